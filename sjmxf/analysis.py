@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+""" Essence frame sizes and bitrate analysis. """
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from sjmxf.s377m import MXFDataSet, S377MException
+from sjmxf.essence import EssenceReader, decode_element_key
+from sjmxf.indexer import RANDOM_ACCESS
+
+# SMPTE 379M: Generic Container picture item types
+PICTURE_ITEM_TYPES = (0x05, 0x15)
+
+# SMPTE 377M: Index Entry prediction flags (bits 5 and 4) to picture types
+PICTURE_TYPES = 'IBPB'
+
+
+class FrameSizeProfile(object):
+    """ Element sizes per edit unit of essence tracks, payloads are never read.
+
+    Indexed essence gets edit unit sizes from its index entries, element
+    sizes are derived from the layout of the first edit unit: elements of
+    constant size and one picture element, or a single element, filling
+    the rest of the edit unit. The layout is checked against @checks edit
+    units spread over the essence, the body is walked otherwise.
+
+    @mxf: parser that went through read().
+    @edit_rate: edit units per second, from index or header metadata by
+    default.
+    """
+
+    def __init__(self, mxf, edit_rate=None, checks=16):
+        if numpy is None:
+            raise ImportError('NumPy is needed to analyse frame sizes')
+
+        self.mxf = mxf
+        self.edit_rate = edit_rate
+        self.checks = checks
+
+        # Track number: element value lengths per edit unit
+        self.sizes = {}
+        # Index Entry flags per edit unit, None unless VBR indexed
+        self.flags = None
+        # 'index' or 'walk'
+        self.source = None
+
+    def collect(self):
+        """ Collect element sizes of each track.
+
+        @returns: the dictionary of size arrays by track number.
+        """
+
+        reader = EssenceReader(self.mxf)
+        try:
+            if self._from_index(reader):
+                self.source = 'index'
+            else:
+                self._from_walk(reader)
+                self.source = 'walk'
+        finally:
+            reader.close()
+
+        if self.edit_rate is None:
+            self.edit_rate = self._edit_rate()
+        return self.sizes
+
+    def _edit_rate(self):
+        for segment in self.mxf.data['index']:
+            if segment.data.get('index_edit_rate'):
+                return segment.data['index_edit_rate']
+
+        for name in ('sample_rate', 'timeline_rate'):
+            for klv in self.mxf.data['header']['klvs']:
+                if isinstance(klv, MXFDataSet) and klv.get_element(name) is not None:
+                    return klv.get_element(name).read()
+
+        raise S377MException('No edit rate found, set it explicitly')
+
+    def _layout(self, reader, edit_unit):
+        """ Returns (track number, KLV header size, length) of elements of @edit_unit. """
+
+        start = self.mxf.edit_unit_position(edit_unit)
+        try:
+            end = self.mxf.edit_unit_position(edit_unit + 1)
+        except S377MException:
+            end = None
+
+        return [(decode_element_key(key)['track_number'], value_pos - pos, length)
+            for key, pos, value_pos, length in reader.elements(start, end)]
+
+    def _from_index(self, reader):
+        """ Derive element sizes from index entries, False if not possible. """
+
+        if not self.mxf.data['index']:
+            return False
+
+        index_sid = self.mxf.data['index'][0].data.get('index_sid')
+        body_sid = self.mxf.data['index'][0].data.get('body_sid')
+        count = self.mxf.edit_unit_count(index_sid)
+        if not count:
+            return False
+
+        # Stream offset of each edit unit and of the end of the container
+        offsets = numpy.empty(count + 1, numpy.int64)
+        offsets.fill(-1)
+        flags = None
+        for segment in self.mxf.data['index']:
+            if segment.data.get('index_sid') != index_sid:
+                continue
+
+            start = segment.data.get('index_start_position', 0)
+            edit_unit_byte_count = segment.data.get('edit_unit_byte_count')
+            if edit_unit_byte_count:
+                duration = segment.data.get('index_duration') or count - start
+                offsets[start:start + duration] = numpy.arange(start, start + duration, dtype=numpy.int64) * edit_unit_byte_count
+            else:
+                entries = segment.data['index_entries']
+                if flags is None:
+                    flags = numpy.zeros(count, numpy.uint8)
+                offsets[start:start + len(entries)] = [entry[3] for entry in entries]
+                flags[start:start + len(entries)] = [entry[2] for entry in entries]
+
+        offsets[count] = max([0] + [entry['body_offset'] + entry['length']
+            for entry in self.mxf.data['essence'] if entry['body_sid'] == body_sid])
+        if (offsets < 0).any():
+            return False
+        edit_unit_sizes = numpy.diff(offsets)
+
+        layout = self._layout(reader, 0)
+        pictures = [item for item in layout if item[0] >> 24 in PICTURE_ITEM_TYPES]
+        if len(layout) == 1:
+            variable = layout[0]
+        elif len(pictures) == 1:
+            variable = pictures[0]
+        else:
+            return False
+
+        # Bytes of other elements and fill, constant across edit units
+        other = edit_unit_sizes[0] - variable[1] - variable[2]
+        sizes = {}
+        for track_number, _, length in layout:
+            if track_number == variable[0]:
+                sizes[track_number] = edit_unit_sizes - other - variable[1]
+            else:
+                sizes[track_number] = numpy.empty(count, numpy.int64)
+                sizes[track_number].fill(length)
+
+        for edit_unit in numpy.unique(numpy.linspace(0, count - 1, self.checks).astype(int)):
+            layout = self._layout(reader, int(edit_unit))
+            if sorted([(track_number, length) for track_number, _, length in layout]) != \
+                sorted([(track_number, sizes[track_number][edit_unit]) for track_number in sizes]):
+                if self.mxf.diagnostics:
+                    self.mxf.diagnostics.emit('info', 'Edit unit %d does not match index layout, walking body' % edit_unit)
+                return False
+
+        self.sizes = sizes
+        self.flags = flags
+        return True
+
+    def _from_walk(self, reader):
+        lengths = {}
+        for key, _, _, length in reader.elements():
+            lengths.setdefault(decode_element_key(key)['track_number'], []).append(length)
+
+        self.sizes = dict([(track_number, numpy.array(items, numpy.int64)) for track_number, items in lengths.items()])
+        self.flags = None
+
+    def track(self, track_number=None):
+        """ Returns the sizes of @track_number, the first picture track by default.
+
+        Tracks without any element raise S377MException.
+        """
+
+        if not self.sizes:
+            self.collect()
+
+        if track_number is None:
+            tracks = sorted(self.sizes.keys())
+            if not tracks:
+                raise S377MException('No essence track')
+            pictures = [item for item in tracks if item >> 24 in PICTURE_ITEM_TYPES]
+            track_number = (pictures or tracks)[0]
+
+        # Statistics are not defined without elements
+        if track_number not in self.sizes or not len(self.sizes[track_number]):
+            raise S377MException('No essence for track %08x' % track_number)
+        return self.sizes[track_number]
+
+    def bitrate(self, track_number=None, window=None):
+        """ Bits per second over sliding windows of @window edit units, one second by default. """
+
+        sizes = self.track(track_number)
+        rate = float(self.edit_rate[0]) / self.edit_rate[1]
+        if window is None:
+            window = max(1, int(round(rate)))
+        window = max(1, min(window, len(sizes)))
+
+        sums = numpy.zeros(len(sizes) + 1, numpy.int64)
+        numpy.cumsum(sizes, out=sums[1:])
+        return (sums[window:] - sums[:-window]) * 8.0 * rate / window
+
+    def statistics(self, track_number=None, percentiles=(1, 5, 50, 95, 99)):
+        """ Size and one second bitrate statistics of @track_number. """
+
+        sizes = self.track(track_number)
+        bitrate = self.bitrate(track_number)
+        return {
+            'count': len(sizes),
+            'min': int(sizes.min()),
+            'max': int(sizes.max()),
+            'mean': float(sizes.mean()),
+            'std': float(sizes.std()),
+            'percentiles': dict(zip(percentiles, numpy.percentile(sizes, percentiles).tolist())),
+            'bitrate_mean': float(sizes.sum()) * 8 * self.edit_rate[0] / self.edit_rate[1] / len(sizes),
+            'bitrate_max': float(bitrate.max()),
+        }
+
+    def picture_types(self):
+        """ Returns the picture type letters of edit units from index flags, None if unknown. """
+
+        if self.flags is None:
+            return None
+        return numpy.array(list(PICTURE_TYPES))[(self.flags >> 4) & 3].tostring()
+
+    def gops(self):
+        """ Returns the lengths of GOPs from index flags random access points, None if unknown. """
+
+        if self.flags is None:
+            return None
+        keys = numpy.flatnonzero(self.flags & RANDOM_ACCESS)
+        return numpy.diff(numpy.append(keys, len(self.flags)))
+
+    def outliers(self, track_number=None, threshold=5.0):
+        """ Edit units whose size is away from the median of their picture type.
+
+        Sizes further than @threshold scaled median absolute deviations are
+        reported, any difference when the deviation is null.
+
+        @returns: the sorted array of edit units.
+        """
+
+        sizes = self.track(track_number)
+        if self.flags is not None and len(self.flags) == len(sizes):
+            groups = (self.flags >> 4) & 3
+        else:
+            groups = numpy.zeros(len(sizes), numpy.uint8)
+
+        ret = []
+        for group in numpy.unique(groups):
+            edit_units = numpy.flatnonzero(groups == group)
+            values = sizes[edit_units]
+            deviation = numpy.abs(values - numpy.median(values))
+            scale = 1.4826 * numpy.median(deviation)
+            if scale:
+                ret.append(edit_units[deviation > threshold * scale])
+            else:
+                ret.append(edit_units[deviation > 0])
+
+        return numpy.sort(numpy.concatenate(ret))
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+""" PCM sound essence decoding into NumPy arrays. """
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from sjmxf.s377m import MXFDataSet, S377MException
+from sjmxf.essence import EssenceReader, decode_element_key
+
+# Sound descriptors giving the PCM layout
+SOUND_DESCRIPTORS = ('WaveAudioDescriptor', 'AES3PCMDescriptor', 'GenericSoundEssenceDescriptor')
+
+# SMPTE 379M: Generic Container sound item type, CP sound items (0x06)
+# being SMPTE 331M AES3 elements
+SOUND_ITEM_TYPE = 0x16
+
+# SMPTE 382M: BWF and AES3 element types, frame and clip wrapped
+PCM_ELEMENT_TYPES = (0x01, 0x02, 0x03, 0x04)
+
+
+def pcm_decode(data, channels, block_align):
+    """ Decode little endian PCM @data into a (samples, channels) array.
+
+    Samples of 2 and 4 bytes are viewed in place, 3 bytes samples are
+    widened to 32 bits integers keeping their value and 8 bits samples,
+    unsigned, are centered on 0 in 16 bits integers. Trailing bytes of an
+    incomplete block are ignored.
+    """
+
+    if numpy is None:
+        raise ImportError('NumPy is needed to decode sound essence')
+
+    width, remainder = divmod(block_align, channels)
+    if remainder or not 0 < width <= 4:
+        raise S377MException('Unsupported PCM layout: %d channels in %d bytes blocks' % (channels, block_align))
+
+    count = len(data) // block_align * channels
+    if not count:
+        return numpy.zeros((0, channels), ('<i2', '<i2', '<i4', '<i4')[width - 1])
+    elif width == 1:
+        samples = numpy.frombuffer(data, numpy.uint8, count).astype(numpy.int16) - 128
+    elif width == 3:
+        raw = numpy.frombuffer(data, numpy.uint8, 3 * count).reshape(count, 3)
+        # Left justified in 32 bits words then shifted back, sign extended
+        samples = numpy.zeros((count, 4), numpy.uint8)
+        samples[:, 1:] = raw
+        samples = samples.view('<i4').reshape(count) >> 8
+    else:
+        samples = numpy.frombuffer(data, '<i%d' % width, count)
+
+    return samples.reshape(count // channels, channels)
+
+
+def is_pcm_track(track_number):
+    """ Whether elements of @track_number are Generic Container BWF or AES3 PCM sound. """
+    return track_number >> 24 == SOUND_ITEM_TYPE and (track_number >> 8) & 0xff in PCM_ELEMENT_TYPES
+
+
+class PCMReader(object):
+    """ Frame wrapped PCM sound track reader.
+
+    The track layout is read from the sound descriptor of its File Package
+    track: bits per sample, channel count and block align. Only element keys
+    and lengths are read to build a table of samples per element, samples
+    are decoded by NumPy from the file memory map.
+
+    @mxf: parser that went through read().
+    @track_number: sound track to read, the first one found by default.
+    """
+
+    def __init__(self, mxf, track_number=None):
+        if numpy is None:
+            raise ImportError('NumPy is needed to decode sound essence')
+
+        if track_number is not None and not is_pcm_track(track_number):
+            raise S377MException('Track %08x is not a PCM sound track' % track_number)
+
+        self.mxf = mxf
+        self.essence = EssenceReader(mxf)
+
+        if track_number is None:
+            tracks = [item for item in self.essence.tracks() if is_pcm_track(item)]
+            if not tracks:
+                raise S377MException('No PCM sound track in essence')
+            track_number = tracks[0]
+        self.track_number = track_number
+
+        descriptor = self.descriptor()
+        self.channels = descriptor.get_element('channel_count').read()
+        self.bits = descriptor.get_element('bits_per_audio_sample').read()
+        self.sample_rate = descriptor.get_element('audio_sample_rate').read()
+        if descriptor.get_element('block_align') is not None:
+            self.block_align = descriptor.get_element('block_align').read()
+        else:
+            self.block_align = self.channels * ((self.bits + 7) // 8)
+
+        # Element value positions and first sample of each element, see _table()
+        self._positions = None
+        self._starts = None
+
+    def descriptor(self):
+        """ Returns the sound descriptor of the track. """
+
+        sets = [klv for klv in self.mxf.data['header']['klvs'] if isinstance(klv, MXFDataSet)]
+        track_ids = [klv.get_element('track_id').read() for klv in sets
+            if klv.get_element('track_number') is not None and klv.get_element('track_number').read() == self.track_number]
+
+        descriptors = [klv for klv in sets if klv.set_type in SOUND_DESCRIPTORS]
+        for descriptor in descriptors:
+            if descriptor.get_element('essence_track_id') is None:
+                continue
+            if descriptor.get_element('essence_track_id').read() in track_ids:
+                return descriptor
+
+        # Single sound descriptor not linked to its track
+        if len(descriptors) == 1:
+            return descriptors[0]
+        raise S377MException('No sound descriptor for track %08x' % self.track_number)
+
+    def close(self):
+        self.essence.close()
+
+    def _table(self):
+        """ Build element value positions and first samples of the track. """
+
+        if self._positions is not None:
+            return
+
+        positions = []
+        counts = []
+        for key, _, value_pos, length in self.essence.elements():
+            if decode_element_key(key)['track_number'] == self.track_number:
+                positions.append(value_pos)
+                counts.append(length // self.block_align)
+
+        self._positions = numpy.array(positions, numpy.int64)
+        self._starts = numpy.zeros(len(counts) + 1, numpy.int64)
+        numpy.cumsum(counts, out=self._starts[1:])
+
+    def __len__(self):
+        """ Number of samples of the track. """
+
+        self._table()
+        return int(self._starts[-1])
+
+    def _element(self, idx, first=0, last=None):
+        """ Returns samples @first to @last excluded of element @idx. """
+
+        count = int(self._starts[idx + 1] - self._starts[idx])
+        if last is None or last > count:
+            last = count
+        payload = self.essence._payload(int(self._positions[idx]) + first * self.block_align,
+            (last - first) * self.block_align)
+        return pcm_decode(payload, self.channels, self.block_align)
+
+    def samples(self, start=0, stop=None):
+        """ Returns samples @start to @stop excluded as a (samples, channels) array.
+
+        Ranges held in one element are views on the file memory map, valid
+        until the reader is closed, others are copies.
+        """
+
+        self._table()
+        total = int(self._starts[-1])
+        if stop is None or stop > total:
+            stop = total
+        if start >= stop:
+            return pcm_decode('', self.channels, self.block_align)
+
+        first = int(numpy.searchsorted(self._starts, start, 'right')) - 1
+        last = int(numpy.searchsorted(self._starts, stop, 'left')) - 1
+        chunks = []
+        for idx in range(first, last + 1):
+            base = int(self._starts[idx])
+            chunks.append(self._element(idx, max(start - base, 0), stop - base))
+
+        if len(chunks) == 1:
+            return chunks[0]
+        return numpy.concatenate(chunks)
+
+    def blocks(self, block_size=48000, start=0, stop=None):
+        """ Iterate over samples @start to @stop excluded by blocks of @block_size samples.
+
+        Only elements covering a block are decoded, memory use is bounded by
+        the block size whatever the track duration. The last block may be
+        shorter.
+
+        @returns: a generator of (first sample, array) tuples.
+        """
+
+        self._table()
+        total = int(self._starts[-1])
+        if stop is None or stop > total:
+            stop = total
+
+        pos = start
+        while pos < stop:
+            block = self.samples(pos, min(pos + block_size, stop))
+            yield pos, block
+            pos += len(block)
+
+    def levels(self, block_size=48000, start=0, stop=None):
+        """ Peak and RMS levels of each channel per block of @block_size samples.
+
+        Levels are relative to the full scale of the track bits per sample.
+
+        @returns: a tuple of (blocks, channels) peak and RMS arrays.
+        """
+
+        scale = float(1 << (self.bits - 1))
+        peaks = []
+        rms = []
+        for _, block in self.blocks(block_size, start, stop):
+            values = block.astype(numpy.float64)
+            peaks.append(numpy.abs(values).max(axis=0) / scale)
+            rms.append(numpy.sqrt((values * values).mean(axis=0)) / scale)
+
+        if not peaks:
+            empty = numpy.zeros((0, self.channels))
+            return empty, empty
+        return numpy.array(peaks), numpy.array(rms)
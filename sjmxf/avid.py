@@ -2,14 +2,19 @@
 
 """ Implements basic classes to parse Avid specific MXF objects. """
 
+import struct
+
 from sjmxf.common import InterchangeObject, Singleton
 from sjmxf.s377m import MXFDataSet, MXFPrimer
 from sjmxf.rp210 import RP210Avid, RP210
-from sjmxf.rp210types import Reference, Integer
 
 class AvidObjectDirectory(InterchangeObject):
     """ Avid ObjectDirectory parser. """
 
+    # Entries count and size, entries key, offset and flag
+    _header = struct.Struct('>QB')
+    _entry = struct.Struct('>16sQB')
+
     def __init__(self, fdesc, debug=False):
         InterchangeObject.__init__(self, fdesc, debug)
         self.data = []
@@ -24,33 +29,25 @@ class AvidObjectDirectory(InterchangeObject):
 
         data = self.fdesc.read(self.length)
 
-        od_list_size = Integer(data[0:8], 'UInt64').read()
-        od_item_size = Integer(data[8], 'UInt8').read()
-        idx = 9
+        if len(data) < self._header.size:
+            raise Exception('Truncated Avid ObjectDirectory')
+        od_list_size, od_item_size = self._header.unpack_from(data)
 
-        self.data = []
-        while od_list_size > len(self.data):
-            self.data.append((
-                Reference(data[idx:idx+16]).read(),            # key
-                Integer(data[idx+16:idx+24], 'UInt64').read(), # offset
-                Integer(data[idx+24], 'UInt8').read(),         # flag
-            ))
-            idx += od_item_size
+        # Entries possibly padded
+        end = self._header.size + od_list_size * od_item_size
+        if od_item_size < self._entry.size or len(data) < end:
+            raise Exception('Truncated Avid ObjectDirectory')
+
+        unpack_from = self._entry.unpack_from
+        self.data = [unpack_from(data, idx) for idx in xrange(self._header.size, end, od_item_size)]
 
         if self.debug:
             print "%d objects of %d bytes size in Object Directory" % (od_list_size, od_item_size)
 
     def write(self):
 
-        ret = []
-        for key, offset, flag in self.data:
-            ret.append(Reference(key).write())
-            ret.append(Integer(offset, 'UInt64').write())
-            ret.append(Integer(flag, 'UInt8').write())
-
-        ret = Integer(len(self.data), 'UInt64').write() \
-            + Integer(len(''.join(ret[0:3])), 'UInt8').write() \
-            + ''.join(ret)
+        pack = self._entry.pack
+        ret = self._header.pack(len(self.data), self._entry.size) + ''.join([pack(*item) for item in self.data])
 
         self.pos = self.fdesc.tell()
         self.length = len(ret)
@@ -76,10 +73,10 @@ class AvidAAFDefinition(MXFDataSet):
         '001b': ('StrongReference', 'Unkown data 1', ''),
     }
 
-    def __init__(self, fdesc, primer, debug=False):
+    def __init__(self, fdesc, primer, debug=False, elements=None):
         # Prepare object specific Primer
-        aprim = MXFPrimer.customize(primer, Singleton(RP210, 'AvidAAFDefinition'), self._extra_mappings)
-        MXFDataSet.__init__(self, fdesc, aprim, debug=debug, dark=True)
+        aprim = MXFPrimer.customize(primer, Singleton(RP210), self._extra_mappings)
+        MXFDataSet.__init__(self, fdesc, aprim, debug=debug, dark=True, elements=elements)
         self.set_type = 'AvidAAFDefinition'
 
 
@@ -93,9 +90,9 @@ class AvidMetadataPreface(MXFDataSet):
         '0004': ('UInt32', 'Audio Channels', 'Number of audio channels in source file'),
     }
 
-    def __init__(self, fdesc, primer, debug=False):
-        aprim = MXFPrimer.customize(primer, Singleton(RP210, 'AvidMetadataPreface'), self._extra_mappings)
-        MXFDataSet.__init__(self, fdesc, aprim, debug=debug, dark=True)
+    def __init__(self, fdesc, primer, debug=False, elements=None):
+        aprim = MXFPrimer.customize(primer, Singleton(RP210), self._extra_mappings)
+        MXFDataSet.__init__(self, fdesc, aprim, debug=debug, dark=True, elements=elements)
         self.set_type = 'AvidMetadataPreface'
 
 
@@ -107,9 +104,9 @@ class AvidMXFDataSet(MXFDataSet):
         '3c03': ('AvidVersion', 'Avid Version Tag', ''),
     }
 
-    def __init__(self, fdesc, primer, debug=False):
+    def __init__(self, fdesc, primer, debug=False, elements=None):
         aprim = MXFPrimer.customize(primer, Singleton(RP210Avid), self._extra_mappings)
-        MXFDataSet.__init__(self, fdesc, aprim, debug=debug, dark=True)
+        MXFDataSet.__init__(self, fdesc, aprim, debug=debug, dark=True, elements=elements)
         self.set_type = 'Avid' + self.set_type
 
 
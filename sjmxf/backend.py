@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+
+""" Byte range I/O backends and block cache for remote or local MXF files. """
+
+import os
+import mmap
+import httplib
+import urlparse
+import threading
+
+from sjmxf.common import OrderedDict
+
+
+class Backend(object):
+    """ Random access byte range reader.
+
+    Backends are thread safe, count the requests they make and the bytes
+    they return. Subclasses implement size() and read_range(), passing the
+    data they read through _account().
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+
+    def size(self):
+        """ Returns the size of the resource. """
+        raise Exception('To be implemented in derived class')
+
+    def read_range(self, offset, length):
+        """ Returns up to @length bytes at @offset, less at the end of the resource. """
+        raise Exception('To be implemented in derived class')
+
+    def _account(self, data):
+        self._lock.acquire()
+        try:
+            self.requests += 1
+            self.bytes_read += len(data)
+        finally:
+            self._lock.release()
+        return data
+
+    def close(self):
+        pass
+
+
+class LocalBackend(Backend):
+    """ Local file read through a file object. """
+
+    def __init__(self, filename):
+        Backend.__init__(self, filename)
+        self.fdesc = open(filename, 'rb')
+        self._io_lock = threading.Lock()
+
+    def size(self):
+        return os.fstat(self.fdesc.fileno()).st_size
+
+    def read_range(self, offset, length):
+        self._io_lock.acquire()
+        try:
+            self.fdesc.seek(offset)
+            data = self.fdesc.read(length)
+        finally:
+            self._io_lock.release()
+        return self._account(data)
+
+    def close(self):
+        self.fdesc.close()
+
+
+class MmapBackend(Backend):
+    """ Local file read through a memory map. """
+
+    def __init__(self, filename):
+        Backend.__init__(self, filename)
+        fdesc = open(filename, 'rb')
+        try:
+            self.map = mmap.mmap(fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fdesc.close()
+
+    def size(self):
+        return len(self.map)
+
+    def read_range(self, offset, length):
+        return self._account(self.map[offset:offset + length])
+
+    def close(self):
+        self.map.close()
+
+
+class HTTPBackend(Backend):
+    """ Resource read with HTTP range requests.
+
+    Each thread keeps its own persistent connection to the server, all of
+    them being closed by close().
+    """
+
+    def __init__(self, url, timeout=30):
+        Backend.__init__(self, url)
+        self.url = urlparse.urlsplit(url)
+        if self.url.scheme not in ('http', 'https'):
+            raise ValueError('Not an HTTP URL: %s' % url)
+        self.path = self.url.path or '/'
+        if self.url.query:
+            self.path += '?' + self.url.query
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections = []
+        self._size = None
+
+    def _request(self, method, headers):
+        """ Returns the status, headers and body of a request, retried once on a new connection. """
+
+        for retry in (True, False):
+            connection = getattr(self._local, 'connection', None)
+            if connection is None:
+                if self.url.scheme == 'https':
+                    connection = httplib.HTTPSConnection(self.url.netloc, timeout=self.timeout)
+                else:
+                    connection = httplib.HTTPConnection(self.url.netloc, timeout=self.timeout)
+                self._local.connection = connection
+                self._lock.acquire()
+                try:
+                    self._connections.append(connection)
+                finally:
+                    self._lock.release()
+
+            try:
+                connection.request(method, self.path, headers=headers)
+                response = connection.getresponse()
+                return response.status, response, response.read()
+            except (httplib.HTTPException, IOError):
+                connection.close()
+                self._local.connection = None
+                if not retry:
+                    raise
+
+    def size(self):
+        if self._size is None:
+            status, response, _ = self._request('HEAD', {})
+            if status != 200:
+                raise IOError('HTTP %d on HEAD %s' % (status, self.name))
+            self._size = int(response.getheader('content-length'))
+        return self._size
+
+    def read_range(self, offset, length):
+        if length <= 0:
+            return ''
+
+        status, response, data = self._request('GET', {'Range': 'bytes=%d-%d' % (offset, offset + length - 1)})
+        if status == 416:
+            # Range past the end of the resource
+            data = ''
+        elif status == 200:
+            # Range ignored, do not download whole resources for every read
+            raise IOError('HTTP 200 on GET %s: Range ignored' % self.name)
+        elif status != 206:
+            raise IOError('HTTP %d on GET %s' % (status, self.name))
+        return self._account(data)
+
+    def close(self):
+        # Connections of read-ahead threads too
+        self._lock.acquire()
+        try:
+            connections, self._connections = self._connections, []
+        finally:
+            self._lock.release()
+        for connection in connections:
+            connection.close()
+        self._local = threading.local()
+
+
+class BlockCache(object):
+    """ Aligned block cache on top of a Backend.
+
+    Reads are rounded to @block_size aligned blocks, kept in a least
+    recently used cache of @capacity blocks. Consecutive missing blocks of
+    a read are fetched with one request, so that key peeks and small sets
+    reads end up in a few large range requests. Reads larger than the
+    cache go straight to the backend.
+    """
+
+    def __init__(self, backend, block_size=256 * 1024, capacity=256):
+        self.backend = backend
+        self.block_size = block_size
+        self.capacity = capacity
+        self.blocks = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def size(self):
+        if self._size is None:
+            self._size = self.backend.size()
+        return self._size
+
+    def _store(self, first, data):
+        """ Cache blocks of @data starting at block @first. """
+
+        self._lock.acquire()
+        try:
+            for idx in range(0, (len(data) + self.block_size - 1) // self.block_size):
+                self.blocks.pop(first + idx, None)
+                self.blocks[first + idx] = data[idx * self.block_size:(idx + 1) * self.block_size]
+            while len(self.blocks) > self.capacity:
+                self.blocks.popitem(last=False)
+        finally:
+            self._lock.release()
+
+    def _fetch(self, first, last):
+        """ Fetch blocks @first to @last included with one request. """
+
+        self._store(first, self.backend.read_range(first * self.block_size, (last - first + 1) * self.block_size))
+
+    def read(self, offset, length):
+        """ Returns up to @length bytes at @offset. """
+
+        length = max(0, min(length, self.size() - offset))
+        if not length:
+            return ''
+
+        first = offset // self.block_size
+        last = (offset + length - 1) // self.block_size
+        if last - first + 1 > self.capacity:
+            return self.backend.read_range(offset, length)
+
+        # Cached blocks and runs of consecutive missing ones
+        blocks = {}
+        runs = []
+        self._lock.acquire()
+        try:
+            for idx in range(first, last + 1):
+                if idx in self.blocks:
+                    self.hits += 1
+                    # Most recently used last
+                    blocks[idx] = self.blocks[idx] = self.blocks.pop(idx)
+                    continue
+                self.misses += 1
+                if runs and runs[-1][1] == idx - 1:
+                    runs[-1][1] = idx
+                else:
+                    runs.append([idx, idx])
+        finally:
+            self._lock.release()
+
+        for run_first, run_last in runs:
+            data = self.backend.read_range(run_first * self.block_size, (run_last - run_first + 1) * self.block_size)
+            self._store(run_first, data)
+            for idx in range(run_first, run_last + 1):
+                blocks[idx] = data[(idx - run_first) * self.block_size:(idx - run_first + 1) * self.block_size]
+
+        data = ''.join([blocks[idx] for idx in range(first, last + 1)])
+        start = offset - first * self.block_size
+        return data[start:start + length]
+
+    def prefetch(self, head=1024 * 1024, tail=1024 * 1024):
+        """ Fetch the first @head and last @tail bytes in parallel.
+
+        Header partition and header metadata, footer partition and Random
+        Index Pack are then read from the cache.
+        """
+
+        size = self.size()
+        last = (size - 1) // self.block_size
+        ranges = [(0, min(last, max(0, (head - 1) // self.block_size)))]
+        first = max(0, (size - tail) // self.block_size)
+        if first > ranges[0][1]:
+            ranges.append((first, last))
+        else:
+            ranges = [(0, last)]
+
+        errors = []
+        def fetch(first, last):
+            try:
+                self._fetch(first, last)
+            except (IOError, httplib.HTTPException), error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=fetch, args=item) for item in ranges]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def open(self):
+        """ Returns a new file like object reading through the cache. """
+        return CachedFile(self)
+
+    def stats(self):
+        return {
+            'blocks': len(self.blocks),
+            'hits': self.hits,
+            'misses': self.misses,
+            'requests': self.backend.requests,
+            'bytes_read': self.backend.bytes_read,
+        }
+
+    def close(self):
+        self.blocks = OrderedDict()
+        self.backend.close()
+
+
+class CachedFile(object):
+    """ Read only file like object on a BlockCache, with its own cursor. """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.name = cache.name
+        self.pos = 0
+        self.closed = False
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self.cache.size() - self.pos
+        data = self.cache.read(self.pos, size)
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            self.pos += offset
+        elif whence == 2:
+            self.pos = self.cache.size() + offset
+        else:
+            self.pos = offset
+
+    def tell(self):
+        return self.pos
+
+    def reopen(self):
+        """ Returns a new file on the same cache, e.g. once closed. """
+        return CachedFile(self.cache)
+
+    def close(self):
+        self.closed = True
+
+
+def open_backend(location, block_size=256 * 1024, capacity=256, prefetch=True):
+    """ Returns a BlockCache reading @location, an HTTP URL or a local file.
+
+    @prefetch: fetch the file head and tail in parallel.
+    """
+
+    if location.startswith('http://') or location.startswith('https://'):
+        backend = HTTPBackend(location)
+    else:
+        try:
+            backend = MmapBackend(location)
+        except (mmap.error, ValueError):
+            # Empty or unmappable file
+            backend = LocalBackend(location)
+
+    cache = BlockCache(backend, block_size, capacity)
+    if prefetch:
+        cache.prefetch()
+    return cache
@@ -3,6 +3,10 @@
 
 """ Helper module with utility classes for MXF parsing. """
 
+import os
+import errno
+import threading
+
 class InterchangeObject(object):
     """ Base class for all MXF objects.
 
@@ -22,12 +26,18 @@ class InterchangeObject(object):
 
         self.fdesc = fdesc
         self.pos = fdesc.tell()
-        self.key, self.length, self.bytes_num = \
+        key, self.length, self.bytes_num = \
             InterchangeObject.get_key_length(fdesc, decoded=False)
+        self.key = UL(key)
 
         # Set cursor to the begining of the actual data
         self.fdesc.seek(16 + self.bytes_num, 1)
 
+        # Parsing statistics, see sjmxf.profiling
+        instrument = getattr(fdesc, 'instrument', None)
+        if instrument:
+            instrument(self)
+
     @staticmethod
     def get_key_length(fdesc, decoded=True):
         """ Get the Key and Length for this KLV. """
@@ -45,6 +55,37 @@ class InterchangeObject(object):
         """ Get the Key for this KLV."""
         return InterchangeObject.get_key_length(fdesc, decoded)[0]
 
+    @staticmethod
+    def iter_klvs(fdesc, start, end):
+        """ Walk KLVs located between @start and @end without loading values.
+
+        Only KLVs fully contained in the range are considered, walk stops on
+        the first truncated one.
+
+        @returns: a generator of (key, pos, length, bytes_num) tuples, key
+        being in binary form. The cursor is set on the key of the current KLV
+        so that it can be loaded by an InterchangeObject, iteration resumes
+        after its value whatever the cursor position.
+        """
+        pos = start
+        while pos + 17 <= end:
+            fdesc.seek(pos)
+            data = fdesc.read(25)
+            if len(data) < 17:
+                break
+
+            size = ord(data[16])
+            if size & 0x80 and len(data) < 17 + (size & 0x7f):
+                break
+
+            length, bytes_num = InterchangeObject.ber_decode_length_details(data[16:25])
+            if pos + 16 + bytes_num + length > end:
+                break
+
+            fdesc.seek(pos)
+            yield data[0:16], pos, length, bytes_num
+            pos += 16 + bytes_num + length
+
     @staticmethod
     def ber_decode_length_details(size_string, bytes_num=None):
         """ Decode BER encoded length.
@@ -118,13 +159,66 @@ class InterchangeObject(object):
     def __str__(self):
         return '<InterchangeObject "if you see this, it is a bug">'
 
+################################################################################
+### Universal Labels
+################################################################################
+
+class UL(str):
+    """ Binary Universal Label, UUID or other KLV key.
+
+    Identical labels are interned: building an UL returns the instance
+    already built for the same bytes, so that keys, Primer format labels and
+    references found thousands of times in a file are kept once. Weak
+    references to str subclasses are not supported, the interning table is
+    cleared when it reaches MAX_INTERNED labels instead.
+
+    Hex form is computed once, comparisons are the str ones.
+    """
+
+    MAX_INTERNED = 65536
+
+    _interned = {}
+
+    def __new__(cls, value):
+        try:
+            return cls._interned[value]
+        except KeyError:
+            pass
+
+        if len(cls._interned) >= cls.MAX_INTERNED:
+            cls._interned.clear()
+
+        ret = str.__new__(cls, value)
+        return cls._interned.setdefault(ret, ret)
+
+    @property
+    def hex(self):
+        """ Lower case hex form. """
+
+        try:
+            return self.__dict__['hex']
+        except KeyError:
+            ret = self.__dict__['hex'] = self.encode('hex_codec')
+            return ret
+
+    def matches(self, other):
+        """ Compare with @other label ignoring the SMPTE version byte (8th). """
+        return self[0:7] == other[0:7] and self[8:] == other[8:]
+
+
 ################################################################################
 ### Singleton
 ################################################################################
 
 class Singleton(object):
+    """ Process wide shared instance of a class.
+
+    Instances are created once, even from concurrent threads, and frozen
+    when they provide a freeze method.
+    """
 
     _instance = {}
+    _lock = threading.Lock()
 
     def __init__(self, cls, qualifier=None):
 
@@ -135,8 +229,13 @@ class Singleton(object):
 
         # Check whether we already have an instance
         if not sclass in Singleton._instance:
-            # Create and remember instance
-            Singleton._instance[sclass] = cls()
+            with Singleton._lock:
+                if not sclass in Singleton._instance:
+                    # Create and remember instance
+                    instance = cls()
+                    if hasattr(instance, 'freeze'):
+                        instance.freeze()
+                    Singleton._instance[sclass] = instance
 
         self._sclass = sclass
 
@@ -166,6 +265,208 @@ class Singleton(object):
             return object.__setattr__(self._instance[self._sclass], attribute, value)
 
 
+################################################################################
+### Diagnostics
+################################################################################
+
+class Diagnostic(object):
+    """ Diagnostic event emitted while parsing.
+
+    @level: one of 'debug', 'info', 'warning' or 'error'.
+    @pos: file position the event relates to, if any.
+    """
+
+    def __init__(self, level, message, pos=None, **details):
+        self.level = level
+        self.message = message
+        self.pos = pos
+        self.details = details
+
+    def __str__(self):
+        if self.pos is None:
+            return "%s: %s" % (self.level, self.message)
+        return "%s at %d: %s" % (self.level, self.pos, self.message)
+
+
+class DiagnosticsCollector(list):
+    """ Diagnostics channel subscriber keeping events of given @levels. """
+
+    def __init__(self, levels=('warning', 'error')):
+        list.__init__(self)
+        self.levels = levels
+
+    def __call__(self, diagnostic):
+        if not self.levels or diagnostic.level in self.levels:
+            self.append(diagnostic)
+
+
+def print_diagnostic(diagnostic):
+    """ Diagnostics channel subscriber printing events on standard output. """
+
+    if diagnostic.level == 'debug':
+        print diagnostic.message
+    else:
+        print diagnostic
+
+
+class Diagnostics(object):
+    """ Parsing diagnostics channel.
+
+    Nothing is built nor formatted unless someone subscribed to the channel,
+    emitters check its truth value before calling emit:
+
+        if self.diagnostics:
+            self.diagnostics.emit('warning', 'message', pos)
+    """
+
+    def __init__(self):
+        self.subscribers = []
+
+    def __nonzero__(self):
+        return len(self.subscribers) > 0
+
+    def subscribe(self, callback):
+        """ Call @callback with each emitted Diagnostic. """
+
+        # Compare identities, collectors are lists
+        if not [item for item in self.subscribers if item is callback]:
+            self.subscribers.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        """ Stop calling @callback. """
+
+        self.subscribers = [item for item in self.subscribers if item is not callback]
+
+    def collect(self, levels=('warning', 'error')):
+        """ Subscribe and returns a list collecting events of given @levels. """
+        return self.subscribe(DiagnosticsCollector(levels))
+
+    def emit(self, level, message, pos=None, **details):
+        """ Send a Diagnostic to subscribers. """
+
+        diagnostic = Diagnostic(level, message, pos, **details)
+        for callback in self.subscribers:
+            callback(diagnostic)
+
+
+# Default channel for objects created without a parser
+DIAGNOSTICS = Diagnostics()
+
+
+
+################################################################################
+### Byte range copies
+################################################################################
+
+# Buffered copies chunk size
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def _libc_sendfile():
+    """ Returns a sendfile(out_fd, in_fd, offset, count) wrapper of the C library, None if unavailable. """
+
+    try:
+        import ctypes
+        import ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        function = libc.sendfile64
+    except (ImportError, OSError, AttributeError):
+        return None
+
+    function.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+    function.restype = ctypes.c_ssize_t
+
+    def sendfile(out_fd, in_fd, offset, count):
+        offset = ctypes.c_int64(offset)
+        ret = function(out_fd, in_fd, ctypes.byref(offset), count)
+        if ret < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        return ret
+    return sendfile
+
+
+def _kernel_copies():
+    """ Returns the available (name, function) kernel copies, copying count
+    bytes at offset of in_fd to the current position of out_fd. """
+
+    ret = []
+    if hasattr(os, 'copy_file_range'):
+        ret.append(('copy_file_range', lambda out_fd, in_fd, offset, count: \
+            os.copy_file_range(in_fd, out_fd, count, offset)))
+    if hasattr(os, 'sendfile'):
+        ret.append(('sendfile', os.sendfile))
+    else:
+        sendfile = _libc_sendfile()
+        if sendfile:
+            ret.append(('sendfile', sendfile))
+    return ret
+
+
+KERNEL_COPIES = _kernel_copies()
+
+
+def copy_range(src, dst, offset, length, chunk_size=COPY_CHUNK_SIZE):
+    """ Copy @length bytes at @offset of file @src to the current position of file @dst.
+
+    Data is copied by the kernel with copy_file_range or sendfile when both
+    files are backed by descriptors, falling back to buffered copies of
+    @chunk_size bytes otherwise or on kernel copy failure. The @src cursor is
+    left untouched, the @dst one is moved past the copied bytes.
+
+    @returns: the name of the copy method used last.
+    """
+
+    method = 'buffered'
+    copied = 0
+
+    try:
+        src_fd = src.fileno()
+        dst_fd = dst.fileno()
+    except (AttributeError, IOError, ValueError):
+        src_fd = dst_fd = None
+
+    if src_fd is not None and KERNEL_COPIES:
+        # Descriptor position must match the file object one
+        dst.flush()
+        start = dst.tell()
+        os.lseek(dst_fd, start, os.SEEK_SET)
+
+        for name, function in KERNEL_COPIES:
+            try:
+                while copied < length:
+                    ret = function(dst_fd, src_fd, offset + copied, min(length - copied, 0x7ffff000))
+                    if ret == 0:
+                        # Source shorter than expected
+                        break
+                    copied += ret
+                method = name
+                break
+            except OSError, error:
+                if error.errno not in (errno.EINVAL, errno.ENOSYS, errno.EXDEV, errno.EBADF, errno.ENOTSUP, errno.EOPNOTSUPP):
+                    raise
+        dst.seek(start + copied)
+
+    if copied < length:
+        method = 'buffered'
+        cursor = src.tell()
+        try:
+            src.seek(offset + copied)
+            while copied < length:
+                data = src.read(min(chunk_size, length - copied))
+                if not data:
+                    break
+                dst.write(data)
+                copied += len(data)
+        finally:
+            src.seek(cursor)
+
+    if copied < length:
+        raise IOError('Short copy: %d bytes out of %d at %d' % (copied, length, offset))
+    return method
+
+
 ################################################################################
 ### OrderedDict
 ################################################################################
@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+
+""" Essence access for Generic Container (SMPTE 379M) wrapped MXF files. """
+
+import io
+import os
+import mmap
+import time
+import Queue
+import threading
+
+from sjmxf.common import InterchangeObject
+from sjmxf.s377m import S377MException
+
+# SMPTE 379M: Generic Container item types, byte 13 of element keys
+GC_ITEM_TYPES = {
+    0x04: 'cp_system',
+    0x05: 'cp_picture',
+    0x06: 'cp_sound',
+    0x07: 'cp_data',
+    0x14: 'gc_system',
+    0x15: 'gc_picture',
+    0x16: 'gc_sound',
+    0x17: 'gc_data',
+    0x18: 'gc_compound',
+}
+
+
+def is_element_key(key):
+    """ Tells whether binary @key is a Generic Container element key. """
+    return key[0:4] == '\x06\x0e\x2b\x34' and key[8:12] == '\x0d\x01\x03\x01'
+
+
+def decode_element_key(key):
+    """ Decode Generic Container element binary @key.
+
+    SMPTE 379M: the last 4 bytes of element keys are the item type, element
+    count, element type and element number, also used as TrackNumber of the
+    essence track in the File Package.
+
+    @returns: a dictionary, None if @key is not an element key.
+    """
+
+    if not is_element_key(key):
+        return None
+
+    item_type, count, element_type, number = [ord(char) for char in key[12:16]]
+    return {
+        'item_type': item_type,
+        'item_name': GC_ITEM_TYPES.get(item_type, 'unknown'),
+        'element_count': count,
+        'element_type': element_type,
+        'element_number': number,
+        'track_number': item_type << 24 | count << 16 | element_type << 8 | number,
+    }
+
+
+class EssenceFrame(object):
+    """ Essence element of a track for one edit unit.
+
+    @element: decoded element key, as returned by decode_element_key().
+    @payload: element value, a buffer on file data whose lifetime depends
+    on the reader that returned the frame.
+    """
+
+    __slots__ = ('track_number', 'edit_unit', 'element', 'pos', 'length', 'payload')
+
+    def __init__(self, track_number, edit_unit, element, pos, length, payload):
+        self.track_number = track_number
+        self.edit_unit = edit_unit
+        self.element = element
+        self.pos = pos
+        self.length = length
+        self.payload = payload
+
+    def __str__(self):
+        return "<EssenceFrame track=%08x edit_unit=%d pos=%d size=%d>" % \
+            (self.track_number, self.edit_unit, self.pos, self.length)
+
+
+class EssenceReader(object):
+    """ Frame wrapped essence reader.
+
+    Relies on the partition table, essence map and index table segments of
+    @mxf, a parser that went through read() or poll(). Only KLV keys and
+    lengths are read to locate elements, payloads are never copied out of
+    the file memory map and remain valid until the reader is closed. Each
+    element of a track is one edit unit.
+    """
+
+    def __init__(self, mxf):
+        self.mxf = mxf
+        self.fd = None
+        self.map = None
+        self._counts = None
+
+    def open(self):
+        if self.fd:
+            return
+
+        self.fd = open(self.mxf.filename, 'r')
+        self._remap()
+
+    def close(self):
+        if self.map:
+            self.map.close()
+            self.map = None
+        if self.fd:
+            self.fd.close()
+            self.fd = None
+
+    def _remap(self):
+        """ Map the whole file, again when it grew. """
+
+        if self.map:
+            self.map.close()
+            self.map = None
+
+        self.fd.seek(0, 2)
+        try:
+            self.map = mmap.mmap(self.fd.fileno(), self.fd.tell(), access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError):
+            # Empty or unmappable file, fall back to reads
+            self.map = None
+
+    def _source(self, end):
+        """ Returns a file like object covering positions up to @end. """
+
+        if not self.fd:
+            self.open()
+        if self.map is not None and len(self.map) < end:
+            self._remap()
+        if self.map is not None:
+            return self.map
+        return self.fd
+
+    def _payload(self, pos, length):
+        """ Returns a view on @length bytes at @pos. """
+
+        if self.map is not None:
+            return buffer(self.map, pos, length)
+
+        self.fd.seek(pos)
+        return self.fd.read(length)
+
+    def elements(self, start=None, end=None):
+        """ Walk Generic Container elements of the essence map.
+
+        @start, @end: optional file positions to restrict the walk to.
+
+        @returns: a generator of (key, pos, value position, length) tuples.
+        """
+
+        for entry in self.mxf.data['essence']:
+            first = entry['pos']
+            last = entry['pos'] + entry['length']
+            if start is not None:
+                first = max(first, start)
+            if end is not None:
+                last = min(last, end)
+            if first >= last:
+                continue
+
+            source = self._source(last)
+            for key, pos, length, bytes_num in InterchangeObject.iter_klvs(source, first, last):
+                if is_element_key(key):
+                    yield key, pos, pos + 16 + bytes_num, length
+
+    def edit_unit_counts(self):
+        """ Returns the number of edit units per track number. """
+
+        layout = [(entry['pos'], entry['length']) for entry in self.mxf.data['essence']]
+        if self._counts and self._counts[0] == layout:
+            return dict(self._counts[1])
+
+        counts = {}
+        for key, _, _, _ in self.elements():
+            track_number = decode_element_key(key)['track_number']
+            counts[track_number] = counts.get(track_number, 0) + 1
+
+        self._counts = (layout, counts)
+        return dict(counts)
+
+    def tracks(self):
+        """ Returns the sorted list of track numbers found in essence. """
+
+        tracks = self.edit_unit_counts().keys()
+        tracks.sort()
+        return tracks
+
+    def frames(self, track_number, start=0, stop=None):
+        """ Iterate over @track_number edit units from @start to @stop excluded.
+
+        @returns: a generator of EssenceFrame.
+        """
+
+        edit_unit = 0
+        walk_start = None
+        try:
+            # Skip over previous edit units using the index
+            walk_start = self.mxf.edit_unit_position(start)
+            edit_unit = start
+        except S377MException:
+            pass
+
+        for key, pos, value_pos, length in self.elements(start=walk_start):
+            element = decode_element_key(key)
+            if element['track_number'] != track_number:
+                continue
+
+            if stop is not None and edit_unit >= stop:
+                return
+            if edit_unit >= start:
+                yield EssenceFrame(track_number, edit_unit, element, pos, length, self._payload(value_pos, length))
+            edit_unit += 1
+
+    def frame(self, track_number, edit_unit):
+        """ Returns @track_number element of @edit_unit.
+
+        Indexed files only read the KLV keys of the requested edit unit,
+        others are walked from the first edit unit.
+        """
+
+        try:
+            start = self.mxf.edit_unit_position(edit_unit)
+        except S377MException:
+            start = None
+
+        if start is not None:
+            try:
+                end = self.mxf.edit_unit_position(edit_unit + 1)
+            except S377MException:
+                end = None
+
+            for key, pos, value_pos, length in self.elements(start, end):
+                element = decode_element_key(key)
+                if element['track_number'] == track_number:
+                    return EssenceFrame(track_number, edit_unit, element, pos, length, self._payload(value_pos, length))
+
+        else:
+            for item in self.frames(track_number, edit_unit, edit_unit + 1):
+                return item
+
+        raise S377MException('No edit unit %d for track %08x' % (edit_unit, track_number))
+
+
+class PrefetchingReader(object):
+    """ Sequential essence reader with background read-ahead.
+
+    A producer thread walks the essence map of @mxf with large sequential
+    reads into a pool of @depth reusable buffers of @chunk_size bytes, and
+    splits them into frames the consumer iterates over. Reads are chunk
+    aligned on KLV boundaries, elements larger than a chunk get a dedicated
+    buffer.
+
+    Frame payloads are buffers on pooled memory: they are only valid until
+    the next frame is taken, copy them with str() to keep them.
+
+    @track_numbers: list of track numbers to return frames of, all if None.
+    """
+
+    def __init__(self, mxf, track_numbers=None, depth=4, chunk_size=4 * 1024 * 1024):
+        self.mxf = mxf
+        self.track_numbers = track_numbers
+        self.depth = depth
+        self.chunk_size = chunk_size
+
+        self._pool = Queue.Queue()
+        for _ in range(0, depth):
+            self._pool.put(bytearray(chunk_size))
+        self._chunks = Queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._current = None
+
+        self.counters = {
+            'chunks': 0,
+            'bytes_read': 0,
+            'frames': 0,
+            # Producer waiting for a free buffer: consumer is the bottleneck
+            'producer_waits': 0,
+            'producer_wait_time': 0.0,
+            # Consumer waiting for a chunk: I/O is the bottleneck
+            'consumer_waits': 0,
+            'consumer_wait_time': 0.0,
+        }
+
+    def stats(self):
+        """ Returns read-ahead and back-pressure statistics. """
+
+        ret = dict(self.counters)
+        ret['queued'] = self._chunks.qsize()
+        return ret
+
+    def start(self):
+        if self._thread:
+            return
+
+        self._thread = threading.Thread(target=self._produce, name='sjmxf-prefetch')
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def close(self):
+        """ Stop the producer thread. """
+
+        self._stop.set()
+        if self._thread:
+            while self._thread.isAlive():
+                # Unblock a producer waiting for a free buffer
+                self._release()
+                try:
+                    chunk = self._chunks.get(timeout=0.1)
+                    if isinstance(chunk, tuple) and len(chunk[0]) == self.chunk_size:
+                        self._pool.put(chunk[0])
+                except Queue.Empty:
+                    pass
+            self._thread = None
+
+    def __iter__(self):
+        return self.frames()
+
+    def frames(self):
+        """ Returns a generator of EssenceFrame, in file order. """
+
+        self.start()
+        try:
+            while True:
+                # Previous payloads are no longer valid
+                self._release()
+
+                if self._chunks.empty():
+                    self.counters['consumer_waits'] += 1
+                    begin = time.time()
+                    chunk = self._chunks.get()
+                    self.counters['consumer_wait_time'] += time.time() - begin
+                else:
+                    chunk = self._chunks.get()
+
+                if chunk is None:
+                    return
+                if isinstance(chunk, Exception):
+                    raise chunk
+
+                self._current = chunk[0]
+                for frame in chunk[1]:
+                    self.counters['frames'] += 1
+                    yield frame
+        finally:
+            self._release()
+
+    def _release(self):
+        """ Give back the buffer of the last chunk consumed. """
+
+        if self._current is not None:
+            if len(self._current) == self.chunk_size:
+                self._pool.put(self._current)
+            self._current = None
+
+    def _buffer(self, size):
+        """ Take a buffer from the pool, waiting for the consumer if needed. """
+
+        if size > self.chunk_size:
+            return bytearray(size)
+
+        try:
+            return self._pool.get_nowait()
+        except Queue.Empty:
+            pass
+
+        self.counters['producer_waits'] += 1
+        begin = time.time()
+        try:
+            while not self._stop.isSet():
+                try:
+                    return self._pool.get(timeout=0.1)
+                except Queue.Empty:
+                    pass
+        finally:
+            self.counters['producer_wait_time'] += time.time() - begin
+        return None
+
+    def _produce(self):
+        fdesc = io.open(self.mxf.filename, 'rb', buffering=0)
+        try:
+            try:
+                if hasattr(os, 'posix_fadvise'):
+                    os.posix_fadvise(fdesc.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+                counters = {}
+                for entry in self.mxf.data['essence']:
+                    if not self._produce_range(fdesc, entry['pos'], entry['pos'] + entry['length'], counters):
+                        return
+            except Exception, error:
+                self._chunks.put(error)
+                return
+        finally:
+            fdesc.close()
+
+        self._chunks.put(None)
+
+    def _produce_range(self, fdesc, pos, end, counters):
+        """ Read and split elements between @pos and @end into chunks. """
+
+        size = self.chunk_size
+        while pos < end and not self._stop.isSet():
+            size = min(size, end - pos)
+            data = self._buffer(size)
+            if data is None:
+                return False
+
+            fdesc.seek(pos)
+            read = fdesc.readinto(memoryview(data)[0:size])
+            self.counters['bytes_read'] += read
+
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(fdesc.fileno(), pos + read, self.chunk_size, os.POSIX_FADV_WILLNEED)
+
+            frames = []
+            idx = 0
+            while idx + 17 <= read:
+                ber = data[idx + 16]
+                if ber & 0x80 and idx + 17 + (ber & 0x7f) > read:
+                    break
+
+                key = str(data[idx:idx + 16])
+                length, bytes_num = InterchangeObject.ber_decode_length_details(str(data[idx + 16:idx + 25]))
+                if idx + 16 + bytes_num + length > read:
+                    break
+
+                element = decode_element_key(key)
+                if element and (self.track_numbers is None or element['track_number'] in self.track_numbers):
+                    edit_unit = counters.get(element['track_number'], 0)
+                    frames.append(EssenceFrame(element['track_number'], edit_unit, element, pos + idx, length,
+                        buffer(data, idx + 16 + bytes_num, length)))
+                if element:
+                    counters[element['track_number']] = counters.get(element['track_number'], 0) + 1
+                idx += 16 + bytes_num + length
+
+            if idx == 0:
+                # KLV larger than a chunk, read it in a dedicated buffer
+                if len(data) == self.chunk_size:
+                    self._pool.put(data)
+                if read < 17:
+                    raise S377MException('Truncated essence at %d' % pos)
+                length, bytes_num = InterchangeObject.ber_decode_length_details(str(data[16:min(25, read)]))
+                if 16 + bytes_num + length <= size or pos + 16 + bytes_num + length > end:
+                    raise S377MException('Truncated essence at %d' % pos)
+                size = 16 + bytes_num + length
+                continue
+
+            self.counters['chunks'] += 1
+            self._chunks.put((data, frames))
+            pos += idx
+            size = self.chunk_size
+
+        return not self._stop.isSet()
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+
+""" Header metadata model with a memory budget and structural fingerprints. """
+
+import json
+import struct
+import hashlib
+import threading
+
+from sjmxf.common import InterchangeObject, OrderedDict
+from sjmxf.s377m import S377MException
+from sjmxf.parser import SMPTE_PRIMER_PACK_LABEL, SMPTE_PREFACE_LABEL, SMPTE_KLV_FILL_LABELS
+
+_UINT16 = struct.Struct('>H')
+_UINT32 = struct.Struct('>I')
+
+# Element types left out of set digests
+STRONG_REFERENCE_TYPES = ('StrongReference', 'StrongReferenceArray', 'StrongReferenceBatch')
+POSITION_TYPES = ('AvidOffset',)
+
+
+def instance_uid(value):
+    """ Returns the InstanceUID of local set @value, None if not a local set or missing. """
+
+    ret = None
+    offset = 0
+    size = len(value)
+    unpack = _UINT16.unpack_from
+    while offset + 4 <= size:
+        end = offset + 4 + unpack(value, offset + 2)[0]
+        if value[offset:offset + 2] == '\x3c\x0a' and end - offset == 20:
+            ret = value[offset + 4:end]
+        offset = end
+
+    # Values which are not local sets seldom chain up to their end
+    if offset != size:
+        return None
+    return ret
+
+
+class HeaderModel(object):
+    """ Header metadata sets by InstanceUID, decoded on demand.
+
+    The header metadata is walked once to keep the key, position and
+    length of each set, along with its InstanceUID. Decoded sets are kept in
+    a least recently used cache whose estimated size stays within @budget
+    bytes, evicted sets being read and decoded again from the file when
+    accessed. The Primer Pack, needed to decode sets and kept by the parser,
+    is accounted in the budget too.
+
+    @mxf: parser that went through header_partition_parse(), sets are
+    decoded by its header_klv_decode method.
+    @budget: memory budget of decoded sets, in bytes.
+    """
+
+    # Decoded set size estimate: fixed cost plus a factor of its value length
+    SET_OVERHEAD = 1024
+    VALUE_FACTOR = 8
+
+    def __init__(self, mxf, budget=64 * 1024 * 1024):
+        self.mxf = mxf
+        self.budget = budget
+
+        # InstanceUID: (hex key, position, value length, length bytes), in file order
+        self.index = OrderedDict()
+        self.preface_uid = None
+
+        self.cache = OrderedDict()
+        self.size = 0
+        # Estimated size of the Primer Pack, never evicted
+        self.primer_size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.fdesc = None
+        self._lock = threading.Lock()
+        # (InstanceUID, algorithm): set type, digest and strong references
+        self._digests = {}
+
+    def scan(self):
+        """ Walk header metadata and index its sets.
+
+        @returns: the number of sets indexed.
+        """
+
+        partition = self.mxf.data['header']['partition']
+        if self.fdesc is None:
+            self.fdesc = open(self.mxf.filename, 'rb')
+        fdesc = self.fdesc
+        fdesc.seek(0, 2)
+        size = fdesc.tell()
+
+        self.index = OrderedDict()
+        self._digests = {}
+        self.primer_size = 0
+        self.clear()
+
+        start = partition.pos + 16 + partition.bytes_num + partition.length
+        header_end = None
+        for key, pos, length, bytes_num in InterchangeObject.iter_klvs(fdesc, start, size):
+            ekey = key.encode('hex_codec')
+            if header_end is None:
+                # SMPTE 377M: KLV fill behind Header Partition is not counted in HeaderByteCount
+                if ekey in SMPTE_KLV_FILL_LABELS:
+                    continue
+                header_end = pos + partition.data['header_byte_count']
+            if pos >= header_end:
+                break
+
+            if ekey in SMPTE_KLV_FILL_LABELS:
+                continue
+
+            if ekey == SMPTE_PRIMER_PACK_LABEL:
+                # Decoding sets needs the Primer Pack
+                fdesc.seek(pos)
+                self.mxf.header_klv_decode(fdesc, ekey)
+                self.primer_size = self.SET_OVERHEAD + self.VALUE_FACTOR * length
+                self.size += self.primer_size
+                continue
+
+            fdesc.seek(pos + 16 + bytes_num)
+            uid = instance_uid(fdesc.read(length))
+            if uid is None:
+                continue
+
+            self.index[uid] = (ekey, pos, length, bytes_num)
+            if ekey == SMPTE_PREFACE_LABEL:
+                self.preface_uid = uid
+
+        return len(self.index)
+
+    def cost(self, uid):
+        """ Estimated memory use of decoded set @uid. """
+        return self.SET_OVERHEAD + self.VALUE_FACTOR * self.index[uid][2]
+
+    def get(self, uid, default=None):
+        """ Returns decoded set @uid, @default if not in header metadata. """
+
+        if uid not in self.index:
+            return default
+
+        self._lock.acquire()
+        try:
+            if uid in self.cache:
+                self.hits += 1
+                # Most recently used last
+                klv = self.cache.pop(uid)
+                self.cache[uid] = klv
+                return klv
+
+            self.misses += 1
+            key, pos, _, _ = self.index[uid]
+            self.fdesc.seek(pos)
+            # Decoded sets are only referenced by the cache, not by the parser
+            preface = self.mxf.data['header']['preface']
+            klv = self.mxf.header_klv_decode(self.fdesc, key)
+            self.mxf.data['header']['preface'] = preface
+
+            cost = self.cost(uid)
+            while self.cache and self.size + cost > self.budget:
+                evicted, _ = self.cache.popitem(last=False)
+                self.size -= self.cost(evicted)
+                self.evictions += 1
+            self.cache[uid] = klv
+            self.size += cost
+            return klv
+        finally:
+            self._lock.release()
+
+    def __getitem__(self, uid):
+        klv = self.get(uid)
+        if klv is None:
+            raise KeyError(uid)
+        return klv
+
+    def __contains__(self, uid):
+        return uid in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    @property
+    def preface(self):
+        """ Decoded Preface set. """
+
+        if self.preface_uid is None:
+            raise S377MException('No Preface in header metadata')
+        return self[self.preface_uid]
+
+    def sets(self, set_type=None):
+        """ Returns a generator of decoded sets, of @set_type only if set. """
+
+        for uid in self.index.keys():
+            klv = self.get(uid)
+            if set_type is None or klv.set_type == set_type:
+                yield klv
+
+    def stats(self):
+        """ Returns cache counters and usage. """
+
+        return {
+            'sets': len(self.index),
+            'cached': len(self.cache),
+            'size': self.size,
+            'budget': self.budget,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def clear(self):
+        """ Drop decoded sets, counters are kept. """
+
+        self._lock.acquire()
+        try:
+            self.cache = OrderedDict()
+            self.size = self.primer_size
+        finally:
+            self._lock.release()
+
+    def _value(self, uid):
+        """ Returns the raw value of set @uid. """
+
+        _, pos, length, bytes_num = self.index[uid]
+        self._lock.acquire()
+        try:
+            self.fdesc.seek(pos + 16 + bytes_num)
+            return self.fdesc.read(length)
+        finally:
+            self._lock.release()
+
+    def set_digest(self, uid, algorithm='sha256'):
+        """ Digest of set @uid canonical encoding.
+
+        Elements are identified by their Primer format UL, whatever their
+        local tag, and sorted. InstanceUID, strong references and position
+        dependent values are left out, references being accounted for by
+        tree digests.
+
+        @returns: a tuple containing the set type, the hex digest and the
+        list of (format UL, element name, referenced InstanceUIDs, is an
+        array) strong references.
+        """
+
+        try:
+            return self._digests[uid, algorithm]
+        except KeyError:
+            pass
+
+        klv = self.get(uid)
+        value = self._value(uid)
+        key = self.index[uid][0].decode('hex_codec')
+
+        elements = []
+        references = []
+        offset = 0
+        unpack = _UINT16.unpack_from
+        while offset + 4 <= len(value):
+            tag = value[offset:offset + 2]
+            end = offset + 4 + unpack(value, offset + 2)[0]
+            data = value[offset + 4:end]
+            offset = end
+            if tag == '\x3c\x0a':
+                continue
+
+            format_ul, (etype, name, _) = klv.primer.get_mapping(tag, klv.pos)
+            if etype in POSITION_TYPES:
+                continue
+            elif etype in STRONG_REFERENCE_TYPES:
+                if etype == 'StrongReference':
+                    uids = [data]
+                else:
+                    count, size = struct.unpack('>II', data[0:8])
+                    uids = [data[8 + idx * size:8 + (idx + 1) * size] for idx in range(count)]
+                references.append((str(format_ul), name, uids, etype != 'StrongReference'))
+            else:
+                elements.append((str(format_ul), data))
+
+        elements.sort()
+        references.sort()
+
+        # Set key version byte ignored
+        hasher = hashlib.new(algorithm, key[0:7] + key[8:16])
+        for format_ul, data in elements:
+            hasher.update(format_ul + _UINT32.pack(len(data)) + data)
+
+        ret = klv.set_type, hasher.hexdigest(), references
+        self._digests[uid, algorithm] = ret
+        return ret
+
+    def fingerprint(self, algorithm='sha256'):
+        """ Structural fingerprint of the strong reference tree from the Preface. """
+
+        if self.preface_uid is None:
+            raise S377MException('No Preface in header metadata')
+
+        nodes = OrderedDict()
+        self._tree(self.preface_uid, 'Preface', nodes, (), algorithm)
+        return Fingerprint(nodes, algorithm)
+
+    def _tree(self, uid, path, nodes, ancestors, algorithm):
+        """ Add the subtree of set @uid to @nodes, returns its tree digest. """
+
+        # Parents before children
+        nodes[path] = None
+        set_type, digest, references = self.set_digest(uid, algorithm)
+        hasher = hashlib.new(algorithm, digest)
+        ancestors += (uid,)
+
+        for format_ul, name, uids, array in references:
+            hasher.update(format_ul + _UINT32.pack(len(uids)))
+            for idx, child in enumerate(uids):
+                child_path = '%s/%s' % (path, name)
+                if array:
+                    child_path += '[%d]' % idx
+
+                if child in ancestors:
+                    nodes[child_path] = ('Cycle', '', '')
+                    hasher.update('cycle')
+                elif child not in self.index:
+                    nodes[child_path] = ('Missing', '', '')
+                    hasher.update('missing')
+                else:
+                    hasher.update(self._tree(child, child_path, nodes, ancestors, algorithm))
+
+        tree = hasher.hexdigest()
+        nodes[path] = (set_type, digest, tree)
+        return tree
+
+    def close(self):
+        if self.fdesc:
+            self.fdesc.close()
+            self.fdesc = None
+
+
+class Fingerprint(object):
+    """ Header metadata structural fingerprint.
+
+    @nodes: ordered dictionary of strong reference paths from the Preface,
+    e.g. 'Preface/content/packages[0]', to (set type, set digest, tree
+    digest) tuples.
+    """
+
+    def __init__(self, nodes, algorithm='sha256'):
+        self.nodes = nodes
+        self.algorithm = algorithm
+
+    @property
+    def digest(self):
+        """ Tree digest of the Preface. """
+        return self.nodes['Preface'][2]
+
+    def __eq__(self, other):
+        return isinstance(other, Fingerprint) and (self.algorithm, self.digest) == (other.algorithm, other.digest)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def save(self, filename):
+        """ Store fingerprint in @filename, as JSON. """
+
+        fdesc = open(filename, 'w')
+        try:
+            json.dump({
+                'algorithm': self.algorithm,
+                'nodes': [[path] + list(node) for path, node in self.nodes.items()],
+            }, fdesc)
+        finally:
+            fdesc.close()
+
+    @staticmethod
+    def load(filename):
+        """ Returns the fingerprint stored in @filename. """
+
+        fdesc = open(filename)
+        try:
+            data = json.load(fdesc)
+        finally:
+            fdesc.close()
+
+        nodes = OrderedDict()
+        for item in data['nodes']:
+            nodes[str(item[0])] = tuple([str(value) for value in item[1:]])
+        return Fingerprint(nodes, str(data['algorithm']))
+
+    def diff(self, other):
+        """ Returns the paths of subtrees differing from @other fingerprint.
+
+        Sets found on one side only or whose set digests differ are reported,
+        unless under an already reported path.
+        """
+
+        if self.algorithm != other.algorithm:
+            raise S377MException('Cannot compare %s and %s fingerprints' % (self.algorithm, other.algorithm))
+
+        changed = []
+        paths = list(self.nodes) + [path for path in other.nodes if path not in self.nodes]
+        for path in paths:
+            mine = self.nodes.get(path)
+            theirs = other.nodes.get(path)
+            if mine and theirs and mine[0:2] == theirs[0:2]:
+                continue
+            if [item for item in changed if path.startswith(item + '/')]:
+                continue
+            changed.append(path)
+        return changed
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+""" Index Table generation for MXF files lacking one. """
+
+import re
+import uuid
+import struct
+
+from sjmxf.common import InterchangeObject
+from sjmxf.s377m import MXFPartition, MXFDataSet, S377MException
+from sjmxf.rp210types import Array
+from sjmxf.parser import SMPTE_PARTITION_PACK_LABEL, SMPTE_INDEX_TABLE_SEGMENT_LABEL, SMPTE_RANDOM_INDEX_PACK_LABEL
+from sjmxf.essence import decode_element_key
+
+# SMPTE 377M: Index Entry flags
+RANDOM_ACCESS = 0x80
+SEQUENCE_HEADER = 0x40
+
+# ISO/IEC 13818-2: picture coding type to Index Entry flags
+MPEG2_CODING_FLAGS = {
+    1: RANDOM_ACCESS, # I
+    2: 0x22,          # P, forward prediction
+    3: 0x33,          # B, forward and backward prediction
+}
+
+MPEG2_SEQUENCE_HEADER_CODE = '\x00\x00\x01\xb3'
+MPEG2_PICTURE_START_CODE = '\x00\x00\x01\x00'
+
+# Bytes read at the start of picture elements to find MPEG-2 headers
+PICTURE_HEADER_SIZE = 512
+
+
+def mpeg2_flags(data):
+    """ Index Entry flags of MPEG-2 picture starting @data, None if not found. """
+
+    idx = data.find(MPEG2_PICTURE_START_CODE)
+    if idx == -1 or idx + 5 >= len(data):
+        return None
+
+    flags = MPEG2_CODING_FLAGS.get((ord(data[idx+5]) >> 3) & 0x7)
+    if flags is None:
+        return None
+    if data.find(MPEG2_SEQUENCE_HEADER_CODE, 0, idx) != -1:
+        flags |= SEQUENCE_HEADER
+    return flags
+
+
+class Reindexer(object):
+    """ Build and write Index Table Segments of an essence container.
+
+    The file is walked once reading KLV keys and lengths only, plus the first
+    bytes of picture elements to derive MPEG-2 key frames. An edit unit
+    starts with each element of the track found first in the container.
+    Essence with constant edit unit sizes is indexed with a CBR segment.
+
+    @mxf: parser of the file, opened or read. Header metadata gives the
+    edit rate when @edit_rate is not set and the parser went through read().
+    @body_sid: essence container to index, the first one found by default.
+    @index_sid: IndexSID of the new segments, unused one by default.
+    """
+
+    # Index entries are 11 bytes long, local set values 64KiB at most
+    MAX_SEGMENT_ENTRIES = 5000
+
+    def __init__(self, mxf, body_sid=None, index_sid=None, edit_rate=None):
+        self.mxf = mxf
+        self.body_sid = body_sid
+        self.index_sid = index_sid
+        self.edit_rate = edit_rate
+
+        # (stream offset, flags, key frame offset) per edit unit
+        self.entries = []
+        self.edit_unit_byte_count = None
+        self.partitions = []
+        self.tail = None
+
+    def scan(self):
+        """ Walk the file and compute index entries. """
+
+        if self.mxf.run_in is None:
+            # Only the Run-In length is needed from the parser file
+            opened = self.mxf.fd is None
+            self.mxf.open()
+            if opened:
+                self.mxf.close()
+
+        fdesc = open(self.mxf.filename, 'rb')
+        try:
+            self._walk(fdesc)
+        finally:
+            fdesc.close()
+
+        if not self.entries:
+            raise S377MException('No essence found for BodySID %s' % self.body_sid)
+
+        if self.index_sid is None:
+            self.index_sid = max([1] + [partition.data['index_sid'] + 1 for partition in self.partitions])
+
+        if self.edit_rate is None:
+            self.edit_rate = self._header_edit_rate()
+
+        return self.entries
+
+    def _walk(self, fdesc):
+        fdesc.seek(0, 2)
+        size = fdesc.tell()
+
+        self.partitions = []
+        self.tail = None
+        self.entries = []
+        sizes = []
+
+        partition = None
+        first_pos = None
+        lead_track = None
+        last_key_frame = None
+        picture_flags = None
+        end = self.mxf.run_in
+
+        for key, pos, length, bytes_num in InterchangeObject.iter_klvs(fdesc, self.mxf.run_in, size):
+            end = pos + 16 + bytes_num + length
+            ekey = key.encode('hex_codec')
+
+            if re.match(SMPTE_PARTITION_PACK_LABEL + '01(0[2-4])', ekey):
+                partition = MXFPartition(fdesc)
+                partition.read()
+                if key[13] == '\x04' and self.tail is None:
+                    self.tail = pos
+                self.partitions.append(partition)
+                first_pos = None
+                continue
+
+            if ekey == SMPTE_RANDOM_INDEX_PACK_LABEL:
+                if self.tail is None:
+                    self.tail = pos
+                continue
+
+            element = decode_element_key(key)
+            if not element or not partition:
+                continue
+
+            if self.body_sid is None and partition.data['body_sid']:
+                self.body_sid = partition.data['body_sid']
+            if partition.data['body_sid'] != self.body_sid:
+                continue
+
+            if first_pos is None:
+                first_pos = pos
+            stream_offset = partition.data['body_offset'] + pos - first_pos
+            stream_end = stream_offset + end - pos
+
+            if lead_track is None:
+                lead_track = element['track_number']
+
+            if element['track_number'] == lead_track:
+                if self.entries:
+                    sizes.append(stream_offset - self.entries[-1][0])
+                self.entries.append([stream_offset, RANDOM_ACCESS, 0])
+                picture_flags = None
+
+            if element['item_name'] in ('cp_picture', 'gc_picture') and picture_flags is None:
+                fdesc.seek(pos + 16 + bytes_num)
+                picture_flags = mpeg2_flags(fdesc.read(min(length, PICTURE_HEADER_SIZE)))
+                if picture_flags is not None:
+                    self.entries[-1][1] = picture_flags
+
+            # Key frame offsets, relative to the last random access edit unit
+            if self.entries[-1][1] & RANDOM_ACCESS:
+                last_key_frame = len(self.entries) - 1
+            if last_key_frame is not None:
+                self.entries[-1][2] = max(-128, last_key_frame - len(self.entries) + 1)
+
+        if self.tail is None:
+            self.tail = end
+
+        if self.entries:
+            sizes.append(stream_end - self.entries[-1][0])
+            if len(set(sizes)) == 1:
+                self.edit_unit_byte_count = sizes[0]
+            else:
+                self.edit_unit_byte_count = None
+
+    def _header_edit_rate(self):
+        """ Essence descriptor sample rate or track edit rate from header metadata. """
+
+        for name in ('sample_rate', 'timeline_rate'):
+            for klv in self.mxf.data['header']['klvs']:
+                if isinstance(klv, MXFDataSet) and klv.get_element(name) is not None:
+                    return klv.get_element(name).read()
+
+        raise S377MException('No edit rate found in header metadata, set it explicitly')
+
+    def segments(self):
+        """ Returns the Index Table Segment KLVs indexing the scanned essence. """
+
+        if not self.entries:
+            self.scan()
+
+        if self.edit_unit_byte_count:
+            return [self._segment(0, len(self.entries), [])]
+
+        ret = []
+        for start in range(0, len(self.entries), self.MAX_SEGMENT_ENTRIES):
+            entries = self.entries[start:start + self.MAX_SEGMENT_ENTRIES]
+            ret.append(self._segment(start, len(entries), entries))
+        return ret
+
+    def _segment(self, start, duration, entries):
+        items = [
+            ('\x3c\x0a', uuid.uuid4().bytes),
+            ('\x3f\x0b', struct.pack('>II', *self.edit_rate)),
+            ('\x3f\x0c', struct.pack('>q', start)),
+            ('\x3f\x0d', struct.pack('>q', duration)),
+            ('\x3f\x05', struct.pack('>I', self.edit_unit_byte_count or 0)),
+            ('\x3f\x06', struct.pack('>I', self.index_sid)),
+            ('\x3f\x07', struct.pack('>I', self.body_sid)),
+            ('\x3f\x08', '\x00'),
+            ('\x3f\x0e', '\x00'),
+        ]
+        if entries:
+            items.append(('\x3f\x0a', struct.pack('>II', len(entries), 11) + ''.join([
+                struct.pack('>bbBQ', 0, key_offset, flags, stream_offset)
+                for stream_offset, flags, key_offset in entries
+            ])))
+
+        value = ''.join([tag + struct.pack('>H', len(item)) + item for tag, item in items])
+        return self._klv(SMPTE_INDEX_TABLE_SEGMENT_LABEL.decode('hex_codec'), value)
+
+    @staticmethod
+    def _klv(key, value):
+        return key + InterchangeObject.ber_encode_length(len(value), bytes_num=8).decode('hex_codec') + value
+
+    @staticmethod
+    def _partition_pack(key, data):
+        value = MXFPartition._struct.pack(*[data[item] for item, _, _ in MXFPartition._compound])
+        value += Array(data['essence_containers'], 'Batch of Universal Labels').write()
+        return Reindexer._klv(key, value)
+
+    def write(self):
+        """ Write an index partition before the Footer Partition.
+
+        The Footer Partition and Random Index Pack are rewritten behind it,
+        FooterPartition of previous partition packs updated in place. A
+        Footer Partition is added when missing.
+
+        @returns: the offset of the index partition.
+        """
+
+        if not self.entries:
+            self.scan()
+
+        run_in = self.mxf.run_in
+        segments = ''.join(self.segments())
+        header = self.partitions[0]
+        body = [partition for partition in self.partitions if partition.pos < self.tail]
+        footer = [partition for partition in self.partitions if partition.pos >= self.tail and partition.key[13] == '\x04']
+
+        fdesc = open(self.mxf.filename, 'r+b')
+        try:
+            # Footer Partition KLVs following its pack, up to the Random Index Pack
+            footer_klvs = ''
+            if footer:
+                footer = footer[0]
+                fdesc.seek(0, 2)
+                size = fdesc.tell()
+                start = footer.pos + 16 + footer.bytes_num + footer.length
+                stop = start
+                for key, pos, length, bytes_num in InterchangeObject.iter_klvs(fdesc, start, size):
+                    if key.encode('hex_codec') == SMPTE_RANDOM_INDEX_PACK_LABEL:
+                        break
+                    stop = pos + 16 + bytes_num + length
+                fdesc.seek(start)
+                footer_klvs = fdesc.read(stop - start)
+
+            index_offset = self.tail - run_in
+            index_data = dict(header.data)
+            index_data.update({
+                'this_partition': index_offset,
+                'previous_partition': body[-1].pos - run_in,
+                'footer_partition': 0,
+                'header_byte_count': 0,
+                'index_byte_cout': len(segments), # sic, MXFPartition item name
+                'index_sid': self.index_sid,
+                'body_offset': 0,
+                'body_sid': 0,
+            })
+            index_key = SMPTE_PARTITION_PACK_LABEL.decode('hex_codec') + '\x01\x03\x04\x00'
+            index_data['footer_partition'] = index_offset + len(self._partition_pack(index_key, index_data)) + len(segments)
+            footer_offset = index_data['footer_partition']
+
+            if footer:
+                footer_key = footer.key
+                footer_data = dict(footer.data)
+            else:
+                footer_key = SMPTE_PARTITION_PACK_LABEL.decode('hex_codec') + '\x01\x04\x04\x00'
+                footer_data = dict(index_data)
+                footer_data.update({'index_byte_cout': 0, 'index_sid': 0})
+            footer_data.update({
+                'this_partition': footer_offset,
+                'previous_partition': index_offset,
+                'footer_partition': footer_offset,
+            })
+
+            entries = [(partition.data['body_sid'], partition.pos - run_in) for partition in body]
+            entries += [(0, index_offset), (footer_data['body_sid'], footer_offset)]
+            rip = ''.join([struct.pack('>IQ', body_sid, offset) for body_sid, offset in entries])
+            rip += struct.pack('>I', 16 + 9 + len(rip) + 4)
+
+            fdesc.seek(self.tail)
+            fdesc.write(self._partition_pack(index_key, index_data) + segments)
+            fdesc.write(self._partition_pack(footer_key, footer_data) + footer_klvs)
+            fdesc.write(self._klv(SMPTE_RANDOM_INDEX_PACK_LABEL.decode('hex_codec'), rip))
+            fdesc.truncate(fdesc.tell())
+
+            # FooterPartition of previous partitions, same size values
+            for partition in body:
+                fdesc.seek(partition.pos + 16 + partition.bytes_num + 24)
+                fdesc.write(struct.pack('>Q', footer_offset))
+                partition.data['footer_partition'] = footer_offset
+        finally:
+            fdesc.close()
+
+        return index_offset
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+
+""" Single pass MXF file integrity digests. """
+
+import Queue
+import hashlib
+import threading
+
+from sjmxf.common import InterchangeObject
+from sjmxf.essence import decode_element_key
+
+
+class _HasherThread(threading.Thread):
+    """ Feeds named groups of hashers with queued data.
+
+    hashlib releases the GIL while hashing large buffers, allowing workers
+    to run in parallel with the reading thread.
+    """
+
+    def __init__(self, algorithms, depth):
+        threading.Thread.__init__(self, name='sjmxf-hasher')
+        self.setDaemon(True)
+        self.algorithms = algorithms
+        self.queue = Queue.Queue(depth)
+        self.hashers = {}
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+
+            name, data = item
+            if name not in self.hashers:
+                self.hashers[name] = [(algorithm, hashlib.new(algorithm)) for algorithm in self.algorithms]
+            for _, hasher in self.hashers[name]:
+                hasher.update(data)
+
+    def digests(self):
+        """ Returns hex digests per name and algorithm. """
+
+        ret = {}
+        for name, hashers in self.hashers.items():
+            ret[name] = dict([(algorithm, hasher.hexdigest()) for algorithm, hasher in hashers])
+        return ret
+
+
+class IntegrityChecker(object):
+    """ Whole file, per partition and per essence track digests.
+
+    The file is read once sequentially, each chunk being hashed as a whole,
+    split at partition boundaries and, following KLVs, into essence element
+    values per track number, in three hashing threads.
+
+    KLVs that cannot be followed, e.g. with an invalid BER length, make the
+    track digests lose sync up to the next partition: an error diagnostic
+    is emitted and the partition offset is listed as incomplete.
+
+    @mxf: parser that went through read(), providing the partition table.
+    @algorithms: hashlib algorithm names.
+    """
+
+    def __init__(self, mxf, algorithms=('md5', 'sha256'), chunk_size=1024 * 1024, depth=8):
+        self.mxf = mxf
+        self.algorithms = algorithms
+        self.chunk_size = chunk_size
+        self.depth = depth
+
+    def partition_ranges(self, size):
+        """ Returns (offset, start, end) file ranges of each partition.
+
+        Partitions are keyed by their offset as found in the Random Index
+        Pack, the last one runs to the end of file.
+        """
+
+        positions = [partition.pos for partition in self.mxf.data['partitions']]
+        positions.sort()
+
+        ret = []
+        for idx, pos in enumerate(positions):
+            if idx + 1 < len(positions):
+                end = positions[idx + 1]
+            else:
+                end = size
+            ret.append((self.mxf.partition_offset(pos), pos, end))
+        return ret
+
+    def run(self):
+        """ Compute all digests and store them in the footer data model.
+
+        @returns: dictionary of 'file', 'partitions' and 'tracks' digests,
+        partitions being keyed by offset and tracks by track number, and
+        the sorted 'incomplete' list of partition offsets whose essence was
+        not fully hashed in track digests.
+        """
+
+        fdesc = open(self.mxf.filename, 'rb')
+        fdesc.seek(0, 2)
+        size = fdesc.tell()
+        fdesc.seek(0)
+
+        ranges = self.partition_ranges(size)
+        workers = {}
+        for name in ('file', 'partitions', 'tracks'):
+            workers[name] = _HasherThread(self.algorithms, self.depth)
+            workers[name].start()
+
+        # KLV walk state, start behind the Run-In
+        self._ranges = ranges
+        self._size = size
+        self._value_end = self.mxf.run_in or 0
+        self._track = None
+        self._header = ''
+        self._incomplete = set()
+
+        try:
+            pos = 0
+            while True:
+                data = fdesc.read(self.chunk_size)
+                if not data:
+                    break
+
+                workers['file'].queue.put(('file', data))
+
+                for offset, start, end in ranges:
+                    first, last = max(start, pos), min(end, pos + len(data))
+                    if first < last:
+                        workers['partitions'].queue.put((offset, buffer(data, first - pos, last - first)))
+
+                for track_number, segment in self._essence_segments(pos, data):
+                    workers['tracks'].queue.put((track_number, segment))
+
+                pos += len(data)
+        finally:
+            fdesc.close()
+            for worker in workers.values():
+                worker.queue.put(None)
+            for worker in workers.values():
+                worker.join()
+
+        digests = {
+            'file': workers['file'].digests().get('file', {}),
+            'partitions': workers['partitions'].digests(),
+            'tracks': workers['tracks'].digests(),
+            'incomplete': sorted(self._incomplete),
+        }
+        self.mxf.data['footer']['digests'] = digests
+        return digests
+
+    def _essence_segments(self, pos, data):
+        """ Split @data read at @pos into essence element value segments.
+
+        @returns: a generator of (track number, buffer) tuples.
+        """
+
+        idx = 0
+        size = len(data)
+        while True:
+            if pos + idx < self._value_end:
+                # KLV value, hashed when an essence element
+                if idx >= size:
+                    break
+                length = min(self._value_end - pos - idx, size - idx)
+                if self._track is not None:
+                    yield self._track, buffer(data, idx, length)
+                idx += length
+                continue
+
+            # KLV key and BER length, possibly over two chunks
+            need = 17
+            if len(self._header) >= 17 and ord(self._header[16]) & 0x80:
+                need += ord(self._header[16]) & 0x7f
+            if len(self._header) < need:
+                if idx >= size:
+                    break
+                take = min(need - len(self._header), size - idx)
+                self._header += data[idx:idx + take]
+                idx += take
+                continue
+
+            key_pos = pos + idx - len(self._header)
+            offset, _, end = self._partition(key_pos)
+            try:
+                length, _ = InterchangeObject.ber_decode_length_details(self._header[16:])
+            except ValueError:
+                length = None
+
+            if length is None or pos + idx + length > end:
+                # KLVs do not cross partitions, sync again on the next one
+                self.mxf.diagnostics.emit('error', 'Lost KLV sync, track digests resume at the next partition', key_pos)
+                if offset is not None:
+                    self._incomplete.add(offset)
+                self._track = None
+                self._value_end = end
+                # Start of the next partition already buffered
+                self._header = self._header[end - key_pos:]
+                continue
+
+            element = decode_element_key(self._header[0:16])
+            if element:
+                self._track = element['track_number']
+            else:
+                self._track = None
+            self._value_end = pos + idx + length
+            self._header = ''
+
+    def _partition(self, position):
+        """ Returns the (offset, start, end) range of the partition holding @position. """
+
+        for item in self._ranges:
+            if item[1] <= position < item[2]:
+                return item
+        return None, 0, self._size
+
+    def verify(self, digests=None, offsets=None):
+        """ Re-verify partitions against previously computed @digests.
+
+        @digests: digests as returned by run(), defaults to the ones stored
+        in the footer data model.
+        @offsets: partition offsets to verify, all by default.
+
+        @returns: the list of offsets whose digests do not match.
+        """
+
+        if digests is None:
+            digests = self.mxf.data['footer']['digests']
+
+        fdesc = open(self.mxf.filename, 'rb')
+        fdesc.seek(0, 2)
+        size = fdesc.tell()
+
+        failed = []
+        try:
+            for offset, start, end in self.partition_ranges(size):
+                if offsets is not None and offset not in offsets:
+                    continue
+
+                expected = digests['partitions'].get(offset, {})
+                hashers = [(algorithm, hashlib.new(algorithm)) for algorithm in expected]
+                fdesc.seek(start)
+                remaining = end - start
+                while remaining > 0:
+                    data = fdesc.read(min(self.chunk_size, remaining))
+                    if not data:
+                        break
+                    for _, hasher in hashers:
+                        hasher.update(data)
+                    remaining -= len(data)
+
+                if not hashers or remaining or \
+                    [algorithm for algorithm, hasher in hashers if hasher.hexdigest() != expected[algorithm]]:
+                    failed.append(offset)
+        finally:
+            fdesc.close()
+
+        return failed
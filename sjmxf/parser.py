@@ -3,18 +3,42 @@
 
 """ MXF Parser. """
 
+import os
 import re
-from sjmxf.common import InterchangeObject
-from sjmxf.s377m import MXFPartition, MXFDataSet, MXFPreface, MXFPrimer, KLVFill, KLVDarkComponent, RandomIndexMetadata, S377MException
+import sys
+import mmap
+import tempfile
+import threading
+from sjmxf.common import InterchangeObject, Diagnostics, DIAGNOSTICS, print_diagnostic, copy_range
+from sjmxf.s377m import MXFPartition, MXFDataSet, MXFPreface, MXFPrimer, MXFIndexTableSegment, KLVFill, KLVDarkComponent, KLVSkipped, RandomIndexMetadata, S377MException
 from sjmxf.avid import AvidObjectDirectory, AvidAAFDefinition, AvidMetadataPreface, AvidMXFDataSet
 from sjmxf.rp210types import AvidOffset
+from sjmxf.essence import is_element_key
 
 SMPTE_PARTITION_PACK_LABEL = '060e2b34020501010d010201'
+SMPTE_PRIMER_PACK_LABEL = '060e2b34020501010d01020101050100'
+SMPTE_PREFACE_LABEL = '060e2b34025301010d01010101012f00'
+SMPTE_INDEX_TABLE_SEGMENT_LABEL = '060e2b34025301010d01020101100100'
+SMPTE_RANDOM_INDEX_PACK_LABEL = '060e2b34020501010d01020101110100'
+SMPTE_RUN_IN_LIMIT = 65535
+SMPTE_KLV_FILL_LABELS = ('060e2b34010101010201021001000000', '060e2b34010101010301021001000000')
 
-def mxf_kind(filename):
-    """ Lookup the MXF data start position and returns appropriate parser. """
+def mxf_kind(filename, debug=False, diagnostics=None, workers=None, backend=None):
+    """ Lookup the MXF data start position and returns appropriate parser.
 
-    mxf = MXFParser(filename)
+    The returned parser reuses the opened file and the Header Partition Pack
+    read to detect the operational pattern.
+
+    @debug: print diagnostics on standard output.
+    @diagnostics: Diagnostics channel shared with the returned parser.
+    @workers: header metadata decoding threads of the returned parser.
+    @backend: BlockCache the file is read through, see sjmxf.backend.
+    """
+
+    if diagnostics is None:
+        diagnostics = Diagnostics()
+
+    mxf = MXFParser(filename, diagnostics=diagnostics, backend=backend)
     mxf.open()
 
     # SMTPE 377M: Header Partition Pack, first thing in a MXF file
@@ -22,21 +46,130 @@ def mxf_kind(filename):
     try:
         header_partition_pack.read()
     except S377MException, error:
-        print error
+        if diagnostics:
+            diagnostics.emit('warning', str(error), header_partition_pack.pos)
+
+    parser = PARSERS.lookup(header_partition_pack.data['operational_pattern'])
+    if not parser:
+        # This is an error
+        mxf.close()
+        return None
+
+    mxf_parser = parser(filename, debug=debug, diagnostics=diagnostics, workers=workers)
+    if diagnostics:
+        diagnostics.emit('info', "Selecting %s" % parser.__name__, parser=parser)
+    mxf_parser.fd = mxf.fd
+    mxf_parser.backend = backend
+    mxf_parser.run_in = mxf.run_in
+    mxf_parser.data['header']['partition'] = header_partition_pack
+    mxf_parser.data['partitions'].append(header_partition_pack)
+    return mxf_parser
+
+
+class OperationalPatternRegistry(object):
+    """ Operational Pattern to parser class registry.
+
+    Patterns are hex encoded Universal Labels where '..' matches any byte,
+    they are compiled to the list of fixed byte ranges to compare with raw
+    labels. Parsers provided by other packages are discovered through the
+    @group entry point group: each entry point is a callable receiving the
+    registry, e.g. to call register.
+    """
+
+    def __init__(self, group='sjmxf.parsers'):
+        self.group = group
+        self._patterns = []
+        self._plugins_loaded = False
+
+    def register(self, pattern, parser):
+        """ Register @parser class for operational pattern @pattern. """
+
+        ranges = []
+        for idx in range(0, len(pattern) / 2):
+            byte = pattern[2*idx:2*idx+2]
+            if byte == '..':
+                continue
+            if ranges and ranges[-1][1] == idx:
+                ranges[-1][1] = idx + 1
+                ranges[-1][2] += byte.decode('hex_codec')
+            else:
+                ranges.append([idx, idx + 1, byte.decode('hex_codec')])
+
+        self._patterns.append((tuple([tuple(item) for item in ranges]), parser))
+
+    def unregister(self, parser):
+        """ Remove all patterns registered for @parser class. """
+        self._patterns = [item for item in self._patterns if item[1] is not parser]
+
+    def load_plugins(self):
+        """ Load parsers registered by other packages through entry points. """
+
+        if self._plugins_loaded:
+            return
+        self._plugins_loaded = True
+
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+
+        for entry_point in pkg_resources.iter_entry_points(self.group):
+            try:
+                entry_point.load()(self)
+            except Exception, error:
+                if DIAGNOSTICS:
+                    DIAGNOSTICS.emit('warning', "Cannot load parser plugin %s: %s" % (entry_point, error))
+
+    def lookup(self, label):
+        """ Returns parser class for binary operational pattern @label, or None. """
+
+        self.load_plugins()
+        for ranges, parser in self._patterns:
+            for start, end, value in ranges:
+                if label[start:end] != value:
+                    break
+            else:
+                return parser
 
-    op = header_partition_pack.data['operational_pattern'].encode('hex_codec')
-    for op_pattern, parser in PARSERS.items():
-        if re.match(op_pattern, op):
-            print "Selecting", str(parser)
-            return parser(filename, debug=True)
+        return None
 
-    # This is an error
-    return None
+
+class _HeaderBuffer(object):
+    """ Read only file object over @data read at @base file position.
+
+    Lets header metadata be decoded from memory by several threads, each
+    one with its own cursor.
+    """
+
+    def __init__(self, data, base, pos):
+        self.data = data
+        self.base = base
+        self.pos = pos
+
+    def read(self, size=-1):
+        start = self.pos - self.base
+        if size < 0:
+            ret = self.data[start:]
+        else:
+            ret = self.data[start:start + size]
+        self.pos += len(ret)
+        return ret
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            self.pos += offset
+        elif whence == 2:
+            self.pos = self.base + len(self.data) + offset
+        else:
+            self.pos = offset
+
+    def tell(self):
+        return self.pos
 
 
 class MXFParser(object):
 
-    def __init__(self, filename, debug=False):
+    def __init__(self, filename, debug=False, diagnostics=None, workers=None, backend=None):
         self.filename = filename
         self.fd = None
         self.data = {
@@ -52,31 +185,166 @@ class MXFParser(object):
             'footer': {
                 'partition': None,
                 'random_index_pack': None,
+                'digests': None,
                 'klvs': [],
             },
+            'partitions': [],
+            'index': [],
+            'essence': [],
         }
         self.debug = debug
 
+        # Warnings and debugging events, printed in debug mode
+        if diagnostics is not None:
+            self.diagnostics = diagnostics
+        else:
+            self.diagnostics = Diagnostics()
+        if debug:
+            self.diagnostics.subscribe(print_diagnostic)
+
+        # SMPTE 377M: length of the Run-In sequence, detected on first open
+        self.run_in = None
+
+        # Position following the last fully parsed KLV of a growing file
+        self.tail = None
+
+        # Opt-in parsing statistics, see enable_stats()
+        self.statistics = None
+
+        # Header metadata decoding threads, see header_klvs_parse()
+        self.workers = workers
+
+        # BlockCache reading the file instead of a local file object
+        self.backend = backend
+
     def open(self):
-        # SMTPE 377M: ability to skip over RunIn sequence
-        self.fd = open(self.filename, 'r')
-        data = self.fd.read(65536)
-        idx = data.find(SMPTE_PARTITION_PACK_LABEL.decode('hex_codec'))
+        if self.fd:
+            # Already opened, e.g. by mxf_kind
+            return
+
+        if self.backend is not None:
+            self.fd = self.backend.open()
+        else:
+            self.fd = open(self.filename, 'r')
+        if self.statistics and self.statistics.enabled:
+            self.fd = self.statistics.wrap(self.fd)
+        if self.run_in is None:
+            self.run_in = self.run_in_detect()
+
+        # Real MXF data position
+        self.fd.seek(self.run_in)
+
+    def run_in_detect(self):
+        """ Lookup the Header Partition Pack to skip over the Run-In sequence.
+
+        SMPTE 377M: the Run-In is less than 64KiB long and never contains the
+        first 11 bytes of the Partition Pack key. Candidates are searched on a
+        memory map of the Run-In area, or a buffer when the file cannot be
+        mapped, and validated as Header Partition Pack keys.
+
+        @returns: the Run-In length.
+        """
+
+        self.fd.seek(0, 2)
+        length = min(self.fd.tell(), SMPTE_RUN_IN_LIMIT + 16)
+
+        try:
+            data = mmap.mmap(self.fd.fileno(), length, access=mmap.ACCESS_READ)
+        except (mmap.error, ValueError, AttributeError):
+            self.fd.seek(0)
+            data = self.fd.read(length)
+
+        prefix = SMPTE_PARTITION_PACK_LABEL[0:22].decode('hex_codec')
+        idx = data.find(prefix)
+        while idx != -1 and idx <= SMPTE_RUN_IN_LIMIT:
+            key = data[idx:idx+16]
+            if key[11:14] == '\x01\x01\x02' and '\x01' <= key[14] <= '\x04' and key[15] == '\x00':
+                break
+            idx = data.find(prefix, idx + 1)
+        else:
+            idx = -1
+
+        if isinstance(data, mmap.mmap):
+            data.close()
+
         if idx == -1:
             raise Exception('Not a valid SMTPE 377m MXF file.')
 
-        # Real MXF data position
-        self.fd.seek(idx)
+        return idx
+
+    def file_position(self, offset):
+        """ Convert a partition relative @offset (e.g. ThisPartition) to a file position. """
+        return self.run_in + offset
+
+    def partition_offset(self, position):
+        """ Convert a file @position to a partition relative offset. """
+        return position - self.run_in
 
     def close(self):
         self.fd.close()
+        self.fd = None
+
+    def enable_stats(self, callback=None):
+        """ Collect parsing statistics until disable_stats() is called.
+
+        I/O operations on the parser file, KLV reads and writes per class with
+        their duration, converters of decoded values per type and Primer local
+        tag misses are accounted. Only this parser is instrumented, and not at
+        all when disabled.
+
+        @callback: called after each KLV read or write with (class name,
+        method name, position, length, elapsed seconds).
+
+        @returns: the ParseStatistics collector.
+        """
+
+        from sjmxf.profiling import ParseStatistics
+
+        if not self.statistics:
+            self.statistics = ParseStatistics(callback)
+        else:
+            self.statistics.callback = callback
+
+        self.statistics.enable()
+        if self.fd:
+            self.fd = self.statistics.wrap(self.fd)
+        return self.statistics
+
+    def disable_stats(self):
+        """ Stop collecting parsing statistics. """
+
+        if not self.statistics:
+            return
+
+        self.statistics.disable()
+        if self.fd and getattr(self.fd, 'statistics', None):
+            self.fd = self.fd.fdesc
+
+    def essence(self):
+        """ Returns an EssenceReader on parsed essence containers. """
+
+        from sjmxf.essence import EssenceReader
+        return EssenceReader(self)
+
+    def stats(self):
+        """ Returns collected parsing statistics, None if never enabled. """
+
+        if not self.statistics:
+            return None
+        return self.statistics.stats()
+
+    def read(self, projection=None):
+        """ Parse the whole file, @projection restricts header metadata decoding. """
 
-    def read(self):
         if not self.fd:
             self.open()
 
         self.header_partition_parse()
-        self.header_metadata_parse()
+        if projection is None:
+            # Operational pattern plugins may not support projections
+            self.header_metadata_parse()
+        else:
+            self.header_metadata_parse(projection)
 
         ### Print out
         if self.debug:
@@ -93,12 +361,16 @@ class MXFParser(object):
         """ Parse MXF header partition. """
 
         # SMTPE 377M: Header Partition Pack, first thing in a MXF file
-        header_partition_pack = MXFPartition(self.fd)
-        try:
-            header_partition_pack.read()
-        except S377MException, error:
-            print error
-        self.data['header']['partition'] = header_partition_pack
+        # (might have been loaded by mxf_kind already)
+        if not self.data['header']['partition']:
+            header_partition_pack = MXFPartition(self.fd)
+            try:
+                header_partition_pack.read()
+            except S377MException, error:
+                if self.diagnostics:
+                    self.diagnostics.emit('warning', str(error), header_partition_pack.pos)
+            self.data['header']['partition'] = header_partition_pack
+            self.data['partitions'].append(header_partition_pack)
 
         # SMPTE 377M: klv fill behind Header Partition is not counted in HeaderByteCount
         key = InterchangeObject.get_key(self.fd)
@@ -109,23 +381,156 @@ class MXFParser(object):
             klv.read()
             self.data['header']['klvs'].append(klv)
 
-    def header_metadata_parse(self):
+    def header_metadata_parse(self, projection=None):
+        """ Parse header metadata following the Header Partition Pack.
+
+        @projection: header metadata sets to decode, see header_projection.
+        """
         raise Exception('To be implemented in specific Operational Pattern Parser')
 
+    def header_projection(self, projection, decode):
+        """ Returns header KLV @decode function restricted to @projection.
+
+        @projection: set types to decode, e.g. ('MaterialPackage',
+        'SourcePackage'), or a dictionary of set types to the element names
+        to decode, None meaning all of them. The None set type stands for
+        sets not listed. Set types are MXFDataSet.dataset_names values,
+        'Preface' or, for other sets, their hex key.
+
+        The Primer Pack is always decoded. Other KLVs are KLVSkipped objects
+        whose values are not read.
+        """
+
+        if projection is None:
+            return decode
+
+        if not isinstance(projection, dict):
+            projection = dict([(item, None) for item in projection])
+
+        selected = {}
+        for set_type, elements in projection.items():
+            if elements is not None:
+                elements = frozenset(elements)
+            selected[set_type] = elements
+        # False: not decoded
+        default = selected.pop(None, False)
+
+        set_types = dict(MXFDataSet.dataset_names)
+        set_types[SMPTE_PREFACE_LABEL] = 'Preface'
+
+        def project(fd, key):
+            if key == SMPTE_PRIMER_PACK_LABEL:
+                return decode(fd, key)
+
+            elements = selected.get(set_types.get(key, key), default)
+            if elements is False:
+                klv = KLVSkipped(fd)
+                klv.read()
+                return klv
+            return decode(fd, key, elements)
+
+        return project
+
+    def header_klvs_parse(self, header_end, decode):
+        """ Decode header metadata KLVs from the current position to @header_end.
+
+        KLV boundaries are found first, then each KLV is decoded by @decode
+        with a file object set on its key and its key in hex form.
+
+        With more than one worker, header metadata is read in memory and the
+        KLVs following the Primer Pack are split between worker threads. It
+        only speeds decoding up on Python builds without a global lock, as
+        sets decoding is CPU bound.
+
+        @returns: the list of decoded KLVs, in file order.
+        """
+
+        fd = self.fd
+        start = fd.tell()
+        fd.seek(0, 2)
+        size = fd.tell()
+
+        boundaries = []
+        end = start
+        for key, pos, length, bytes_num in InterchangeObject.iter_klvs(fd, start, size):
+            if pos >= header_end:
+                break
+            boundaries.append((key.encode('hex_codec'), pos))
+            end = pos + 16 + bytes_num + length
+
+        if end < header_end and self.diagnostics:
+            self.diagnostics.emit('warning', "Invalid KLV in header metadata", end)
+
+        if not self.workers or self.workers < 2:
+            klvs = []
+            for key, pos in boundaries:
+                fd.seek(pos)
+                klvs.append(decode(fd, key))
+            fd.seek(end)
+            return klvs
+
+        # Keys and lengths are read ahead of each KLV, keep some spare bytes
+        fd.seek(start)
+        data = fd.read(end - start + 25)
+        klvs = [None] * len(boundaries)
+
+        # Sets need the Primer Pack, decode up to it first
+        idx = 0
+        while idx < len(boundaries):
+            key, pos = boundaries[idx]
+            klvs[idx] = decode(_HeaderBuffer(data, start, pos), key)
+            idx += 1
+            if key == SMPTE_PRIMER_PACK_LABEL:
+                break
+
+        errors = []
+
+        def work(first, last):
+            try:
+                for item in range(first, last):
+                    key, pos = boundaries[item]
+                    klvs[item] = decode(_HeaderBuffer(data, start, pos), key)
+            except Exception:
+                errors.append(sys.exc_info())
+
+        step = (len(boundaries) - idx + self.workers - 1) / self.workers
+        threads = []
+        for first in range(idx, len(boundaries), step or 1):
+            thread = threading.Thread(target=work, args=(first, min(first + step, len(boundaries))), name='sjmxf-header')
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0][0], errors[0][1], errors[0][2]
+
+        for klv in klvs:
+            klv.fdesc = fd
+        fd.seek(end)
+        return klvs
+
     def body_parse(self):
 
+        # Only build diagnostics when subscribed to
+        diagnostics = self.diagnostics or None
+
         # Read until Footer Partition Pack key
         i = 0
-        key = InterchangeObject.get_key(self.fd)
+        key, length, bytes_num = InterchangeObject.get_key_length(self.fd)
         while not key.startswith('060e2b34020501010d01020101040400'):
 
-            klv = KLVDarkComponent(self.fd)
-            klv.read()
-            i += 1
-            key = InterchangeObject.get_key(self.fd)
-            print klv
+            klv = self.body_klv_register(key.decode('hex_codec'), self.fd.tell(), 16 + bytes_num + length)
+            if not klv:
+                klv = KLVDarkComponent(self.fd)
+                klv.read()
+                i += 1
+            key, length, bytes_num = InterchangeObject.get_key_length(self.fd)
+            if diagnostics:
+                diagnostics.emit('debug', str(klv), klv.pos, klv=klv)
 
-        print "Skipped", i, "KLVs"
+        if diagnostics:
+            diagnostics.emit('info', "Skipped %d KLVs" % i)
 
     def footer_partition_parse(self):
         """ Parse MXF footer partition. """
@@ -134,6 +539,7 @@ class MXFParser(object):
         footer_partition_pack = MXFPartition(self.fd)
         footer_partition_pack.read()
         self.data['footer']['partition'] = footer_partition_pack
+        self.data['partitions'].append(footer_partition_pack)
 
         key = InterchangeObject.get_key(self.fd)
         if key in ('060e2b34010101010201021001000000',
@@ -157,11 +563,18 @@ class MXFParser(object):
                 klv = KLVFill(self.fd)
                 klv.read()
 
+            elif key == SMPTE_INDEX_TABLE_SEGMENT_LABEL:
+                klv = MXFIndexTableSegment(self.fd)
+                klv.read()
+                self.index_segment_register(klv)
+                if self.diagnostics:
+                    self.diagnostics.emit('debug', str(klv), klv.pos, klv=klv)
+
             else:
-                # 060e2b34025301010d01020101100100 -> Index Table Segment
                 klv = KLVDarkComponent(self.fd)
                 klv.read()
-                print klv
+                if self.diagnostics:
+                    self.diagnostics.emit('debug', str(klv), klv.pos, klv=klv)
 
             self.data['footer']['klvs'].append(klv)
 
@@ -175,6 +588,196 @@ class MXFParser(object):
         self.data['footer']['klvs'].append(random_index_pack)
         self.data['footer']['random_index_pack'] = random_index_pack
 
+    def poll(self):
+        """ Incrementally parse a growing (open or incomplete) MXF file.
+
+        Header partition and header metadata are parsed on first call, as soon
+        as they are completely written. Following calls only walk KLVs appended
+        since the last fully parsed one, updating the partition table, index
+        table segments and essence map in place. Essence is never loaded.
+
+        @returns: list of partition packs and index table segments found.
+        """
+
+        if self.tail is None:
+            if not self.fd:
+                self.open()
+            if not self._header_available():
+                return []
+
+            self.header_partition_parse()
+            self.header_metadata_parse()
+            self.tail = self.fd.tell()
+
+        self.fd.seek(0, 2)
+        size = self.fd.tell()
+
+        found = []
+        for key, pos, length, bytes_num in InterchangeObject.iter_klvs(self.fd, self.tail, size):
+            klv = self.body_klv_register(key, pos, 16 + bytes_num + length)
+            if klv:
+                found.append(klv)
+            self.tail = pos + 16 + bytes_num + length
+
+        return found
+
+    def follow(self, interval=1.0, timeout=None):
+        """ Follow a growing MXF file until its Random Index Pack is written.
+
+        @interval: delay in seconds between two polls.
+        @timeout: give up after @timeout seconds without the file growing.
+
+        @returns: a generator of non empty poll results.
+        """
+
+        import time
+
+        idle = 0
+        while not self.data['footer']['random_index_pack']:
+            found = self.poll()
+            if found:
+                idle = 0
+                yield found
+            else:
+                if timeout is not None and idle >= timeout:
+                    return
+                time.sleep(interval)
+                idle += interval
+
+    def _header_available(self):
+        """ Whether header partition and header metadata are completely written. """
+
+        start = self.fd.tell()
+        self.fd.seek(0, 2)
+        size = self.fd.tell()
+
+        header_end = None
+        for key, pos, length, bytes_num in InterchangeObject.iter_klvs(self.fd, start, size):
+            if header_end is None:
+                header_partition_pack = MXFPartition(self.fd)
+                try:
+                    header_partition_pack.read()
+                except S377MException:
+                    # Reported by header_partition_parse
+                    pass
+                header_end = pos + 16 + bytes_num + length + header_partition_pack.data['header_byte_count']
+                continue
+
+            # SMPTE 377M: klv fill behind Header Partition is not counted in HeaderByteCount
+            if key.encode('hex_codec') in SMPTE_KLV_FILL_LABELS:
+                header_end += 16 + bytes_num + length
+            break
+
+        else:
+            header_end = None
+
+        self.fd.seek(start)
+        return header_end is not None and header_end <= size
+
+    def body_klv_register(self, key, pos, size):
+        """ Register body KLV at @pos of @size bytes in partition table, index or essence map.
+
+        The cursor is expected to be set on @key.
+
+        @returns: loaded KLV object for partition packs and index table segments.
+        """
+
+        ekey = key.encode('hex_codec')
+
+        if ekey == SMPTE_RANDOM_INDEX_PACK_LABEL:
+            random_index_pack = RandomIndexMetadata(self.fd)
+            random_index_pack.read()
+            self.data['footer']['klvs'].append(random_index_pack)
+            self.data['footer']['random_index_pack'] = random_index_pack
+
+        elif re.match(SMPTE_PARTITION_PACK_LABEL + '01(0[2-4])', ekey):
+            partition_pack = MXFPartition(self.fd)
+            try:
+                partition_pack.read()
+            except S377MException, error:
+                if self.diagnostics:
+                    self.diagnostics.emit('warning', str(error), partition_pack.pos)
+
+            self.data['partitions'].append(partition_pack)
+            if key[13] == '\x03':
+                self.data['body']['partition'] = partition_pack
+            elif key[13] == '\x04':
+                self.data['footer']['partition'] = partition_pack
+            return partition_pack
+
+        elif ekey == SMPTE_INDEX_TABLE_SEGMENT_LABEL:
+            segment = MXFIndexTableSegment(self.fd)
+            segment.read()
+            self.index_segment_register(segment)
+            return segment
+
+        elif is_element_key(key):
+            # SMPTE 379M: Generic Container element, tracked per partition
+            partition_pack = self.data['partitions'][-1]
+            if not self.data['essence'] or self.data['essence'][-1]['partition'] != partition_pack.pos:
+                self.data['essence'].append({
+                    'partition': partition_pack.pos,
+                    'body_sid': partition_pack.data['body_sid'],
+                    'body_offset': partition_pack.data['body_offset'],
+                    'pos': pos,
+                    'length': 0,
+                })
+            self.data['essence'][-1]['length'] = pos + size - self.data['essence'][-1]['pos']
+
+        return None
+
+    def index_segment_register(self, segment):
+        """ Insert @segment in the index, replacing a previous copy of it. """
+
+        for idx, item in enumerate(self.data['index']):
+            if item.data.get('index_sid') == segment.data.get('index_sid') and \
+                item.data.get('index_start_position') == segment.data.get('index_start_position'):
+                self.data['index'][idx] = segment
+                return
+
+        self.data['index'].append(segment)
+        self.data['index'].sort(key=lambda item: (item.data.get('index_sid'), item.data.get('index_start_position')))
+
+    def stream_position(self, body_sid, stream_offset):
+        """ Convert essence container @stream_offset to a file position. """
+
+        for entry in reversed(self.data['essence']):
+            if entry['body_sid'] == body_sid and entry['body_offset'] <= stream_offset:
+                if stream_offset >= entry['body_offset'] + entry['length']:
+                    break
+                return entry['pos'] + stream_offset - entry['body_offset']
+
+        raise S377MException('Stream offset %d of BodySID %d is not available' % (stream_offset, body_sid))
+
+    def edit_unit_position(self, edit_unit, index_sid=None):
+        """ Lookup file position of @edit_unit using index table segments. """
+
+        for segment in self.data['index']:
+            if index_sid is not None and segment.data.get('index_sid') != index_sid:
+                continue
+            if segment.covers(edit_unit):
+                return self.stream_position(segment.data.get('body_sid', 0), segment.stream_offset(edit_unit))
+
+        raise S377MException('Edit unit %d is not indexed' % edit_unit)
+
+    def edit_unit_count(self, index_sid=None):
+        """ Number of edit units indexed so far. """
+
+        count = 0
+        for segment in self.data['index']:
+            if index_sid is not None and segment.data.get('index_sid') != index_sid:
+                continue
+
+            if segment.data.get('edit_unit_byte_count') and not segment.data.get('index_duration'):
+                # CBR index covering the whole container, count what is written
+                stream_end = max([0] + [entry['body_offset'] + entry['length'] \
+                    for entry in self.data['essence'] if entry['body_sid'] == segment.data.get('body_sid')])
+                count = max(count, stream_end / segment.data['edit_unit_byte_count'])
+            else:
+                count = max(count, segment.data.get('index_start_position', 0) + segment.edit_unit_count())
+
+        return count
+
     def primer_statistics(self):
         # Primer Pack stats
         smpte377_transcodings = self.data['header']['primer'].data.values()
@@ -218,186 +821,269 @@ class MXFParser(object):
 class AvidParser(MXFParser):
 
 
-    def header_metadata_parse(self):
-
-        dark = 0
+    def header_metadata_parse(self, projection=None):
 
-        avid_metadata_preface = None
-        header_metadata_preface = None
         header_end = self.fd.tell() + self.data['header']['partition'].data['header_byte_count']
+        self.data['header'].update({
+            'primer': None,
+            'preface': None,
+            'avid_preface': None,
+        })
 
-        while self.fd.tell() < header_end:
-            fd = self.fd
-            key = InterchangeObject.get_key(self.fd)
-
-            if key in ('060e2b34010101010201021001000000', \
-                '060e2b34010101010301021001000000'):
-                # KLV Fill item
-                klv = KLVFill(fd)
-                klv.read()
-
-            elif key == '060e2b34020501010d01020101050100':
-                # SMTPE 377M: Header Metadata (Primer Pack)
-                #if not isinstance(header_klvs[-1], KLVFill) and \
-                #    not isinstance(header_klvs[-1], MXFPartition):
-                #    raise Exception('Error: MXFPrimer not located after Header Partition Pack')
-                header_metadata_primer_pack = MXFPrimer(fd, debug=True)
-                header_metadata_primer_pack.read()
-                #print header_metadata_primer_pack
-                klv = header_metadata_primer_pack
-                #continue
-
-            elif key == '060e2b34025301010d01010101012f00':
-                # SMTPE 377M: Header Metadata (Preface)
-                #if not isinstance(header_klvs[-1], KLVFill) and \
-                #    not isinstance(header_klvs[-1], MXFPrimer):
-                #    raise Exception('Error: MXFPrimer not located after Header Partition Pack')
-                header_metadata_preface = MXFPreface(fd, header_metadata_primer_pack)
-                header_metadata_preface.read()
-                klv = header_metadata_preface
-
-            elif key == '8053080036210804b3b398a51c9011d4':
-                # Avid ???
-                avid_metadata_preface = AvidMetadataPreface(fd, header_metadata_primer_pack)
-                avid_metadata_preface.read()
-                klv = avid_metadata_preface
-
-            elif key in (
-             # 416 chunk (dark)
-             '060e2b34025301010d01010102010000',
-             '060e2b34025301010d01010102020000',
-             '060e2b34025301010d01010102040000',
-             '060e2b34025301010d01010102050000',
-             '060e2b34025301010d01010102060000',
-             '060e2b34025301010d01010102070000',
-             '060e2b34025301010d01010102080000',
-             '060e2b34025301010d01010102090000',
-             '060e2b34025301010d010101020a0000',
-             '060e2b34025301010d010101020b0000',
-             '060e2b34025301010d010101020c0000',
-             '060e2b34025301010d010101020d0000',
-             '060e2b34025301010d010101020e0000',
-
-             '060e2b34025301010d01010102200000',
-             '060e2b34025301010d01010102210000',
-             '060e2b34025301010d01010102220000', # Dark Dictionary ?
-
-             '060e2b34025301010d01010102250000',
-
-             # 119 chunk: Metadata of type ???
-             '060e2b34025301010d01010101011b00', # Dark Simple Type Definition
-             '060e2b34025301010d01010101011f00', # Dark Derived Type Definition
-             '060e2b34025301010d01010101012000', # Dark Concent Type Definition
-             '060e2b34025301010d01010101012200', # Dark Links to Data/Container/Codecs definitions
-            ):
-                # Avid DataSet
-                klv = AvidAAFDefinition(fd, header_metadata_primer_pack)
-                klv.read()
-
-            elif key in (
-             # essence descriptions (130~180)
-             # SMPTE 377M: Strutural Metadata Sets
-             '060e2b34025301010d01010101010900', # Filler
-
-             '060e2b34025301010d01010101010f00', # Sequence
-
-             '060e2b34025301010d01010101011100', # Source Clip
-             '060e2b34025301010d01010101011400', # Timecode Component
-
-             '060e2b34025301010d01010101011800', # ContentStorage
-
-             '060e2b34025301010d01010101012e00', # AVID
-
-             '060e2b34025301010d01010101013700', # Source Package (File, Physical)
+        klvs = self.header_klvs_parse(header_end, self.header_projection(projection, self.header_klv_decode))
+        self.data['header']['klvs'].extend(klvs)
+        dark = len([klv for klv in klvs if type(klv) is KLVDarkComponent])
 
-             '060e2b34025301010d01010101013b00', # Timeline Track
+        if self.diagnostics:
+            self.diagnostics.emit('info', "Loaded %d KLVs" % len(self.data['header']['klvs']), self.fd.tell())
+            self.diagnostics.emit('info', "Skipped %d dark KLVs" % dark)
+            if projection is not None:
+                skipped = len([klv for klv in klvs if type(klv) is KLVSkipped])
+                self.diagnostics.emit('info', "Left out %d KLVs by projection" % skipped)
+        return
 
-             '060e2b34025301010d01010101014200', # GenericSoundEssenceDescriptor
-             '060e2b34025301010d01010101014400', # MultipleDescriptor
-             '060e2b34025301010d01010101014800', # WaveAudioDescriptor
-             ):
-                klv = MXFDataSet(fd, header_metadata_primer_pack)
-                klv.read()
+    def header_klv_decode(self, fd, key, elements=None):
+        """ Returns the header metadata KLV with @key read at @fd position.
 
-            elif key in (
-             '060e2b34025301010d01010101012800', # CDCI Essence Descriptor
+        @elements: element names to decode in sets, all by default.
+        """
 
-             # avid does not use standard 10 bytes ProductVersion
-             '060e2b34025301010d01010101013000', # Identification
+        if key in ('060e2b34010101010201021001000000', \
+            '060e2b34010101010301021001000000'):
+            # KLV Fill item
+            klv = KLVFill(fd)
+            klv.read()
 
-             '060e2b34025301010d01010101013600', # Material Package
-             '060e2b34025301010d01010101013f00', # AVID
-            ):
-                klv = AvidMXFDataSet(fd, header_metadata_primer_pack)
-                klv.read()
+        elif key == '060e2b34020501010d01020101050100':
+            # SMTPE 377M: Header Metadata (Primer Pack)
+            #if not isinstance(header_klvs[-1], KLVFill) and \
+            #    not isinstance(header_klvs[-1], MXFPartition):
+            #    raise Exception('Error: MXFPrimer not located after Header Partition Pack')
+            klv = MXFPrimer(fd, debug=self.debug, diagnostics=self.diagnostics)
+            klv.read()
+            self.data['header']['primer'] = klv
+
+        elif key == '060e2b34025301010d01010101012f00':
+            # SMTPE 377M: Header Metadata (Preface)
+            #if not isinstance(header_klvs[-1], KLVFill) and \
+            #    not isinstance(header_klvs[-1], MXFPrimer):
+            #    raise Exception('Error: MXFPrimer not located after Header Partition Pack')
+            klv = MXFPreface(fd, self.data['header']['primer'], elements=elements)
+            klv.read()
+            self.data['header']['preface'] = klv
 
-            elif key == '9613b38a87348746f10296f056e04d2a':
-                # Avid ObjectDirectory
-                klv = AvidObjectDirectory(fd, True)
-                klv.read()
+        elif key == '8053080036210804b3b398a51c9011d4':
+            # Avid ???
+            klv = AvidMetadataPreface(fd, self.data['header']['primer'], elements=elements)
+            klv.read()
+            self.data['header']['avid_preface'] = klv
+
+        elif key in (
+         # 416 chunk (dark)
+         '060e2b34025301010d01010102010000',
+         '060e2b34025301010d01010102020000',
+         '060e2b34025301010d01010102040000',
+         '060e2b34025301010d01010102050000',
+         '060e2b34025301010d01010102060000',
+         '060e2b34025301010d01010102070000',
+         '060e2b34025301010d01010102080000',
+         '060e2b34025301010d01010102090000',
+         '060e2b34025301010d010101020a0000',
+         '060e2b34025301010d010101020b0000',
+         '060e2b34025301010d010101020c0000',
+         '060e2b34025301010d010101020d0000',
+         '060e2b34025301010d010101020e0000',
+
+         '060e2b34025301010d01010102200000',
+         '060e2b34025301010d01010102210000',
+         '060e2b34025301010d01010102220000', # Dark Dictionary ?
+
+         '060e2b34025301010d01010102250000',
+
+         # 119 chunk: Metadata of type ???
+         '060e2b34025301010d01010101011b00', # Dark Simple Type Definition
+         '060e2b34025301010d01010101011f00', # Dark Derived Type Definition
+         '060e2b34025301010d01010101012000', # Dark Concent Type Definition
+         '060e2b34025301010d01010101012200', # Dark Links to Data/Container/Codecs definitions
+        ):
+            # Avid DataSet
+            klv = AvidAAFDefinition(fd, self.data['header']['primer'], elements=elements)
+            klv.read()
 
-            else:
-                klv = KLVDarkComponent(fd)
-                klv.read()
-                dark += 1
+        elif key in (
+         # essence descriptions (130~180)
+         # SMPTE 377M: Strutural Metadata Sets
+         '060e2b34025301010d01010101010900', # Filler
 
-            self.data['header']['klvs'].append(klv)
+         '060e2b34025301010d01010101010f00', # Sequence
 
-        ### End of the parsing loop 1
+         '060e2b34025301010d01010101011100', # Source Clip
+         '060e2b34025301010d01010101011400', # Timecode Component
 
-        if self.debug:
-            print "Loaded ", len(self.data['header']['klvs']), "KLVs", self.fd.tell()
-            print "Skipped", dark, "dark KLVs"
+         '060e2b34025301010d01010101011800', # ContentStorage
 
-        self.data['header'].update({
-            'primer': header_metadata_primer_pack,
-            'preface': header_metadata_preface,
-            'avid_preface': avid_metadata_preface,
-        })
-        return
+         '060e2b34025301010d01010101012e00', # AVID
 
-    def write(self):
+         '060e2b34025301010d01010101013700', # Source Package (File, Physical)
 
-        fd = open(self.filename, 'w')
+         '060e2b34025301010d01010101013b00', # Timeline Track
 
-        for part in ('header', 'body', 'footer'):
-            if not self.data[part]['partition']:
-                print "part", part, "is empty"
-                continue
+         '060e2b34025301010d01010101014200', # GenericSoundEssenceDescriptor
+         '060e2b34025301010d01010101014400', # MultipleDescriptor
+         '060e2b34025301010d01010101014800', # WaveAudioDescriptor
+         ):
+            klv = MXFDataSet(fd, self.data['header']['primer'], elements=elements)
+            klv.read()
 
-            print "Writing part:", part
-            value = self.data[part]['partition']
-            value.fdesc = fd
-            value.write()
+        elif key in (
+         '060e2b34025301010d01010101012800', # CDCI Essence Descriptor
 
-            value = self.data[part]['klvs']
-            object_directory = []
-            for item in value:
-                item.fdesc = fd
+         # avid does not use standard 10 bytes ProductVersion
+         '060e2b34025301010d01010101013000', # Identification
 
-                # Build AvidObjectDirectory update
-                if hasattr(item, 'get_element'):
-                    object_directory.append((item.get_element('guid').read(), item.pos, 0))
+         '060e2b34025301010d01010101013600', # Material Package
+         '060e2b34025301010d01010101013f00', # AVID
+        ):
+            klv = AvidMXFDataSet(fd, self.data['header']['primer'], elements=elements)
+            klv.read()
 
-                if isinstance(item, AvidMetadataPreface):
-                    avid_preface = item
+        elif key == '9613b38a87348746f10296f056e04d2a':
+            # Avid ObjectDirectory
+            klv = AvidObjectDirectory(fd, True)
+            klv.read()
 
-                if isinstance(item, AvidObjectDirectory):
-                    item.data = object_directory
-                    avid_objdir = item
+        else:
+            klv = KLVDarkComponent(fd)
+            klv.read()
 
-                item.write()
+        return klv
+
+    def write(self, filename=None):
+        """ Write parsed file to @filename, in place by default.
+
+        Header metadata and footer KLVs are written from their objects, KLV
+        fill and dark values which were not modified being copied from the
+        source file. The Run-In and body are copied as is, only partition
+        packs are rewritten with updated offsets. In place rewrites go
+        through a temporary file renamed over the source one.
+
+        Written objects positions are updated, the parser cannot write the
+        file again unless it is read from the written one.
+        """
+
+        if filename is None:
+            filename = self.filename
+
+        if os.path.abspath(filename) == os.path.abspath(self.filename):
+            # Values must outlive the source file
+            for part in ('header', 'footer'):
+                for item in self.data[part]['klvs']:
+                    if getattr(item, 'source', None):
+                        item.data = item.load()
+
+            handle, path = tempfile.mkstemp(prefix=os.path.basename(filename) + '.', dir=os.path.dirname(os.path.abspath(filename)))
+            try:
+                self._write(os.fdopen(handle, 'wb'))
+                os.rename(path, filename)
+            except:
+                os.unlink(path)
+                raise
+        else:
+            self._write(open(filename, 'wb'))
+
+    def _write(self, fd):
+        """ Write parsed file to @fd, closed once done. """
+
+        source = open(self.filename, 'rb')
+        body = [item for item in self.data['partitions'] if item.key[13] == '\x03']
+        footer = self.data['footer']['partition']
+
+        # Source ranges copied as is, objects positions being updated by writes
+        last = self.data['header']['klvs'][-1]
+        ranges = [last.pos + 16 + last.bytes_num + last.length]
+        for item in body:
+            ranges += [item.pos, item.pos + 16 + item.bytes_num + item.length]
+        ranges.append(footer.pos)
+
+        run_in = self.run_in or 0
+        copy_range(source, fd, 0, run_in)
+
+        # Old partition offsets to new ones
+        offsets = {}
+
+        value = self.data['header']['partition']
+        value.fdesc = fd
+        offsets[value.pos - run_in] = fd.tell() - run_in
+        value.write()
+
+        avid_preface = None
+        avid_objdir = None
+        object_directory = []
+        for item in self.data['header']['klvs']:
+            item.fdesc = fd
+
+            # Build AvidObjectDirectory update
+            if hasattr(item, 'get_element'):
+                object_directory.append((item.get_element('guid').read(), item.pos, 0))
+
+            if isinstance(item, AvidMetadataPreface):
+                avid_preface = item
+
+            if isinstance(item, AvidObjectDirectory):
+                item.data = object_directory
+                avid_objdir = item
+
+            item.write()
+
+        # Body, copied up to each partition pack
+        for idx, item in enumerate(body):
+            copy_range(source, fd, ranges[2 * idx], ranges[2 * idx + 1] - ranges[2 * idx])
+            offsets[item.pos - run_in] = fd.tell() - run_in
+            item.fdesc = fd
+            item.write()
+        copy_range(source, fd, ranges[-2], ranges[-1] - ranges[-2])
+
+        offsets[footer.pos - run_in] = fd.tell() - run_in
+        footer.fdesc = fd
+        footer.write()
+
+        # Footer index section: index table segments and fill following them
+        index_start = index_end = None
+        in_index = False
+        for item in self.data['footer']['klvs']:
+            item.fdesc = fd
+            if isinstance(item, RandomIndexMetadata):
+                for entry in item.data['partition']:
+                    entry['byte_offset'] = offsets.get(entry['byte_offset'], entry['byte_offset'])
+            start = fd.tell()
+            item.write()
+
+            if isinstance(item, MXFIndexTableSegment):
+                if index_start is None:
+                    index_start = start
+                in_index = True
+                index_end = fd.tell()
+            elif in_index and type(item) is KLVFill:
+                index_end = fd.tell()
+            else:
+                in_index = False
 
         # Update Avid Metadata Preface
-        fd.seek(avid_preface.pos)
-        avid_preface.set_element('object_directory',
-           AvidOffset(AvidOffset(int(avid_objdir.pos)).write())
-        )
-        avid_preface.write()
+        if avid_preface and avid_objdir:
+            fd.seek(avid_preface.pos)
+            avid_preface.set_element('object_directory',
+               AvidOffset(AvidOffset(int(avid_objdir.pos)).write())
+            )
+            avid_preface.write()
+
+        # Partition packs linkage, rewritten at their new position
+        partitions = [self.data['header']['partition']] + body + [footer]
+        for item in partitions:
+            for name in ('this_partition', 'previous_partition', 'footer_partition'):
+                item.data[name] = offsets.get(item.data[name], item.data[name])
 
         # Update Header
-        fd.seek(0)
-        self.data['header']['partition'].data['footer_partition'] = self.data['footer']['partition'].pos
+        self.data['header']['partition'].data['footer_partition'] = footer.pos - run_in
 #        self.data['header']['partition'].data['header_byte_count'] = self.data['footer']['partition'].pos - (self.data['header']['partition'].length + 16 + 9)
 #
 #        if isinstance(self.data['header']['klvs'][0], KLVFill):
@@ -405,116 +1091,108 @@ class AvidParser(MXFParser):
 #            self.data['header']['partition'].data['header_byte_count'] -= (self.data['header']['klvs'][0].length + 16 + 9)
 
         self.data['header']['partition'].data['header_byte_count'] = sum(16 + 9 + klv.length for klv in self.data['header']['klvs'][1:])
-        self.data['header']['partition'].write()
-
-        # Update Footer
-        fd.seek(self.data['footer']['partition'].pos)
-        self.data['footer']['partition'].data['footer_partition'] = self.data['footer']['partition'].pos
-        self.data['footer']['partition'].data['this_partition'] = self.data['footer']['partition'].pos
-        self.data['footer']['partition'].write()
-
-        # Update Random Index Pack
-        # No need to seek after footer write
-        self.data['footer']['random_index_pack'].data['partition'] = [
-            {'body_sid': 0, 'byte_offset': self.data['header']['partition'].pos},
-            {'body_sid': 1, 'byte_offset': self.data['footer']['partition'].pos},
-        ]
-        self.data['footer']['random_index_pack'].write()
+        footer.data['index_byte_cout'] = index_start is not None and index_end - index_start or 0
+
+        for item in partitions:
+            fd.seek(item.pos)
+            item.write()
 
         if self.debug:
             print "Sum of header klv length:", sum(klv.length for klv in self.data['header']['klvs']) + self.data['header']['partition'].length
             print "Footer position:", self.data['footer']['partition'].pos
 
-        fd.truncate(fd.tell())
+        fd.close()
+        source.close()
 
 
 class OP1aParser(MXFParser):
 
-    def header_metadata_parse(self):
+    def header_metadata_parse(self, projection=None):
 
-        dark = 0
-        header_metadata_preface = None
         header_end = self.fd.tell() + self.data['header']['partition'].data['header_byte_count']
+        self.data['header'].update({
+            'primer': None,
+            'preface': None,
+        })
 
-        while self.fd.tell() <= header_end:
-            fd = self.fd
-            key = InterchangeObject.get_key(self.fd)
-
-            if key in ('060e2b34010101010201021001000000', \
-                '060e2b34010101010301021001000000'):
-                # KLV Fill item
-                klv = KLVFill(fd)
-                klv.read()
-
-            elif key == '060e2b34020501010d01020101050100':
-                # SMTPE 377M: Header Metadata (Primer Pack)
-                #if not isinstance(header_klvs[-1], KLVFill) and \
-                #    not isinstance(header_klvs[-1], MXFPartition):
-                #    raise Exception('Error: MXFPrimer not located after Header Partition Pack')
-                header_metadata_primer_pack = MXFPrimer(fd, debug=True)
-                header_metadata_primer_pack.read()
-                print header_metadata_primer_pack
-                klv = header_metadata_primer_pack
-
-            elif key == '060e2b34025301010d01010101012f00':
-                # SMTPE 377M: Header Metadata (Preface)
-                #if not isinstance(header_klvs[-1], KLVFill) and \
-                #    not isinstance(header_klvs[-1], MXFPrimer):
-                #    raise Exception('Error: MXFPrimer not located after Header Partition Pack')
-                header_metadata_preface = MXFPreface(fd, header_metadata_primer_pack)
-                header_metadata_preface.read()
-                klv = header_metadata_preface
-
-            elif key in (
-             # essence descriptions (130~180)
-             # SMPTE 377M: Strutural Metadata Sets
-             '060e2b34025301010d01010101010900', # Filler
-
-             '060e2b34025301010d01010101010f00', # Sequence
-
-             '060e2b34025301010d01010101011100', # Source Clip
-             '060e2b34025301010d01010101011400', # Timecode Component
-
-             '060e2b34025301010d01010101011800', # ContentStorage
-
-             '060e2b34025301010d01010101013000', # Identification
-             '060e2b34025301010d01010101013700', # Source Package (File, Physical)
-             '060e2b34025301010d01010101013600', # Material Package
-             '060e2b34025301010d01010101013b00', # Timeline Track
-
-             '060e2b34025301010d01010101012300', # EssenceContainerData
-             '060e2b34025301010d01010101012800', # CDCI Essence Descriptor
-             '060e2b34025301010d01010101014200', # GenericSoundEssenceDescriptor
-             '060e2b34025301010d01010101014400', # MultipleDescriptor
-             '060e2b34025301010d01010101014700', # AES3PCMDescriptor
-             '060e2b34025301010d01010101014800', # WaveAudioDescriptor
-             '060e2b34025301010d01010101015100', # MPEG2VideoDescriptor
-             ):
-                klv = MXFDataSet(fd, header_metadata_primer_pack)
-                klv.read()
+        klvs = self.header_klvs_parse(header_end, self.header_projection(projection, self.header_klv_decode))
+        self.data['header']['klvs'].extend(klvs)
+        dark = len([klv for klv in klvs if type(klv) is KLVDarkComponent])
 
-            else:
-                klv = KLVDarkComponent(fd)
-                klv.read()
-                dark += 1
+        if self.diagnostics:
+            self.diagnostics.emit('info', "Loaded %d KLVs" % len(self.data['header']['klvs']), self.fd.tell())
+            self.diagnostics.emit('info', "Skipped %d dark KLVs" % dark)
+            if projection is not None:
+                skipped = len([klv for klv in klvs if type(klv) is KLVSkipped])
+                self.diagnostics.emit('info', "Left out %d KLVs by projection" % skipped)
+        return
 
-            self.data['header']['klvs'].append(klv)
+    def header_klv_decode(self, fd, key, elements=None):
+        """ Returns the header metadata KLV with @key read at @fd position.
 
-        ### End of the parsing loop 1
+        @elements: element names to decode in sets, all by default.
+        """
 
-        if self.debug:
-            print "Loaded ", len(self.data['header']['klvs']), "KLVs", self.fd.tell()
-            print "Skipped", dark, "dark KLVs"
+        if key in ('060e2b34010101010201021001000000', \
+            '060e2b34010101010301021001000000'):
+            # KLV Fill item
+            klv = KLVFill(fd)
+            klv.read()
 
-        self.data['header'].update({
-            'primer': header_metadata_primer_pack,
-            'preface': header_metadata_preface,
-        })
-        return
+        elif key == '060e2b34020501010d01020101050100':
+            # SMTPE 377M: Header Metadata (Primer Pack)
+            #if not isinstance(header_klvs[-1], KLVFill) and \
+            #    not isinstance(header_klvs[-1], MXFPartition):
+            #    raise Exception('Error: MXFPrimer not located after Header Partition Pack')
+            klv = MXFPrimer(fd, debug=self.debug, diagnostics=self.diagnostics)
+            klv.read()
+            if self.diagnostics:
+                self.diagnostics.emit('debug', str(klv), klv.pos)
+            self.data['header']['primer'] = klv
+
+        elif key == '060e2b34025301010d01010101012f00':
+            # SMTPE 377M: Header Metadata (Preface)
+            #if not isinstance(header_klvs[-1], KLVFill) and \
+            #    not isinstance(header_klvs[-1], MXFPrimer):
+            #    raise Exception('Error: MXFPrimer not located after Header Partition Pack')
+            klv = MXFPreface(fd, self.data['header']['primer'], elements=elements)
+            klv.read()
+            self.data['header']['preface'] = klv
+
+        elif key in (
+         # essence descriptions (130~180)
+         # SMPTE 377M: Strutural Metadata Sets
+         '060e2b34025301010d01010101010900', # Filler
+
+         '060e2b34025301010d01010101010f00', # Sequence
+
+         '060e2b34025301010d01010101011100', # Source Clip
+         '060e2b34025301010d01010101011400', # Timecode Component
+
+         '060e2b34025301010d01010101011800', # ContentStorage
+
+         '060e2b34025301010d01010101013000', # Identification
+         '060e2b34025301010d01010101013700', # Source Package (File, Physical)
+         '060e2b34025301010d01010101013600', # Material Package
+         '060e2b34025301010d01010101013b00', # Timeline Track
+
+         '060e2b34025301010d01010101012300', # EssenceContainerData
+         '060e2b34025301010d01010101012800', # CDCI Essence Descriptor
+         '060e2b34025301010d01010101014200', # GenericSoundEssenceDescriptor
+         '060e2b34025301010d01010101014400', # MultipleDescriptor
+         '060e2b34025301010d01010101014700', # AES3PCMDescriptor
+         '060e2b34025301010d01010101014800', # WaveAudioDescriptor
+         '060e2b34025301010d01010101015100', # MPEG2VideoDescriptor
+         ):
+            klv = MXFDataSet(fd, self.data['header']['primer'], elements=elements)
+            klv.read()
 
+        else:
+            klv = KLVDarkComponent(fd)
+            klv.read()
 
-PARSERS = {
-    '060e2b34040101030e04020110000000': AvidParser,
-    '060e2b34040101010d0102010101..00': OP1aParser,
-}
+        return klv
 
+PARSERS = OperationalPatternRegistry()
+PARSERS.register('060e2b34040101030e04020110000000', AvidParser)
+PARSERS.register('060e2b34040101010d0102010101..00', OP1aParser)
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+""" Opt-in instrumentation of MXF parsing.
+
+Nothing in this module is used unless statistics are enabled, and no class
+is ever modified: a parser collecting statistics reads through an
+InstrumentedFile proxy, and only the KLV objects built on that proxy get
+their read and write methods wrapped. Other parsers of the process are
+left untouched.
+
+Converters and Primer misses are accounted from the values of the sets
+read, once decoded.
+"""
+
+import time
+
+from sjmxf.rp210types import Converter
+
+
+class InstrumentedFile(object):
+    """ File like object proxy counting I/O operations.
+
+    KLV objects built on the proxy are instrumented, see instrument().
+    """
+
+    def __init__(self, fdesc, statistics):
+        self.fdesc = fdesc
+        self.statistics = statistics
+
+    def read(self, size=-1):
+        data = self.fdesc.read(size)
+        self.statistics.counters['reads'] += 1
+        self.statistics.counters['bytes_read'] += len(data)
+        return data
+
+    def write(self, data):
+        self.statistics.counters['writes'] += 1
+        self.statistics.counters['bytes_written'] += len(data)
+        return self.fdesc.write(data)
+
+    def seek(self, offset, whence=0):
+        self.statistics.counters['seeks'] += 1
+        return self.fdesc.seek(offset, whence)
+
+    def reopen(self):
+        """ Returns a new, not instrumented, file on the same source, e.g. once closed. """
+
+        if hasattr(self.fdesc, 'reopen'):
+            return self.fdesc.reopen()
+        return open(self.fdesc.name, 'rb')
+
+    def instrument(self, klv):
+        """ Wrap read and write methods of @klv, an InterchangeObject built on this file. """
+
+        for name in ('read', 'write'):
+            setattr(klv, name, _wrap_io(klv, name, getattr(klv, name)))
+
+    def __getattr__(self, attribute):
+        return getattr(self.fdesc, attribute)
+
+
+class ParseStatistics(object):
+    """ Parsing statistics collector.
+
+    @callback: optional callable invoked after each instrumented KLV read or
+    write with (class name, method name, position, length, elapsed seconds).
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        """ Reset all counters. """
+
+        self.counters = {
+            'reads': 0,
+            'bytes_read': 0,
+            'writes': 0,
+            'bytes_written': 0,
+            'seeks': 0,
+            'primer_misses': 0,
+            'rp210_misses': 0,
+        }
+        self.klvs = {}
+        self.timings = {}
+        self.converters = {}
+
+    def stats(self):
+        """ Returns a dictionary of all collected statistics. """
+
+        ret = dict(self.counters)
+        ret.update({
+            'klvs': dict(self.klvs),
+            'time': dict(self.timings),
+            'converters': dict(self.converters),
+        })
+        return ret
+
+    def wrap(self, fdesc):
+        """ Returns an instrumented proxy of @fdesc. """
+
+        if isinstance(fdesc, InstrumentedFile):
+            fdesc = fdesc.fdesc
+        return InstrumentedFile(fdesc, self)
+
+    def enable(self):
+        """ Start accounting KLVs of instrumented files. """
+        self.enabled = True
+
+    def disable(self):
+        """ Stop accounting, instrumented KLVs call their methods straight. """
+        self.enabled = False
+
+    def record(self, klv, method, elapsed):
+        """ Account a KLV @method call of @elapsed seconds. """
+
+        name = klv.__class__.__name__
+        if method == 'read':
+            self.klvs[name] = self.klvs.get(name, 0) + 1
+            self.record_values(klv)
+
+        name += '.' + method
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+        if self.callback:
+            self.callback(klv.__class__.__name__, method, klv.pos, klv.length, elapsed)
+
+    def record_values(self, klv):
+        """ Account converters and Primer misses of values decoded by @klv. """
+
+        # Fill values are loaded on access, leave them alone
+        data = klv.__dict__.get('data')
+        if not isinstance(data, dict):
+            return
+
+        primer = getattr(klv, 'primer', None)
+        for tag, value in data.items():
+            if isinstance(value, Converter):
+                name = value.__class__.__name__
+                self.converters[name] = self.converters.get(name, 0) + 1
+            elif primer is not None and isinstance(value, basestring):
+                # Values left undecoded
+                if tag not in primer.data:
+                    self.counters['primer_misses'] += 1
+                elif primer.data[tag].encode('hex_codec') not in primer.rp210.data:
+                    self.counters['rp210_misses'] += 1
+
+
+def _wrap_io(klv, method_name, method):
+    """ Instrument the read or write @method of @klv. """
+
+    def wrapper(*args, **kwargs):
+        # Written KLVs usually moved to another, not instrumented, file
+        statistics = getattr(klv.fdesc, 'statistics', None)
+        if not statistics or not statistics.enabled:
+            return method(*args, **kwargs)
+
+        start = time.time()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            statistics.record(klv, method_name, time.time() - start)
+
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
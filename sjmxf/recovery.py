@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+""" Resynchronisation scanner for truncated or damaged MXF files. """
+
+import mmap
+import struct
+
+from sjmxf.common import InterchangeObject, Diagnostics
+from sjmxf.s377m import MXFPartition
+from sjmxf.parser import SMPTE_PARTITION_PACK_LABEL, SMPTE_RANDOM_INDEX_PACK_LABEL, SMPTE_RUN_IN_LIMIT
+
+# SMPTE 336M: Universal Label prefix
+SMPTE_UL_PREFIX = '\x06\x0e\x2b\x34'
+
+_PARTITION_PACK_PREFIX = SMPTE_PARTITION_PACK_LABEL.decode('hex_codec')
+_PARTITION_KINDS = {'\x02': 'header', '\x03': 'body', '\x04': 'footer'}
+
+
+class RecoveryScanner(object):
+    """ Locate the readable parts of a truncated or damaged MXF file.
+
+    The file is memory mapped and walked KLV by KLV, reading keys and BER
+    lengths only. When the walk meets a KLV that does not fit, the next
+    bytes are searched in bulk for the Universal Label prefix, candidates
+    being trusted once followed by @chain_depth well formed KLVs with
+    Universal Label keys, or reaching the end of file.
+
+    Damage inside KLV values does not break the chain and is not detected,
+    use IntegrityChecker digests for that.
+
+    @chain_depth: KLVs with Universal Label keys needed to resynchronise.
+    """
+
+    # Non Universal Label keys (e.g. Avid dark sets) followed while chaining
+    MAX_DARK_KLVS = 256
+
+    def __init__(self, filename, diagnostics=None, chain_depth=3):
+        self.filename = filename
+        self.chain_depth = chain_depth
+        if diagnostics is not None:
+            self.diagnostics = diagnostics
+        else:
+            self.diagnostics = Diagnostics()
+
+        self.size = 0
+        self.run_in = 0
+        # [start, end) file ranges of consecutive well formed KLVs
+        self.ranges = []
+        # Partition packs found, in file order
+        self.partitions = []
+        # Position of a KLV cut by the end of file
+        self.truncated = None
+        self.random_index_pack_pos = None
+
+    def scan(self):
+        """ Walk the whole file.
+
+        @returns: the list of recoverable [start, end) file ranges.
+        """
+
+        fdesc = open(self.filename, 'rb')
+        try:
+            fdesc.seek(0, 2)
+            self.size = fdesc.tell()
+            try:
+                data = mmap.mmap(fdesc.fileno(), 0, access=mmap.ACCESS_READ)
+            except (mmap.error, ValueError, AttributeError):
+                fdesc.seek(0)
+                data = fdesc.read()
+
+            try:
+                self._scan(data)
+            finally:
+                if isinstance(data, mmap.mmap):
+                    data.close()
+        finally:
+            fdesc.close()
+
+        return self.ranges
+
+    def _scan(self, data):
+        self.ranges = []
+        self.partitions = []
+        self.truncated = None
+        self.random_index_pack_pos = None
+
+        pos = self._resync(data, 0)
+        while pos is not None:
+            end = self._walk(data, pos)
+            self.ranges.append((pos, end))
+            if end >= self.size:
+                break
+
+            pos = self._resync(data, end + 1)
+            if pos is None and SMPTE_UL_PREFIX.startswith(data[end:end + 4]):
+                # Last KLV cut by the end of file
+                self.truncated = end
+                self.diagnostics.emit('error', 'KLV truncated by the end of file', end, check='truncated')
+            elif pos is None:
+                self.diagnostics.emit('warning', 'Damaged bytes up to the end of file', end, check='damaged')
+            else:
+                self.diagnostics.emit('warning', 'Damaged bytes up to %d' % pos, end, check='damaged')
+
+        # Partition offsets are relative to the Header Partition Pack
+        headers = [item['pos'] for item in self.partitions if item['kind'] == 'header']
+        if headers and headers[0] <= SMPTE_RUN_IN_LIMIT:
+            self.run_in = headers[0]
+        else:
+            self.run_in = 0
+
+        for item in self.partitions:
+            item['offset'] = item['pos'] - self.run_in
+            if item.get('this_partition') != item['offset']:
+                self.diagnostics.emit('warning', 'ThisPartition %s, found at %d' % (item.get('this_partition'), item['offset']),
+                    item['pos'], check='partition_linkage')
+
+    def _klv_at(self, data, pos):
+        """ Returns the end position of the KLV at @pos, None if it does not fit in the file. """
+
+        if pos + 17 > self.size:
+            return None
+
+        size = ord(data[pos + 16])
+        if not size & 0x80:
+            end = pos + 17 + size
+        else:
+            bytes_num = size & 0x7f
+            if not 0 < bytes_num <= 8 or pos + 17 + bytes_num > self.size:
+                return None
+            end = pos + 17 + bytes_num + int(data[pos + 17:pos + 17 + bytes_num].encode('hex_codec'), 16)
+
+        if end > self.size:
+            return None
+        return end
+
+    def _chained(self, data, pos, depth):
+        """ True if @depth KLVs with Universal Label keys chain from @pos. """
+
+        found = 0
+        dark = 0
+        while pos < self.size:
+            end = self._klv_at(data, pos)
+            if end is None:
+                return False
+
+            if data[pos:pos + 4] == SMPTE_UL_PREFIX:
+                found += 1
+                if found >= depth:
+                    return True
+            else:
+                dark += 1
+                if dark > self.MAX_DARK_KLVS:
+                    return False
+            pos = end
+
+        # Chained up to the end of file
+        return True
+
+    def _resync(self, data, start):
+        """ Returns the first trusted KLV position from @start, None if none. """
+
+        idx = data.find(SMPTE_UL_PREFIX, start)
+        while idx != -1:
+            if self._chained(data, idx, self.chain_depth):
+                return idx
+            idx = data.find(SMPTE_UL_PREFIX, idx + 1)
+        return None
+
+    def _walk(self, data, pos):
+        """ Follow KLVs from trusted @pos, returns the end of the last well formed one. """
+
+        while pos < self.size:
+            end = self._klv_at(data, pos)
+            if end is None:
+                break
+
+            key = data[pos:pos + 16]
+            if key[0:4] != SMPTE_UL_PREFIX:
+                # Dark KLV, kept when Universal Label keys follow
+                if end < self.size and not self._chained(data, end, 1):
+                    break
+            elif key[0:12] == _PARTITION_PACK_PREFIX and key[12] == '\x01' and key[13] in _PARTITION_KINDS:
+                self._partition(data, pos, key)
+            elif key.encode('hex_codec') == SMPTE_RANDOM_INDEX_PACK_LABEL:
+                self.random_index_pack_pos = pos
+
+            pos = end
+        return pos
+
+    def _partition(self, data, pos, key):
+        length, bytes_num = InterchangeObject.ber_decode_length_details(data[pos + 16:pos + 25])
+        item = {'pos': pos, 'kind': _PARTITION_KINDS[key[13]], 'key': key}
+
+        start = pos + 16 + bytes_num
+        if length >= MXFPartition._struct.size:
+            values = MXFPartition._struct.unpack(data[start:start + MXFPartition._struct.size])
+            for (name, _, _), value in zip(MXFPartition._compound, values):
+                item[name] = value
+        else:
+            self.diagnostics.emit('warning', 'Truncated Partition Pack', pos, check='partition_pack')
+
+        self.partitions.append(item)
+
+    def damaged(self):
+        """ Returns the [start, end) file ranges, Run-In excluded, not covered by recoverable ones. """
+
+        ret = []
+        pos = self.run_in
+        for start, end in self.ranges:
+            if start > pos:
+                ret.append((pos, start))
+            pos = end
+        if pos < self.size:
+            ret.append((pos, self.size))
+        return ret
+
+    def partition_table(self):
+        """ Returns (offset, BodySID) of partitions found, as Random Index Pack entries. """
+
+        return [(item['offset'], item.get('body_sid', 0)) for item in self.partitions]
+
+    def random_index_pack(self):
+        """ Returns a Random Index Pack KLV rebuilt from the partitions found. """
+
+        value = ''.join([struct.pack('>IQ', body_sid, offset) for offset, body_sid in self.partition_table()])
+        value += struct.pack('>I', 16 + 9 + len(value) + 4)
+        return SMPTE_RANDOM_INDEX_PACK_LABEL.decode('hex_codec') \
+            + InterchangeObject.ber_encode_length(len(value), bytes_num=8).decode('hex_codec') + value
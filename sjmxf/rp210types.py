@@ -3,9 +3,10 @@
 
 """ Set of classes to help convert RP210 defined types. """
 
-from sjmxf.common import InterchangeObject
+from sjmxf.common import InterchangeObject, UL
 from datetime import datetime
 import re
+import struct
 
 CONVERTERS = ['Reference', 'Version', 'Integer', 'Boolean', 'TimeStamp', 'String', 'Rational', 'Length', 'Array', 'VariableArray', 'AvidOffset', 'AvidVersion', 'XID']
 
@@ -35,6 +36,15 @@ class RP210TypesException(Exception):
         Exception.__init__(self, message)
 
 
+def unpack_compound(codec, value, vtype):
+    """ Decode fixed layout @value of @vtype type with @codec struct.Struct. """
+
+    try:
+        return codec.unpack_from(value)
+    except struct.error:
+        raise RP210TypesException('Invalid %s length: %d bytes' % (vtype, len(value)))
+
+
 class Converter(object):
     """ Base class for RP210 type converters.
 
@@ -209,6 +219,12 @@ class Reference(Converter):
     def __str__(self):
         return self.value.encode('hex_codec')
 
+    def read(self):
+        # Labels and UUIDs are interned
+        if len(self.value) == 16:
+            self.value = UL(self.value)
+        return self.value
+
 
 class Version(Converter):
     """ RP210 Version converter. """
@@ -227,6 +243,12 @@ class Version(Converter):
         ],
     }
 
+    # _compound layouts
+    _structs = {
+        'ProductVersion': struct.Struct('>HHHHH'),
+        'VersionType': struct.Struct('>BB'),
+    }
+
     caps = re.compile('(ProductVersion|VersionType)')
 
     def __init__(self, value, match):
@@ -239,21 +261,10 @@ class Version(Converter):
         return '.'.join([str(item.__str__()) for item in self.read()])
 
     def read(self):
-        ret = []
-        offset = 0
-        for _item, itype in self._compound[self.type]:
-            value = self.value[offset:offset+Integer(None, itype).length]
-            ret.append(Integer(value, itype).read())
-            offset += len(value)
-
-        return ret
+        return list(unpack_compound(self._structs[self.type], self.value, self.type))
 
     def write(self):
-        ret = []
-        for index, itype in enumerate(self._compound[self.type]):
-            ret.append(Integer(self.value[index], itype[1]).write())
-
-        return ''.join(ret)
+        return self._structs[self.type].pack(*self.value)
 
 
 class TimeStamp(Converter):
@@ -269,18 +280,16 @@ class TimeStamp(Converter):
         ('microsecond', 'UInt8'),
     )
 
+    # _compound layout
+    _struct = struct.Struct('>HBBBBBB')
+
     caps = 'TimeStamp'
 
     def __str__(self):
         return str(self.read()) or 'Unknown timestamp'
 
     def read(self):
-        ret = []
-        offset = 0
-        for _item, itype in self._compound:
-            value = self.value[offset:offset+Integer(None, itype).length]
-            ret.append(Integer(value, itype).read())
-            offset += len(value)
+        ret = list(unpack_compound(self._struct, self.value, 'TimeStamp'))
 
         # milliseconds are represented as 1/4 of the real value
         ret[-1] = ret[-1] * 4
@@ -297,7 +306,7 @@ class TimeStamp(Converter):
     def write(self):
         ret = []
         if self.value:
-            for item, itype in self._compound:
+            for item, _itype in self._compound:
                 if item == 'microsecond':
                     value = getattr(self.value, item)
                     if value > 0:
@@ -306,12 +315,11 @@ class TimeStamp(Converter):
                         value = value / (100 * 4) / 1000000
                 else:
                     value = getattr(self.value, item)
-                ret.append(Integer(value, itype).write())
+                ret.append(value)
         else:
-            for _item, itype in self._compound:
-                ret.append(Integer(0, itype).write())
+            ret = [0] * len(self._compound)
 
-        return ''.join(ret)
+        return self._struct.pack(*ret)
 
 
 class Integer(Converter):
@@ -356,18 +364,18 @@ class XID(Integer):
 class Rational(Converter):
     """ RP210 Rational converter. """
 
+    _struct = struct.Struct('>II')
+
     caps = 'Rational'
 
     def __str__(self):
         return '%d/%d' % self.read()
 
     def read(self):
-        num = Integer(self.value[0:4], 'UInt32').read()
-        den = Integer(self.value[4:8], 'UInt32').read()
-        return (num, den)
+        return unpack_compound(self._struct, self.value, 'Rational')
 
     def write(self):
-        return Integer(self.value[0], 'UInt32').write() + Integer(self.value[1], 'UInt32').write()
+        return self._struct.pack(*self.value)
 
 
 class Boolean(Converter):
@@ -472,6 +480,11 @@ class AvidVersion(Version):
         ],
     }
 
+    # _compound layouts
+    _structs = {
+        'AvidVersion': struct.Struct('>HHHHB'),
+    }
+
     caps = re.compile('(AvidVersion)')
 
 
@@ -3,11 +3,17 @@
 """ Implements basic classes to parse SMPTE S377-1-2009 compliant MXF files. """
 
 import re
+import struct
 
-from sjmxf.common import InterchangeObject, OrderedDict, Singleton
+from sjmxf.common import InterchangeObject, OrderedDict, Singleton, UL, DIAGNOSTICS, copy_range
 from sjmxf.rp210 import RP210Exception, RP210
 from sjmxf.rp210types import Array, Reference, Integer, select_converter, RP210TypesException
 
+# Local set value lengths
+_UINT16 = struct.Struct('>H')
+
+_PRIMER_PACK_KEY = UL('060e2b34020501010d01020101050100'.decode('hex_codec'))
+
 class S377MException(Exception):
     """ Raised on non SMPTE 377M input. """
 
@@ -17,24 +23,89 @@ class S377MException(Exception):
 
 
 class KLVFill(InterchangeObject):
-    """ KLVFill parser. """
+    """ KLVFill parser.
+
+    Values read from a file are not loaded: their position is kept as a
+    source reference and the value is read on first access to data. Values
+    which were not modified are copied from their source by write.
+    """
+
+    # (file, value position) of a value not loaded yet
+    source = None
 
     def __init__(self, fdesc, debug=False):
+        self._data = None
         InterchangeObject.__init__(self, fdesc, debug)
 
     def __str__(self):
         return "<KLVFill pos=%d size=%d>" % (self.pos, self.length)
 
+    def _get_data(self):
+        if self._data is None and self.source:
+            self._data = self.load()
+        return self._data
+
+    def _set_data(self, data):
+        self._data = data
+        self.source = None
+
+    data = property(_get_data, _set_data)
+
+    @staticmethod
+    def _reopen(fdesc):
+        """ Returns a new file on closed source @fdesc. """
+
+        if hasattr(fdesc, 'reopen'):
+            return fdesc.reopen()
+        return open(fdesc.name, 'rb')
+
+    def load(self):
+        """ Returns the value read from its source, without moving the source cursor. """
+
+        fdesc, pos = self.source
+        if fdesc.closed:
+            fdesc = self._reopen(fdesc)
+            try:
+                fdesc.seek(pos)
+                return fdesc.read(self.length)
+            finally:
+                fdesc.close()
+
+        cursor = fdesc.tell()
+        try:
+            fdesc.seek(pos)
+            return fdesc.read(self.length)
+        finally:
+            fdesc.seek(cursor)
+
     def read(self):
         """ KLV Fill data has no value. """
 
         if self.debug:
             print "data:", self.fdesc.read(self.length).encode('hex_codec')
+        elif isinstance(self.fdesc, file) or hasattr(self.fdesc, 'reopen'):
+            # Value left in the file until accessed
+            self.source = (self.fdesc, self.fdesc.tell())
+            self.fdesc.seek(self.length, 1)
         else:
             self.data = self.fdesc.read(self.length)
 
     def write(self):
         self.pos = self.fdesc.tell()
+        if self._data is None and self.source:
+            # Unmodified value, copied from its source
+            self.fdesc.write(self.key + self.ber_encode_length(self.length, bytes_num=8).decode('hex_codec'))
+            fdesc, pos = self.source
+            if fdesc.closed:
+                fdesc = self._reopen(fdesc)
+                try:
+                    copy_range(fdesc, self.fdesc, pos, self.length)
+                finally:
+                    fdesc.close()
+            else:
+                copy_range(fdesc, self.fdesc, pos, self.length)
+            return
+
         self.length = len(self.data)
         self.fdesc.write(self.key + self.ber_encode_length(self.length, bytes_num=8).decode('hex_codec') + self.data)
 
@@ -48,6 +119,23 @@ class KLVDarkComponent(KLVFill):
         return "<KLVDarkComponent pos=%d size=%d ul=%s >" % (self.pos, self.length, self.key.encode('hex_codec'))
 
 
+class KLVSkipped(InterchangeObject):
+    """ KLV left out by a header metadata projection, only its key, position and length are kept. """
+
+    def __init__(self, fdesc, debug=False):
+        InterchangeObject.__init__(self, fdesc, debug)
+
+    def __str__(self):
+        return "<KLVSkipped pos=%d size=%d ul=%s >" % (self.pos, self.length, self.key.hex)
+
+    def read(self):
+        """ Value is not read, the cursor is moved past it. """
+        self.fdesc.seek(self.length, 1)
+
+    def write(self):
+        raise S377MException('Cannot write a skipped KLV, its value was never read')
+
+
 class MXFPartition(InterchangeObject):
     """ MXF Partition Pack parser. """
 
@@ -67,12 +155,15 @@ class MXFPartition(InterchangeObject):
         #('essence_containers',  'Batch of Universal Labels', 8 + 16n),
     ]
 
+    # _compound layout
+    _struct = struct.Struct('>HHIQQQQQIQI16s')
+
     def __init__(self, fdesc, debug=False):
         InterchangeObject.__init__(self, fdesc, debug)
         self.data = OrderedDict()
 
-        if not re.search('060e2b34020501010d01020101(0[2-4])(0[0-4])00', self.key.encode('hex_codec')):
-            raise S377MException('Not a valid Partition Pack key: %s' % self.key.encode('hex_codec'))
+        if not re.search('060e2b34020501010d01020101(0[2-4])(0[0-4])00', self.key.hex):
+            raise S377MException('Not a valid Partition Pack key: %s' % self.key.hex)
 
     def __str__(self):
         return '<MXF%(type)sPartition pos=%(pos)s %(openness)s and %(completeness)s>' % {
@@ -107,17 +198,16 @@ class MXFPartition(InterchangeObject):
             raise S377MException('Invalid value for BodySID in Partition Pack')
 
     def read(self):
-        idx = 0
         data = self.fdesc.read(self.length)
 
         # Read Partition Pack items
-        for pp_item, pp_type, pp_size in self._compound:
-            conv = select_converter(pp_type)
-            self.data[pp_item] = conv(data[idx:idx+pp_size], pp_type).read()
-            idx += pp_size
+        if len(data) < self._struct.size:
+            raise S377MException('Truncated Partition Pack: %d bytes' % len(data))
+        for (pp_item, _, _), value in zip(self._compound, self._struct.unpack_from(data)):
+            self.data[pp_item] = value
 
         # Read essence containers list, if any
-        self.data['essence_containers'] = Array(data[idx:], 'Batch of Universal Labels').read()
+        self.data['essence_containers'] = Array(data[self._struct.size:], 'Batch of Universal Labels').read()
 
         self.__smtpe_377m_check()
 
@@ -127,11 +217,7 @@ class MXFPartition(InterchangeObject):
         return
 
     def write(self):
-        ret = ""
-        for pp_item, pp_type, _ in self._compound:
-            conv = select_converter(pp_type)
-            ret += conv(self.data[pp_item], pp_type).write()
-
+        ret = self._struct.pack(*[self.data[pp_item] for pp_item, _, _ in self._compound])
         ret += Array(self.data['essence_containers'], 'Batch of Universal Labels').write()
 
         self.pos = self.fdesc.tell()
@@ -154,17 +240,27 @@ class MXFPartition(InterchangeObject):
 class MXFPrimer(InterchangeObject):
     """ MXF Primer Pack parser. """
 
-    def __init__(self, fdesc, rp210=None, debug=False):
+    # Set layouts kept per set type, variable length values may give many
+    MAX_LAYOUTS = 64
+
+    def __init__(self, fdesc, rp210=None, debug=False, diagnostics=None):
         InterchangeObject.__init__(self, fdesc, debug)
         self.data = OrderedDict()
+        self._decoders = {}
+        self._customized = {}
+
+        if diagnostics is not None:
+            self.diagnostics = diagnostics
+        else:
+            self.diagnostics = DIAGNOSTICS
 
         if rp210:
             self.rp210 = rp210
         else:
             self.rp210 = Singleton(RP210)
 
-        if self.key and not re.search('060e2b34020501..0d01020101050100', self.key.encode('hex_codec')):
-            raise S377MException('Not a valid Primer Pack key: %s' % self.key.encode('hex_codec'))
+        if self.key and not self.key.matches(_PRIMER_PACK_KEY):
+            raise S377MException('Not a valid Primer Pack key: %s' % self.key.hex)
 
     def __str__(self):
         ret = ['<MXFPrimer']
@@ -182,23 +278,34 @@ class MXFPrimer(InterchangeObject):
         """ Modifies a primer to abide @spec rules with optional @mappings.
 
         @spec: instance of a sjmxf.rp210 like object
-        @mappings: a dictionary that is passed to inject method
+        @mappings: a dictionary of extra RP210 items, inserted in a variant
+        of @spec and in the Primer copy
+
+        Customized Primers are created once per @primer, spec variant and
+        mappings, @spec is not modified.
 
         @returns: custimized Primer object.
         """
 
         import copy
-        aprim = copy.copy(primer)
 
         if mappings:
-            spec.inject(mappings)
+            spec = spec.derive(mappings)
+            try:
+                return primer._customized[spec]
+            except KeyError:
+                pass
 
+        aprim = copy.copy(primer)
         aprim.data = {}
         aprim.data.update(primer.data)
         aprim.rp210 = spec
+        aprim._decoders = {}
+        aprim._customized = {}
 
         if mappings:
             aprim.inject(mappings.keys())
+            primer._customized[spec] = aprim
 
         return aprim
 
@@ -210,7 +317,9 @@ class MXFPrimer(InterchangeObject):
         """
 
         for item in mappings:
-            self.data[item.decode('hex_codec')] = item.rjust(32, '0').decode('hex_codec')
+            self.data[item.decode('hex_codec')] = UL(item.rjust(32, '0').decode('hex_codec'))
+        self._decoders = {}
+        self._customized = {}
         return
 
     def read(self):
@@ -224,6 +333,8 @@ class MXFPrimer(InterchangeObject):
         while lt_list_size > len(self.data):
             self.data[data[idx:idx+2]] = Reference(data[idx+2:idx+lt_item_size], 'Universal Label').read()
             idx += lt_item_size
+        self._decoders = {}
+        self._customized = {}
 
         if self.debug:
             print "%d local tag mappings in Primer Pack" % len(self.data)
@@ -245,14 +356,18 @@ class MXFPrimer(InterchangeObject):
         self.fdesc.write(self.key + self.ber_encode_length(self.length, bytes_num=8).decode('hex_codec') + ret)
         return
 
-    def decode_from_local_tag(self, tag, value):
-        """ Decode data according to local tag mapping to format Universal Labels. """
+    def decode_from_local_tag(self, tag, value, pos=None):
+        """ Decode data according to local tag mapping to format Universal Labels.
+
+        @pos: position of the set being decoded, given in diagnostics.
+        """
 
         etag = tag.encode('hex_codec')
         evalue = value.encode('hex_codec')
 
-        if tag not in self.data.keys():
-            print "Error: Local key '%s' not found in primer" % etag
+        if tag not in self.data:
+            if self.diagnostics:
+                self.diagnostics.emit('warning', "Local key '%s' not found in primer" % etag, pos, tag=etag)
             return etag, evalue
 
         #if not self.data[tag].startswith('060e2b34'.decode('hex_codec')):
@@ -264,9 +379,117 @@ class MXFPrimer(InterchangeObject):
             key = self.rp210.get_triplet_from_format_ul(self.data[tag])[1]
             return key, self.rp210.convert(self.data[tag], value)
         except RP210Exception, error:
-            print error
+            if self.diagnostics:
+                self.diagnostics.emit('warning', str(error), pos, tag=etag)
             return key, evalue
 
+    def _bind(self, tag):
+        """ Returns (element name, converter factory) of @tag, None when it cannot be decoded. """
+
+        try:
+            format_ul = self.data[tag]
+            return self.rp210.get_triplet_from_format_ul(format_ul)[1], self.rp210.converter(format_ul)
+        except (KeyError, RP210Exception):
+            return None
+
+    def _element_name(self, tag):
+        """ Element name decode_from_local_tag gives to @tag, without diagnostics. """
+
+        if tag not in self.data:
+            return tag.encode('hex_codec')
+        try:
+            return self.rp210.get_triplet_from_format_ul(self.data[tag])[1]
+        except RP210Exception:
+            return "unkown_data_format"
+
+    def decoder(self, set_key, elements=None):
+        """ Returns the decode function of @set_key sets values.
+
+        Decode functions are compiled once per set type: local tags are bound
+        to their element name and converter on first use. Sets of the same
+        type usually share the same local tag and value length sequence, the
+        layout of each such sequence is kept as a plan holding value offsets,
+        converters and the element name mapping, later sets replaying it.
+        Tags that cannot be bound go through decode_from_local_tag when
+        values are decoded, not when layouts are planned, so that their
+        diagnostics are emitted once per set.
+
+        The returned function takes a set value and the set position, and
+        returns an element name to local tag mapping, shared by sets of the
+        same layout, and a list of (local tag, converted value) tuples.
+
+        @elements: element names to decode, others being left out of the
+        mapping and values. InstanceUID is always decoded.
+        """
+
+        if elements is not None:
+            elements = frozenset(elements)
+
+        try:
+            return self._decoders[set_key, elements]
+        except KeyError:
+            pass
+
+        bindings = {}
+        plans = {}
+        bind = self._bind
+        unpack = _UINT16.unpack_from
+
+        def plan(data, fingerprint):
+            mapping = {}
+            entries = []
+            offset = 0
+            size = len(data)
+            while offset < size:
+                localtag = data[offset:offset+2]
+                end = offset + 4 + unpack(data, offset + 2)[0]
+                try:
+                    binding = bindings[localtag]
+                except KeyError:
+                    binding = bindings[localtag] = bind(localtag)
+
+                if binding is None:
+                    element_name = self._element_name(localtag)
+                    factory = None
+                else:
+                    element_name, factory = binding
+
+                if elements is None or element_name in elements or localtag == '\x3c\x0a':
+                    entries.append((localtag, offset + 4, end, factory))
+                    mapping[element_name] = localtag
+                offset = end
+
+            ret = mapping, entries
+            if len(plans) < MXFPrimer.MAX_LAYOUTS:
+                plans[fingerprint] = ret
+            return ret
+
+        def decode(data, pos=None):
+            # Layout fingerprint: local tags and value lengths
+            headers = []
+            offset = 0
+            size = len(data)
+            while offset < size:
+                headers.append(data[offset:offset+4])
+                offset += 4 + unpack(data, offset + 2)[0]
+            fingerprint = ''.join(headers)
+
+            try:
+                mapping, entries = plans[fingerprint]
+            except KeyError:
+                mapping, entries = plan(data, fingerprint)
+
+            items = []
+            for localtag, start, end, factory in entries:
+                if factory is None:
+                    items.append((localtag, self.decode_from_local_tag(localtag, data[start:end], pos)[1]))
+                else:
+                    items.append((localtag, factory(data[start:end])))
+            return mapping, items
+
+        self._decoders[set_key, elements] = decode
+        return decode
+
     def encode_from_local_tag(self, tag, value):
         """ Encode data according to local tag mapping to format Universal Labels. """
 
@@ -281,8 +504,11 @@ class MXFPrimer(InterchangeObject):
         except RP210Exception:
             return tag, value
 
-    def get_mapping(self, tag):
-        """ Shows Primer/RP210 mapping for @tag local tag. """
+    def get_mapping(self, tag, pos=None):
+        """ Shows Primer/RP210 mapping for @tag local tag.
+
+        @pos: position of the set holding @tag, given in diagnostics.
+        """
 
         try:
             format_ul = self.data[tag]
@@ -292,7 +518,8 @@ class MXFPrimer(InterchangeObject):
         try:
             return format_ul, self.rp210.get_triplet_from_format_ul(format_ul)
         except RP210Exception, error:
-            print error
+            if self.diagnostics:
+                self.diagnostics.emit('warning', str(error), pos, tag=tag.encode('hex_codec'))
             return format_ul, ('unknown_type', 'unknown_data_format', '')
 
 
@@ -329,23 +556,27 @@ class MXFDataSet(InterchangeObject):
          '060e2b34025301010d01010101015100': 'MPEG2VideoDescriptor',
     }
 
-    def __init__(self, fdesc, primer, debug=False, dark=False):
+    def __init__(self, fdesc, primer, debug=False, dark=False, elements=None):
         InterchangeObject.__init__(self, fdesc, debug)
         self.primer = primer
         self.dark = dark
+        # Element names to decode, all by default
+        self.elements = elements
         self.data = OrderedDict()
         self.set_type = 'DataSet'
         self.element_mapping = {}
+        self._shared_mapping = False
 
-        if self.key.encode('hex_codec') not in MXFDataSet.dataset_names.keys():
-            #print "MXFDataSet is dark", self.key.encode('hex_codec')
+        ekey = self.key.hex
+        if ekey not in MXFDataSet.dataset_names:
+            #print "MXFDataSet is dark", ekey
             self.dark = True
             self.set_type = 'Dark' + self.set_type
         else:
-            self.set_type = MXFDataSet.dataset_names[self.key.encode('hex_codec')]
+            self.set_type = MXFDataSet.dataset_names[ekey]
 
         if not self.dark:
-            if not self.key.encode('hex_codec').startswith('060e2b34'):
+            if not ekey.startswith('060e2b34'):
                 raise S377MException('Not a SMPTE administrated label')
 
             if self.key[4] != '\x02':
@@ -374,6 +605,10 @@ class MXFDataSet(InterchangeObject):
 
     def rm_element(self, element_name):
         if self.element_mapping.get(element_name, None):
+            if self._shared_mapping:
+                # Mapping is shared with sets of the same layout, copy on write
+                self.element_mapping = dict(self.element_mapping)
+                self._shared_mapping = False
             del self.data[self.element_mapping[element_name]]
             del self.element_mapping[element_name]
             return True
@@ -393,25 +628,21 @@ class MXFDataSet(InterchangeObject):
     def read(self):
         """ Generic read method for sets and packs. """
 
-        idx = 0
         data = self.fdesc.read(self.length)
 
-        # Get all items
-        offset = idx
-        while offset < idx + self.length:
-            set_size = Integer(data[offset+2:offset+4], 'UInt16').read()
-            localtag = data[offset:offset+2]
-            localdata = data[offset+4:offset+set_size+4]
-            offset += set_size + 4
-
-            element_name, cvalue = self.primer.decode_from_local_tag(localtag, localdata)
-            self.element_mapping.update({element_name: localtag})
-            self.data.update({localtag: cvalue})
+        # Get all items, with the decoder compiled for this set type
+        self.element_mapping, items = self.primer.decoder(self.key, self.elements)(data, self.pos)
+        self._shared_mapping = True
+        for localtag, cvalue in items:
+            self.data[localtag] = cvalue
 
         return
 
     def write(self):
 
+        if self.elements is not None:
+            raise S377MException('Cannot write a projected set, only some of its elements were read')
+
         ret = []
         for tag, value in self.data.items():
             # Not all values are decoded
@@ -438,9 +669,9 @@ class MXFDataSet(InterchangeObject):
 
         for i, j in self.data.items():
 
-            element_name = self.primer.get_mapping(i)[1][1]
+            element_name = self.primer.get_mapping(i, self.pos)[1][1]
             if len(element_name) == 0:
-                element_name = self.primer.get_mapping(i)[1][2]
+                element_name = self.primer.get_mapping(i, self.pos)[1][2]
 
 
             if element_name == 'guid':
@@ -491,14 +722,175 @@ class MXFDataSet(InterchangeObject):
 class MXFPreface(MXFDataSet):
     """ MXF Metadata Preface parser. """
 
-    def __init__(self, fdesc, debug=False):
-        MXFDataSet.__init__(self, fdesc, debug)
+    def __init__(self, fdesc, debug=False, elements=None):
+        MXFDataSet.__init__(self, fdesc, debug, elements=elements)
         self.set_type = 'Preface'
 
 
+class MXFIndexTableSegment(InterchangeObject):
+    """ MXF Index Table Segment parser.
+
+    Index Table Segments use static local tags (SMPTE 377M, section 10) and
+    are therefore decoded without the help of the Primer Pack.
+    """
+
+    _compound = [
+        ('\x3c\x0a', 'instance_uid',         'UUID'),
+        ('\x3f\x0b', 'index_edit_rate',      'Rational'),
+        ('\x3f\x0c', 'index_start_position', 'Int64'),
+        ('\x3f\x0d', 'index_duration',       'Int64'),
+        ('\x3f\x05', 'edit_unit_byte_count', 'UInt32'),
+        ('\x3f\x06', 'index_sid',            'UInt32'),
+        ('\x3f\x07', 'body_sid',             'UInt32'),
+        ('\x3f\x08', 'slice_count',          'UInt8'),
+        ('\x3f\x0e', 'pos_table_count',      'UInt8'),
+    ]
+
+    def __init__(self, fdesc, debug=False):
+        InterchangeObject.__init__(self, fdesc, debug)
+        self.data = OrderedDict()
+        self.data['delta_entries'] = []
+        self.data['index_entries'] = []
+        self._tags = []
+
+        if not re.search('060e2b34025301010d01020101100100', self.key.hex):
+            raise S377MException('Not a valid Index Table Segment key: %s' % self.key.hex)
+
+    def __str__(self):
+        return '<MXFIndexTableSegment pos=%d size=%d start=%d duration=%d entries=%d>' % (
+            self.pos, self.length,
+            self.data.get('index_start_position', 0),
+            self.data.get('index_duration', 0),
+            len(self.data['index_entries'])
+        )
+
+    @staticmethod
+    def _converter(itype, value):
+        """ Build RP210 converter for @value of RP210 type @itype. """
+        conv = select_converter(itype)
+        if hasattr(conv.caps, 'search'):
+            return conv(value, itype)
+        return conv(value)
+
+    def read(self):
+
+        data = self.fdesc.read(self.length)
+        items = dict([(tag, (name, itype)) for tag, name, itype in self._compound])
+
+        offset = 0
+        while offset < self.length:
+            localtag = data[offset:offset+2]
+            set_size = Integer(data[offset+2:offset+4], 'UInt16').read()
+            localdata = data[offset+4:offset+4+set_size]
+            offset += set_size + 4
+            self._tags.append(localtag)
+
+            if localtag in items:
+                name, itype = items[localtag]
+                self.data[name] = self._converter(itype, localdata).read()
+
+            elif localtag == '\x3f\x09':
+                count, size = struct.unpack('>II', localdata[0:8])
+                self.data['delta_entries'] = [
+                    struct.unpack('>bBI', localdata[idx:idx+6])
+                    for idx in range(8, 8 + count * size, size)
+                ]
+
+            elif localtag == '\x3f\x0a':
+                count, size = struct.unpack('>II', localdata[0:8])
+                nsl = self.data.get('slice_count', 0)
+                npe = self.data.get('pos_table_count', 0)
+                entry = struct.Struct('>bbBQ%dI%dI' % (nsl, 2 * npe))
+                entries = []
+                for idx in range(8, 8 + count * size, size):
+                    item = entry.unpack(localdata[idx:idx+entry.size])
+                    entries.append(item[0:4] + (
+                        item[4:4+nsl],
+                        tuple(zip(item[4+nsl::2], item[5+nsl::2])),
+                    ))
+                self.data['index_entries'] = entries
+
+            else:
+                self.data[localtag] = localdata
+
+        return
+
+    def write(self):
+
+        items = dict([(tag, (name, itype)) for tag, name, itype in self._compound])
+        ret = []
+        for localtag in self._tags:
+            if localtag in items:
+                name, itype = items[localtag]
+                cvalue = self._converter(itype, self.data[name]).write()
+
+            elif localtag == '\x3f\x09':
+                cvalue = struct.pack('>II', len(self.data['delta_entries']), 6) + ''.join([
+                    struct.pack('>bBI', *entry) for entry in self.data['delta_entries']
+                ])
+
+            elif localtag == '\x3f\x0a':
+                nsl = self.data.get('slice_count', 0)
+                npe = self.data.get('pos_table_count', 0)
+                entry = struct.Struct('>bbBQ%dI%dI' % (nsl, 2 * npe))
+                cvalue = [struct.pack('>II', len(self.data['index_entries']), entry.size)]
+                for item in self.data['index_entries']:
+                    pos_table = []
+                    for num, den in item[5]:
+                        pos_table += [num, den]
+                    cvalue.append(entry.pack(*(item[0:4] + tuple(item[4]) + tuple(pos_table))))
+                cvalue = ''.join(cvalue)
+
+            else:
+                cvalue = self.data[localtag]
+
+            ret.append(localtag + struct.pack('>H', len(cvalue)) + cvalue)
+
+        ret = ''.join(ret)
+        self.pos = self.fdesc.tell()
+        self.length = len(ret)
+        self.fdesc.write(self.key + self.ber_encode_length(self.length, bytes_num=8).decode('hex_codec') + ret)
+        return
+
+    def edit_unit_count(self):
+        """ Number of edit units indexed by this segment. """
+
+        if self.data.get('edit_unit_byte_count'):
+            return self.data.get('index_duration', 0)
+        return len(self.data['index_entries'])
+
+    def covers(self, edit_unit):
+        """ Whether @edit_unit is indexed by this segment.
+
+        CBR segments with a null duration cover the whole essence container.
+        """
+
+        start = self.data.get('index_start_position', 0)
+        if edit_unit < start:
+            return False
+        if self.data.get('edit_unit_byte_count') and not self.data.get('index_duration'):
+            return True
+        return edit_unit < start + self.edit_unit_count()
+
+    def stream_offset(self, edit_unit):
+        """ Offset of @edit_unit in the essence container stream. """
+
+        if not self.covers(edit_unit):
+            raise S377MException('Edit unit %d not indexed by %s' % (edit_unit, self))
+
+        if self.data.get('edit_unit_byte_count'):
+            return edit_unit * self.data['edit_unit_byte_count']
+
+        return self.data['index_entries'][edit_unit - self.data.get('index_start_position', 0)][3]
+
+
 class RandomIndexMetadata(InterchangeObject):
     """ MXF Random Index Pack metadata parser. """
 
+    # Partition entries BodySID and offset, overall length
+    _entry = struct.Struct('>IQ')
+    _length = struct.Struct('>I')
+
     def __init__(self, fdesc, debug=False):
         InterchangeObject.__init__(self, fdesc, debug)
         self.data = {'partition': []}
@@ -508,28 +900,31 @@ class RandomIndexMetadata(InterchangeObject):
 
     def read(self):
 
-        idx = 0
         data = self.fdesc.read(self.length)
 
-        for _ in range(0, (self.length - 4) / 12):
+        end = self.length - self._length.size
+        if len(data) < self.length or end < 0:
+            raise S377MException('Truncated Random Index Pack: %d bytes' % len(data))
+
+        unpack_from = self._entry.unpack_from
+        for idx in xrange(0, end - self._entry.size + 1, self._entry.size):
+            body_sid, byte_offset = unpack_from(data, idx)
             self.data['partition'].append({
-                'body_sid': Integer(data[idx:idx+4], 'UInt32').read(),
-                'byte_offset': Integer(data[idx+4:idx+12], 'UInt64').read(),
+                'body_sid': body_sid,
+                'byte_offset': byte_offset,
             })
-            idx += 12
 
-        total_part_length = Integer(data[idx:idx+4], 'UInt32').read()
+        total_part_length = self._length.unpack_from(data, end)[0]
 
         if 16 + self.bytes_num + self.length != total_part_length:
             raise S377MException('Overall length differs from UL length')
         return
 
     def write(self):
-        ret = ""
-        for partition in self.data['partition']:
-            ret += Integer(partition['body_sid'], 'UInt32').write() + Integer(partition['byte_offset'], 'UInt64').write()
+        pack = self._entry.pack
+        ret = ''.join([pack(partition['body_sid'], partition['byte_offset']) for partition in self.data['partition']])
 
-        total_part_length = Integer(16 + 9 + 4 + len(ret), 'UInt32').write()
+        total_part_length = self._length.pack(16 + 9 + 4 + len(ret))
 
         self.pos = self.fdesc.tell()
         self.length = len(ret) + 4
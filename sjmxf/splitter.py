@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+
+""" Split OP1a files into one OP-Atom file per essence track. """
+
+import os
+import re
+import copy
+import struct
+import hashlib
+
+from sjmxf.common import InterchangeObject, OrderedDict, UL
+from sjmxf.s377m import MXFPartition, MXFDataSet, S377MException
+from sjmxf.parser import SMPTE_PARTITION_PACK_LABEL, SMPTE_RANDOM_INDEX_PACK_LABEL
+from sjmxf.essence import decode_element_key
+from sjmxf.indexer import Reindexer, RANDOM_ACCESS, PICTURE_HEADER_SIZE, mpeg2_flags
+from sjmxf.timecode import TIMECODE_DATA_DEFINITION
+
+# SMPTE 390M: OP-Atom operational pattern
+OP_ATOM_LABEL = '060e2b34040101020d01020110000000'
+
+BODY_SID = 1
+INDEX_SID = 2
+
+# Generic Container mappings giving the wrapping in byte 14 of essence
+# container labels, clip wrapping values: AES3 and BWF, A-law, JPEG 2000
+# and VC-3
+CLIP_WRAPPINGS = {0x06: (0x02, 0x04), 0x0a: (0x02,), 0x0c: (0x02,), 0x11: (0x02,)}
+
+
+def _batch(items):
+    """ Encode a batch of 16 bytes @items. """
+    return struct.pack('>II', len(items), 16) + ''.join(items)
+
+
+def _copy(klv):
+    """ Returns a copy of set @klv whose elements can be changed. """
+
+    ret = copy.copy(klv)
+    ret.data = OrderedDict(klv.data)
+    ret.element_mapping = dict(klv.element_mapping)
+    ret._shared_mapping = False
+    return ret
+
+
+def _set_raw(klv, element_name, value):
+    """ Replace @element_name of @klv by binary @value. """
+
+    tag = klv.element_mapping[element_name]
+    klv.data[tag] = klv.primer.rp210.convert(klv.primer.data[tag], value)
+
+
+def clip_wrapped(label):
+    """ Whether Generic Container essence container binary @label is clip wrapped.
+
+    Mappings missing from CLIP_WRAPPINGS give the wrapping in the last byte
+    of the label, 0x02 being clip wrapping. Other labels are considered
+    frame wrapped.
+    """
+
+    if label[8:13] != '\x0d\x01\x03\x01\x02':
+        return False
+
+    mapping = ord(label[13])
+    if mapping in CLIP_WRAPPINGS:
+        return ord(label[14]) in CLIP_WRAPPINGS[mapping]
+    return ord(label[15]) == 0x02
+
+
+class AtomWriter(object):
+    """ OP-Atom output of one essence track.
+
+    Essence elements are queued and written by batches of @chunk_size bytes,
+    only index entries grow with the track duration.
+
+    @body_sid: essence container of the track in the input file.
+    """
+
+    def __init__(self, filename, track_number, body_sid, sets, essence_container, chunk_size):
+        self.filename = filename
+        self.track_number = track_number
+        self.body_sid = body_sid
+        self.sets = sets
+        self.essence_container = essence_container
+        self.chunk_size = chunk_size
+
+        self.fdesc = None
+        self.pending = []
+        self.pending_size = 0
+        self.stream_offset = 0
+        self.partitions = []
+        self.header_partition = None
+
+        # (stream offset, flags, key frame offset) per edit unit
+        self.entries = []
+        # Distinct element sizes, up to two
+        self.sizes = set()
+        self.last_key_frame = None
+
+    def _partition(self, template, kind, data):
+        """ Write a partition pack of @kind (2, 3 or 4) from @template, at the current position. """
+
+        partition = copy.copy(template)
+        partition.data = OrderedDict(template.data)
+        partition.data.update(data)
+        partition.data['operational_pattern'] = OP_ATOM_LABEL.decode('hex_codec')
+        partition.data['essence_containers'] = [self.essence_container]
+        partition.key = UL(SMPTE_PARTITION_PACK_LABEL.decode('hex_codec') + '\x01' + chr(kind) + '\x04\x00')
+        partition.fdesc = self.fdesc
+        partition.write()
+        return partition
+
+    def open(self, template, primer):
+        """ Write the Header Partition, with header metadata, and open the body. """
+
+        self.fdesc = open(self.filename, 'wb')
+        self.header_partition = self._partition(template, 2, {
+            'this_partition': 0,
+            'previous_partition': 0,
+            'footer_partition': 0,
+            'header_byte_count': 0,
+            'index_byte_cout': 0,
+            'index_sid': 0,
+            'body_offset': 0,
+            'body_sid': 0,
+        })
+        self.partitions.append((0, 0))
+
+        start = self.fdesc.tell()
+        for klv in [primer] + self.sets:
+            klv = copy.copy(klv)
+            klv.fdesc = self.fdesc
+            klv.write()
+        self.header_partition.data['header_byte_count'] = self.fdesc.tell() - start
+
+        body = self.fdesc.tell()
+        self._partition(template, 3, {
+            'this_partition': body,
+            'previous_partition': 0,
+            'footer_partition': 0,
+            'header_byte_count': 0,
+            'index_byte_cout': 0,
+            'index_sid': 0,
+            'body_offset': 0,
+            'body_sid': BODY_SID,
+        })
+        self.partitions.append((BODY_SID, body))
+
+    def add(self, element, data, length):
+        """ Queue essence @element KLV @data whose value is @length bytes long. """
+
+        flags = RANDOM_ACCESS
+        if element['item_name'] in ('cp_picture', 'gc_picture'):
+            picture_flags = mpeg2_flags(data[len(data) - length:len(data) - length + PICTURE_HEADER_SIZE])
+            if picture_flags is not None:
+                flags = picture_flags
+
+        if flags & RANDOM_ACCESS:
+            self.last_key_frame = len(self.entries)
+        key_offset = 0
+        if self.last_key_frame is not None:
+            key_offset = max(-128, self.last_key_frame - len(self.entries))
+
+        self.entries.append((self.stream_offset, flags, key_offset))
+        if len(self.sizes) < 2:
+            self.sizes.add(len(data))
+        self.stream_offset += len(data)
+
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.fdesc.write(''.join(self.pending))
+        self.pending = []
+        self.pending_size = 0
+
+    def close(self, edit_rate):
+        """ Write index, Footer Partition and Random Index Pack, update the header. """
+
+        self.flush()
+
+        reindexer = Reindexer(None, body_sid=BODY_SID, index_sid=INDEX_SID, edit_rate=edit_rate)
+        reindexer.entries = [list(entry) for entry in self.entries]
+        if len(self.sizes) == 1:
+            reindexer.edit_unit_byte_count = self.sizes.pop()
+        segments = ''
+        if self.entries:
+            segments = ''.join(reindexer.segments())
+
+        footer = self.fdesc.tell()
+        template = self.header_partition
+        self._partition(template, 4, {
+            'this_partition': footer,
+            'previous_partition': self.partitions[-1][1],
+            'footer_partition': footer,
+            'header_byte_count': 0,
+            'index_byte_cout': len(segments), # sic, MXFPartition item name
+            'index_sid': INDEX_SID,
+            'body_offset': 0,
+            'body_sid': 0,
+        })
+        self.fdesc.write(segments)
+        self.partitions.append((0, footer))
+
+        rip = ''.join([struct.pack('>IQ', body_sid, offset) for body_sid, offset in self.partitions])
+        rip += struct.pack('>I', 16 + 9 + len(rip) + 4)
+        self.fdesc.write(Reindexer._klv(SMPTE_RANDOM_INDEX_PACK_LABEL.decode('hex_codec'), rip))
+
+        # FooterPartition of previous partitions, same size values
+        self.header_partition.data['footer_partition'] = footer
+        self.header_partition.fdesc = self.fdesc
+        self.fdesc.seek(0)
+        self.header_partition.write()
+        for _, offset in self.partitions[1:-1]:
+            self.fdesc.seek(offset + 16 + 9 + 24)
+            self.fdesc.write(struct.pack('>Q', footer))
+
+        self.fdesc.close()
+        self.fdesc = None
+
+
+class OPAtomSplitter(object):
+    """ Split an OP1a file into one OP-Atom file per essence track.
+
+    Each output gets copies of the Preface, Identification and Content
+    Storage sets, of the Material Package restricted to the timecode tracks
+    and the tracks playing the essence track, and of the File Package
+    restricted to the essence track with its own descriptor and a package
+    UMID derived from the original one. Only frame wrapped tracks are
+    split, each element being one edit unit of the output index.
+
+    The body is walked once, each Generic Container element being routed to
+    the writer of its track.
+
+    @mxf: parser that went through header_metadata_parse(), or read().
+    @pattern: output filename pattern, formatted with the 'base' of the
+    input filename, 'track_id' and 'track_number'.
+    @chunk_size: write batch size per track.
+    """
+
+    def __init__(self, mxf, pattern='%(base)s.%(track_id)d.mxf', chunk_size=4 * 1024 * 1024):
+        self.mxf = mxf
+        self.pattern = pattern
+        self.chunk_size = chunk_size
+        self.writers = {}
+        self.edit_rates = {}
+
+    def _sets(self):
+        """ Returns header metadata sets by InstanceUID. """
+
+        ret = {}
+        for klv in self.mxf.data['header']['klvs']:
+            if isinstance(klv, MXFDataSet) and '\x3c\x0a' in klv.data:
+                ret[klv.data['\x3c\x0a'].read()] = klv
+        return ret
+
+    @staticmethod
+    def _components(sets, track):
+        """ Returns the sets of @track, its sequence and components. """
+
+        ret = [track]
+        segment = sets.get(track.get_element('segment').read())
+        if segment is None:
+            return ret
+        ret.append(segment)
+        if segment.get_element('components_in_sequence') is not None:
+            ret += [sets[uid] for uid in segment.get_element('components_in_sequence').read() if uid in sets]
+        return ret
+
+    def plan(self):
+        """ Build the output header metadata of each essence track.
+
+        @returns: the writers by track number.
+        """
+
+        sets = self._sets()
+        preface = self.mxf.data['header']['preface']
+        if preface is None:
+            raise S377MException('No Preface in header metadata')
+        storage = sets[preface.get_element('content').read()]
+        identifications = [sets[uid] for uid in preface.get_element('identification_list').read() if uid in sets]
+        packages = [sets[uid] for uid in storage.get_element('packages').read() if uid in sets]
+        containers = [sets[uid] for uid in storage.get_element('essence_data').read() if uid in sets]
+
+        materials = [item for item in packages if item.set_type == 'MaterialPackage']
+        sources = [item for item in packages if item.get_element('essence_description') is not None]
+        base = os.path.splitext(self.mxf.filename)[0]
+
+        self.writers = {}
+        for source in sources:
+            package_id = source.get_element('package_id').read()
+            container = [item for item in containers if item.get_element('associated_package').read() == package_id]
+            descriptor = sets.get(source.get_element('essence_description').read())
+            if not container or descriptor is None:
+                continue
+
+            for track_uid in source.get_element('tracks').read():
+                track = sets.get(track_uid)
+                if track is None or not track.get_element('track_number').read():
+                    continue
+                track_id = track.get_element('track_id').read()
+                track_number = track.get_element('track_number').read()
+
+                # File descriptor of the track
+                file_descriptor = descriptor
+                if descriptor.get_element('file_descriptors') is not None:
+                    file_descriptor = [sets[uid] for uid in descriptor.get_element('file_descriptors').read()
+                        if uid in sets and sets[uid].get_element('essence_track_id').read() == track_id]
+                    if not file_descriptor:
+                        continue
+                    file_descriptor = file_descriptor[0]
+
+                # Package UMID material number derived from the track
+                atom_id = package_id[0:16] + hashlib.md5(package_id + struct.pack('>I', track_number)).digest()
+
+                output = []
+                atom_source = _copy(source)
+                _set_raw(atom_source, 'package_id', atom_id)
+                _set_raw(atom_source, 'tracks', _batch([track_uid]))
+                _set_raw(atom_source, 'essence_description', file_descriptor.data['\x3c\x0a'].read())
+                atom_container = _copy(container[0])
+                _set_raw(atom_container, 'associated_package', atom_id)
+                _set_raw(atom_container, 'essence_stream_id', struct.pack('>I', BODY_SID))
+                _set_raw(atom_container, 'index_stream_id', struct.pack('>I', INDEX_SID))
+
+                packages_uids = []
+                for material in materials:
+                    material_tracks = []
+                    material_sets = []
+                    plays = False
+                    for material_track_uid in material.get_element('tracks').read():
+                        material_track = sets.get(material_track_uid)
+                        if material_track is None:
+                            continue
+                        components = self._components(sets, material_track)
+                        if len(components) > 1 and re.match(TIMECODE_DATA_DEFINITION,
+                            components[1].get_element('data_definition').read().encode('hex_codec')):
+                            material_tracks.append(material_track_uid)
+                            material_sets += components
+                            continue
+
+                        clips = [item for item in components[2:] if item.set_type == 'SourceClip' and
+                            item.get_element('source_id').read() == package_id and
+                            item.get_element('source_track_id').read() == track_id]
+                        if not clips:
+                            continue
+                        plays = True
+                        material_tracks.append(material_track_uid)
+                        for item in components:
+                            if item in clips:
+                                item = _copy(item)
+                                _set_raw(item, 'source_id', atom_id)
+                            material_sets.append(item)
+
+                    if plays:
+                        atom_material = _copy(material)
+                        _set_raw(atom_material, 'tracks', _batch(material_tracks))
+                        output += [atom_material] + material_sets
+                        packages_uids.append(material.data['\x3c\x0a'].read())
+
+                packages_uids.append(source.data['\x3c\x0a'].read())
+                output += [atom_source] + self._components(sets, track) + [file_descriptor]
+
+                essence_container = file_descriptor.get_element('essence_container_format').read()
+                if clip_wrapped(essence_container):
+                    raise S377MException('Track %d is clip wrapped, only frame wrapped tracks can be split' % track_id)
+                atom_preface = _copy(preface)
+                _set_raw(atom_preface, 'operational_pattern_universal_label', OP_ATOM_LABEL.decode('hex_codec'))
+                _set_raw(atom_preface, 'essence_containers', _batch([essence_container]))
+                atom_storage = _copy(storage)
+                _set_raw(atom_storage, 'packages', _batch(packages_uids))
+                _set_raw(atom_storage, 'essence_data', _batch([atom_container.data['\x3c\x0a'].read()]))
+
+                filename = self.pattern % {'base': base, 'track_id': track_id, 'track_number': track_number}
+                self.writers[track_number] = AtomWriter(filename, track_number,
+                    container[0].get_element('essence_stream_id').read(),
+                    [atom_preface] + identifications + [atom_storage, atom_container] + output,
+                    essence_container, self.chunk_size)
+                self.edit_rates[track_number] = track.get_element('timeline_rate').read()
+
+        return self.writers
+
+    def run(self):
+        """ Write the OP-Atom files.
+
+        @returns: output filenames by track number.
+        """
+
+        if not self.writers:
+            self.plan()
+        if not self.writers:
+            raise S377MException('No essence track to split')
+
+        header_partition = self.mxf.data['header']['partition']
+        primer = self.mxf.data['header']['primer']
+        fdesc = open(self.mxf.filename, 'rb')
+        try:
+            for writer in self.writers.values():
+                writer.open(header_partition, primer)
+
+            fdesc.seek(0, 2)
+            size = fdesc.tell()
+            start = header_partition.pos + 16 + header_partition.bytes_num + header_partition.length
+            self._walk(fdesc, start, size)
+
+            for track_number, writer in self.writers.items():
+                writer.close(self.edit_rates[track_number])
+        finally:
+            fdesc.close()
+            for writer in self.writers.values():
+                if writer.fdesc:
+                    writer.fdesc.close()
+
+        return dict([(track_number, writer.filename) for track_number, writer in self.writers.items()])
+
+    def _walk(self, fdesc, start, size):
+        # Essence may follow header metadata in the Header Partition
+        body_sid = self.mxf.data['header']['partition'].data['body_sid']
+        for key, pos, length, bytes_num in InterchangeObject.iter_klvs(fdesc, start, size):
+            # Partition packs, not the Primer Pack sharing their label prefix
+            if key[0:12] == SMPTE_PARTITION_PACK_LABEL.decode('hex_codec') and key[12] == '\x01' and key[13] in '\x02\x03\x04':
+                if key[13] == '\x04':
+                    break
+                fdesc.seek(pos + 16 + bytes_num)
+                body_sid = MXFPartition._struct.unpack(fdesc.read(MXFPartition._struct.size))[10]
+                continue
+
+            element = decode_element_key(key)
+            if not element or element['track_number'] not in self.writers:
+                continue
+
+            writer = self.writers[element['track_number']]
+            if body_sid != writer.body_sid:
+                continue
+
+            fdesc.seek(pos)
+            writer.add(element, fdesc.read(16 + bytes_num + length), length)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+""" Timecode addressing of MXF edit units. """
+
+import re
+
+from sjmxf.s377m import MXFDataSet, S377MException
+
+# SMPTE RP 224: Timecode data definition, version byte ignored
+TIMECODE_DATA_DEFINITION = '060e2b34040101..0103020101000000'
+
+_TIMECODE_RE = re.compile(r'^(\d+)[:;.](\d+)[:;.](\d+)[:;.,](\d+)$')
+
+
+class Timecode(object):
+    """ SMPTE 12M timecode arithmetic.
+
+    @base: rounded timecode timebase, e.g. 30 for 29.97 fps.
+    @drop_frame: drop frame counting, only defined for 30 and 60 bases.
+    """
+
+    def __init__(self, base, drop_frame=False):
+        if drop_frame and base not in (30, 60):
+            raise ValueError('No drop frame counting for a timebase of %d' % base)
+
+        self.base = base
+        self.drop_frame = drop_frame
+
+        # Frame numbers skipped at the start of each minute but every tenth
+        self.dropped = 0
+        if drop_frame:
+            self.dropped = base / 15
+
+    def to_frames(self, timecode):
+        """ Convert 'HH:MM:SS:FF' @timecode, or a 4-tuple, to a frame count. """
+
+        if isinstance(timecode, basestring):
+            match = _TIMECODE_RE.match(timecode.strip())
+            if not match:
+                raise ValueError('Invalid timecode %r' % timecode)
+            timecode = [int(item) for item in match.groups()]
+
+        hours, minutes, seconds, frames = timecode
+        if frames >= self.base or seconds >= 60 or minutes >= 60:
+            raise ValueError('Invalid timecode %r' % (timecode,))
+
+        minutes += 60 * hours
+        count = (minutes * 60 + seconds) * self.base + frames
+        if self.dropped:
+            if seconds == 0 and frames < self.dropped and minutes % 10:
+                raise ValueError('Dropped timecode %r' % (timecode,))
+            count -= self.dropped * (minutes - minutes / 10)
+        return count
+
+    def to_timecode(self, count):
+        """ Convert a frame @count to a 'HH:MM:SS:FF' timecode, ';' separated frames in drop frame. """
+
+        if self.dropped:
+            per_minute = self.base * 60 - self.dropped
+            per_ten_minutes = per_minute * 10 + self.dropped
+            tens, remainder = divmod(count, per_ten_minutes)
+            count += 9 * self.dropped * tens
+            if remainder > self.dropped:
+                count += self.dropped * ((remainder - self.dropped) / per_minute)
+
+        seconds, frames = divmod(count, self.base)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return '%02d:%02d:%02d%s%02d' % (hours % 24, minutes, seconds, self.drop_frame and ';' or ':', frames)
+
+
+class TimecodeIndex(object):
+    """ Map timecodes to edit units and byte ranges.
+
+    The Material Package timecode track of @mxf, a parser that went through
+    read(), gives the start timecode, rounded timebase and drop frame flag,
+    index table segments give edit unit positions. Edit rates that are a
+    multiple of the timebase, e.g. 50p essence with a 25 timebase, have
+    several edit units per timecode frame.
+    """
+
+    def __init__(self, mxf):
+        self.mxf = mxf
+        self.start = None
+        self.edit_rate = None
+        self.timecode = None
+        # Edit units per timecode frame
+        self.scale = 1
+        self.resolve()
+
+    def _sets(self):
+        """ Returns header metadata sets by InstanceUID. """
+
+        ret = {}
+        for klv in self.mxf.data['header']['klvs']:
+            if isinstance(klv, MXFDataSet) and '\x3c\x0a' in klv.data:
+                ret[klv.data['\x3c\x0a'].read()] = klv
+        return ret
+
+    def resolve(self):
+        """ Lookup the timecode component of the Material Package timecode track. """
+
+        sets = self._sets()
+        for package in sets.values():
+            if package.set_type != 'MaterialPackage':
+                continue
+
+            for track_uid in package.get_element('tracks').read():
+                track = sets.get(track_uid)
+                if not track or track.get_element('segment') is None:
+                    continue
+
+                sequence = sets.get(track.get_element('segment').read())
+                if not sequence or not re.match(TIMECODE_DATA_DEFINITION, sequence.get_element('data_definition').read().encode('hex_codec')):
+                    continue
+
+                # Arrays are dictionaries, test them against None
+                components = [sequence]
+                if sequence.get_element('components_in_sequence') is not None:
+                    components = [sets.get(item) for item in sequence.get_element('components_in_sequence').read()]
+
+                for component in components:
+                    if component and component.set_type == 'TimecodeComponent':
+                        self.start = component.get_element('start_timecode').read()
+                        self.timecode = Timecode(component.get_element('rounded_timecode_timebase').read(),
+                            component.get_element('drop_frame').read())
+                        self.edit_rate = track.get_element('timeline_rate').read()
+                        self.scale = self._scale()
+                        return
+
+        raise S377MException('No Material Package timecode track')
+
+    def _scale(self):
+        """ Returns the number of edit units per timecode frame. """
+
+        numerator, denominator = self.edit_rate
+        rounded = (numerator + denominator - 1) / denominator
+        scale, remainder = divmod(rounded, self.timecode.base)
+        if remainder or not scale:
+            raise S377MException('Edit rate %d/%d does not match timecode base %d' % (numerator, denominator, self.timecode.base))
+        return scale
+
+    def edit_unit(self, timecode):
+        """ First edit unit of @timecode. """
+        return (self.timecode.to_frames(timecode) - self.start) * self.scale
+
+    def edit_unit_timecode(self, edit_unit):
+        """ Timecode of @edit_unit. """
+        return self.timecode.to_timecode(self.start + edit_unit / self.scale)
+
+    def edit_units(self, timecodes):
+        """ Convert a list of @timecodes to edit units. """
+
+        to_frames = self.timecode.to_frames
+        start = self.start
+        scale = self.scale
+        return [(to_frames(item) - start) * scale for item in timecodes]
+
+    def byte_range(self, timecode_in, timecode_out):
+        """ Returns the [start, end) file range of edit units from @timecode_in to @timecode_out excluded. """
+        return self.byte_ranges([(timecode_in, timecode_out)])[0]
+
+    def byte_ranges(self, events):
+        """ Convert a list of (timecode in, timecode out) @events to file ranges.
+
+        Each edit unit position is looked up once, whatever the number of
+        events referencing it.
+        """
+
+        units = self.edit_units([item for event in events for item in event])
+        count = self.mxf.edit_unit_count()
+
+        positions = {}
+        for edit_unit in set(units):
+            if edit_unit < 0 or edit_unit > count:
+                raise S377MException('Edit unit %d is out of the %d indexed ones' % (edit_unit, count))
+            if edit_unit == count:
+                positions[edit_unit] = self._essence_end()
+            else:
+                positions[edit_unit] = self.mxf.edit_unit_position(edit_unit)
+
+        return [(positions[units[idx]], positions[units[idx + 1]]) for idx in range(0, len(units), 2)]
+
+    def _essence_end(self):
+        """ Position following the last essence container element. """
+
+        if not self.mxf.data['essence']:
+            raise S377MException('No essence container')
+        entry = self.mxf.data['essence'][-1]
+        return entry['pos'] + entry['length']
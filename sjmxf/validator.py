@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+""" Streaming SMPTE 377M conformance validator. """
+
+import re
+
+from sjmxf.common import InterchangeObject, Diagnostics
+from sjmxf.s377m import MXFPartition, MXFPrimer, MXFDataSet, RandomIndexMetadata, S377MException
+from sjmxf.rp210types import RP210TypesException
+from sjmxf.parser import MXFParser, SMPTE_PARTITION_PACK_LABEL, SMPTE_PRIMER_PACK_LABEL, \
+    SMPTE_INDEX_TABLE_SEGMENT_LABEL, SMPTE_RANDOM_INDEX_PACK_LABEL, SMPTE_KLV_FILL_LABELS
+from sjmxf.essence import is_element_key
+
+
+class Validator(object):
+    """ Validate a MXF file walking its KLVs once.
+
+    Only KLV keys and lengths are read, except for partition packs, the
+    random index pack and header metadata sets, whose instance UIDs and
+    strong references are kept until the end of their partition to find
+    dangling references. Memory use does not depend on essence size.
+
+    Findings are Diagnostic objects whose details hold the 'check' name:
+    partition_pack, partition_linkage, header_byte_count, index_byte_count,
+    random_index_pack, kag or strong_reference.
+    """
+
+    def __init__(self, filename, diagnostics=None):
+        self.filename = filename
+        if diagnostics is not None:
+            self.diagnostics = diagnostics
+        else:
+            self.diagnostics = Diagnostics()
+        self.findings = None
+
+    def error(self, check, message, pos=None, **details):
+        self.diagnostics.emit('error', message, pos, check=check, **details)
+
+    def warning(self, check, message, pos=None, **details):
+        self.diagnostics.emit('warning', message, pos, check=check, **details)
+
+    def run(self):
+        """ Validate the file.
+
+        @returns: the list of findings.
+        """
+
+        self.findings = self.diagnostics.collect(levels=None)
+        try:
+            mxf = MXFParser(self.filename)
+            try:
+                mxf.open()
+            except Exception, error:
+                self.error('partition_pack', str(error))
+                return self.findings
+
+            try:
+                self._walk(mxf)
+            finally:
+                mxf.close()
+        finally:
+            self.diagnostics.unsubscribe(self.findings)
+
+        return self.findings
+
+    def _walk(self, mxf):
+        fdesc = mxf.fd
+        fdesc.seek(0, 2)
+        size = fdesc.tell()
+
+        # Offset and BodySID of partitions found
+        self._partitions = []
+        self._footer = None
+        self._footer_references = []
+        self._current = None
+        random_index_pack = None
+        end = mxf.run_in
+
+        for key, pos, length, bytes_num in InterchangeObject.iter_klvs(fdesc, mxf.run_in, size):
+            end = pos + 16 + bytes_num + length
+            ekey = key.encode('hex_codec')
+
+            if re.match(SMPTE_PARTITION_PACK_LABEL + '01(0[2-4])', ekey):
+                self._partition_end(pos)
+                self._partition_start(mxf, fdesc, pos)
+
+            elif ekey == SMPTE_RANDOM_INDEX_PACK_LABEL:
+                self._partition_end(pos)
+                random_index_pack = RandomIndexMetadata(fdesc)
+                try:
+                    random_index_pack.read()
+                except S377MException, error:
+                    self.error('random_index_pack', str(error), pos)
+
+            elif not self._current:
+                self.error('partition_pack', 'KLV %s out of any partition' % ekey, pos)
+
+            elif ekey in SMPTE_KLV_FILL_LABELS:
+                # Counted in the current section, fill behind the partition pack in none
+                pass
+
+            elif ekey == SMPTE_PRIMER_PACK_LABEL:
+                self._section(pos, 'header')
+                self._current['primer'] = MXFPrimer(fdesc)
+                self._current['primer'].read()
+
+            elif ekey == SMPTE_INDEX_TABLE_SEGMENT_LABEL:
+                self._section(pos, 'index')
+
+            elif is_element_key(key):
+                self._section(pos, 'essence')
+
+            elif self._current['section'] == 'header' and key[4:6] == '\x02\x53':
+                self._header_set(fdesc, pos)
+
+            elif self._current['section'] == 'pack':
+                self._section(pos, 'essence')
+
+        if end < size:
+            self.error('partition_pack', 'Truncated or invalid KLV', end)
+        self._partition_end(end)
+
+        # Partitions referencing the footer
+        for pos, footer in self._footer_references:
+            if self._footer is None:
+                self.error('partition_linkage', 'FooterPartition %d set without Footer Partition' % footer, pos)
+            elif footer != self._footer:
+                self.error('partition_linkage', 'FooterPartition %d, Footer Partition found at %d' % (footer, self._footer), pos)
+
+        if random_index_pack:
+            self._random_index_pack_check(random_index_pack)
+
+    def _partition_start(self, mxf, fdesc, pos):
+        try:
+            partition = MXFPartition(fdesc)
+            partition.read()
+        except (S377MException, RP210TypesException), error:
+            self.error('partition_pack', str(error), pos)
+            self._current = None
+            return
+
+        offset = mxf.partition_offset(pos)
+        data = partition.data
+        if 'this_partition' not in data:
+            self._current = None
+            return
+
+        if data['this_partition'] != offset:
+            self.error('partition_linkage', 'ThisPartition %d, found at %d' % (data['this_partition'], offset), pos)
+
+        previous = 0
+        if self._partitions:
+            previous = self._partitions[-1][0]
+        if data['previous_partition'] != previous:
+            self.error('partition_linkage', 'PreviousPartition %d, previous found at %d' % (data['previous_partition'], previous), pos)
+
+        if partition.key[13] == '\x04':
+            self._footer = offset
+        if data['footer_partition']:
+            self._footer_references.append((pos, data['footer_partition']))
+
+        self._partitions.append((offset, data['body_sid']))
+        self._current = {
+            'pos': pos,
+            'partition': partition,
+            'section': 'pack',
+            'header': None,
+            'index': None,
+            'primer': None,
+            'instances': set(),
+            'references': [],
+        }
+
+    def _section(self, pos, section):
+        """ Switch current partition to @section starting at @pos. """
+
+        current = self._current
+        if current['section'] == section:
+            return
+
+        self._section_end(pos)
+        current['section'] = section
+        current[section] = [pos, None]
+
+        kag_size = current['partition'].data['kag_size']
+        if kag_size > 1 and (pos - current['pos']) % kag_size:
+            self.error('kag', '%s does not start on a %d bytes KAG boundary' % (section.capitalize(), kag_size), pos)
+
+    def _section_end(self, pos):
+        current = self._current
+        if current['section'] in ('header', 'index'):
+            current[current['section']][1] = pos
+
+    def _header_set(self, fdesc, pos):
+        """ Keep instance UID and strong references of header metadata set at @pos. """
+
+        if self._current['primer'] is None:
+            self.error('strong_reference', 'Cannot decode set without Primer Pack', pos)
+            return
+
+        try:
+            dataset = MXFDataSet(fdesc, self._current['primer'])
+            dataset.read()
+        except S377MException, error:
+            self.error('strong_reference', 'Cannot decode set: %s' % error, pos)
+            return
+
+        if '\x3c\x0a' in dataset.data:
+            self._current['instances'].add(dataset.data['\x3c\x0a'].read())
+        for reference in dataset.get_strong_references():
+            self._current['references'].append((pos, reference))
+
+    def _partition_end(self, pos):
+        """ Check partition ending at @pos. """
+
+        current = self._current
+        if not current:
+            return
+        self._section_end(pos)
+        data = current['partition'].data
+
+        for section, name, count in (
+            ('header', 'HeaderByteCount', data['header_byte_count']),
+            ('index', 'IndexByteCount', data['index_byte_cout']),
+        ):
+            actual = 0
+            if current[section]:
+                actual = current[section][1] - current[section][0]
+            if actual != count:
+                self.error(section + '_byte_count', '%s %d, found %d bytes' % (name, count, actual), current['pos'])
+
+        for ref_pos, reference in current['references']:
+            if reference not in current['instances']:
+                self.error('strong_reference', 'Dangling strong reference to %s' % reference.encode('hex_codec'), ref_pos)
+
+        self._current = None
+
+    def _random_index_pack_check(self, random_index_pack):
+        entries = [(item['byte_offset'], item['body_sid']) for item in random_index_pack.data['partition']]
+
+        for offset, body_sid in entries:
+            if (offset, body_sid) not in self._partitions:
+                self.error('random_index_pack', 'Entry %d (BodySID %d) does not match a partition' % (offset, body_sid), random_index_pack.pos)
+
+        for offset, body_sid in self._partitions:
+            if (offset, body_sid) not in entries:
+                self.warning('random_index_pack', 'Partition %d missing from Random Index Pack' % offset, random_index_pack.pos)
@@ -0,0 +1,365 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Helpers to build small synthetic OP1a MXF files for unit tests.
+
+Generated files hold one picture track (MPEG-2 like frames with I/P/B
+pictures) and one stereo 16 bits PCM sound track, frame wrapped in a Generic
+Container, described by a complete header metadata set (Preface, packages,
+tracks, sequences, timecode, descriptors). Header metadata encoding relies on
+the Primer Pack of tests/data/primer.raw.
+"""
+
+import os
+import struct
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+OP1A_LABEL = '060e2b34040101010d01020101010900'.decode('hex_codec')
+ESSENCE_CONTAINER_LABEL = '060e2b34040101020d01030102047f01'.decode('hex_codec')
+PICTURE_DEFINITION = '060e2b34040101010103020201000000'.decode('hex_codec')
+SOUND_DEFINITION = '060e2b34040101010103020202000000'.decode('hex_codec')
+TIMECODE_DEFINITION = '060e2b34040101010103020101000000'.decode('hex_codec')
+
+FILL_KEY = '060e2b34010101010301021001000000'.decode('hex_codec')
+PRIMER_KEY = '060e2b34020501010d01020101050100'.decode('hex_codec')
+INDEX_KEY = '060e2b34025301010d01020101100100'.decode('hex_codec')
+RIP_KEY = '060e2b34020501010d01020101110100'.decode('hex_codec')
+SET_KEY = '060e2b34025301010d0101010101%s00'
+
+PICTURE_ELEMENT_KEY = '060e2b34010201010d01030115010501'.decode('hex_codec')
+SOUND_ELEMENT_KEY = '060e2b34010201010d01030116010301'.decode('hex_codec')
+PICTURE_TRACK_NUMBER = 0x15010501
+SOUND_TRACK_NUMBER = 0x16010301
+
+GOP = 'IBBPBBPBB'
+PICTURE_SIZES = {'I': 3000, 'P': 1500, 'B': 800}
+PICTURE_CODING_TYPES = {'I': 1, 'P': 2, 'B': 3}
+
+SAMPLES_PER_FRAME = 1920
+CHANNELS = 2
+
+
+def uid(num):
+    """ Builds a fake InstanceUID. """
+    return struct.pack('>12sI', 'sjmxf-test-0', num)
+
+
+def umid(num):
+    """ Builds a fake basic UMID. """
+    return '060a2b340101010101010f00'.decode('hex_codec') + '\x13\x00\x00\x00' + uid(num)
+
+
+def ber(length):
+    """ BER encoding of @length on 4 bytes. """
+    return struct.pack('>BI', 0x84, length)
+
+
+def klv(key, value):
+    """ Builds a KLV. """
+    return key + ber(len(value)) + value
+
+
+def local_set(kind, items):
+    """ Builds a local set of @kind (hex string byte 13) from (tag, value) @items. """
+    value = ''.join([tag.decode('hex_codec') + struct.pack('>H', len(item)) + item for tag, item in items])
+    return klv((SET_KEY % kind).decode('hex_codec'), value)
+
+
+def batch(items, size=16):
+    """ Builds a batch/array of references. """
+    return struct.pack('>II', len(items), size) + ''.join(items)
+
+
+def primer():
+    """ Primer Pack from tests/data/primer.raw with MultipleDescriptor file descriptors tag added. """
+    data = open(os.path.join(DATA_DIR, 'primer.raw'), 'rb').read()
+    count, size = struct.unpack('>II', data[25:33])
+    entries = data[33:33 + count * size]
+    entries += '\x3f\x01' + '060e2b340101010406010104060b0000'.decode('hex_codec')
+    return klv(PRIMER_KEY, struct.pack('>II', count + 1, size) + entries)
+
+
+def partition_pack(kind, status, this=0, previous=0, footer=0, header_byte_count=0,
+    index_byte_count=0, index_sid=0, body_offset=0, body_sid=0, essence_containers=True):
+    """ Builds a partition pack, @kind being 2 (header), 3 (body) or 4 (footer). """
+
+    key = '060e2b34020501010d01020101'.decode('hex_codec') + chr(kind) + chr(status) + '\x00'
+    value = struct.pack('>HHIQQQQQIQI', 1, 2, 1, this, previous, footer,
+        header_byte_count, index_byte_count, index_sid, body_offset, body_sid)
+    value += OP1A_LABEL
+    if essence_containers:
+        value += batch([ESSENCE_CONTAINER_LABEL])
+    else:
+        value += batch([])
+    return klv(key, value)
+
+
+def timestamp():
+    return struct.pack('>hBBBBBB', 2011, 4, 29, 16, 7, 53, 0)
+
+
+def header_metadata(frames, start_timecode=900000, drop_frame=False, rate=(25, 1), timecode_base=None):
+    """ Builds header metadata (primer and sets) for @frames edit units. """
+
+    edit_rate = struct.pack('>II', *rate)
+    if timecode_base is None:
+        timecode_base = (rate[0] + rate[1] - 1) / rate[1]
+    material, source = umid(1), umid(2)
+    sets = [
+        local_set('2f', [
+            ('3c0a', uid(1)),
+            ('3b02', timestamp()),
+            ('3b05', '\x01\x02'),
+            ('3b03', uid(2)),
+            ('3b09', OP1A_LABEL),
+            ('3b0a', batch([ESSENCE_CONTAINER_LABEL])),
+            ('3b06', batch([uid(3)])),
+        ]),
+        local_set('30', [
+            ('3c0a', uid(3)),
+            ('3c09', uid(100)),
+            ('3c01', u'SmartJog'.encode('utf_16_be')),
+            ('3c02', u'python-mxf tests'.encode('utf_16_be')),
+            ('3c05', uid(101)),
+            ('3c06', timestamp()),
+        ]),
+        local_set('18', [
+            ('3c0a', uid(2)),
+            ('1901', batch([uid(10), uid(20)])),
+            ('1902', batch([uid(4)])),
+        ]),
+        local_set('23', [
+            ('3c0a', uid(4)),
+            ('2701', source),
+            ('3f06', struct.pack('>I', 1)),
+            ('3f07', struct.pack('>I', 1)),
+        ]),
+
+        # Material Package: timecode, picture and sound tracks
+        local_set('36', [
+            ('3c0a', uid(10)),
+            ('4401', material),
+            ('4405', timestamp()),
+            ('4404', timestamp()),
+            ('4403', batch([uid(11), uid(12), uid(13)])),
+        ]),
+    ]
+
+    def track(num, track_id, track_number, sequence, definition, components):
+        return [
+            local_set('3b', [
+                ('3c0a', uid(num)),
+                ('4801', struct.pack('>I', track_id)),
+                ('4804', struct.pack('>I', track_number)),
+                ('4b01', edit_rate),
+                ('4b02', struct.pack('>q', 0)),
+                ('4803', uid(sequence)),
+            ]),
+            local_set('0f', [
+                ('3c0a', uid(sequence)),
+                ('0201', definition),
+                ('0202', struct.pack('>q', frames)),
+                ('1001', batch([uid(item[0]) for item in components])),
+            ]),
+        ] + [item[1] for item in components]
+
+    def source_clip(num, definition, package, track_id):
+        return num, local_set('11', [
+            ('3c0a', uid(num)),
+            ('0201', definition),
+            ('0202', struct.pack('>q', frames)),
+            ('1201', struct.pack('>q', 0)),
+            ('1101', package),
+            ('1102', struct.pack('>I', track_id)),
+        ])
+
+    sets += track(11, 1, 0, 31, TIMECODE_DEFINITION, [
+        (41, local_set('14', [
+            ('3c0a', uid(41)),
+            ('0201', TIMECODE_DEFINITION),
+            ('0202', struct.pack('>q', frames)),
+            ('1501', struct.pack('>q', start_timecode)),
+            ('1502', struct.pack('>H', timecode_base)),
+            ('1503', drop_frame and '\x01' or '\x00'),
+        ])),
+    ])
+    sets += track(12, 2, 0, 32, PICTURE_DEFINITION, [source_clip(42, PICTURE_DEFINITION, source, 2)])
+    sets += track(13, 3, 0, 33, SOUND_DEFINITION, [source_clip(43, SOUND_DEFINITION, source, 3)])
+
+    # File Source Package: picture and sound tracks
+    sets.append(local_set('37', [
+        ('3c0a', uid(20)),
+        ('4401', source),
+        ('4405', timestamp()),
+        ('4404', timestamp()),
+        ('4403', batch([uid(22), uid(23)])),
+        ('4701', uid(50)),
+    ]))
+    null_package = '\x00' * 32
+    sets += track(22, 2, PICTURE_TRACK_NUMBER, 54, PICTURE_DEFINITION, [source_clip(62, PICTURE_DEFINITION, null_package, 0)])
+    sets += track(23, 3, SOUND_TRACK_NUMBER, 53, SOUND_DEFINITION, [source_clip(63, SOUND_DEFINITION, null_package, 0)])
+
+    sets += [
+        local_set('44', [
+            ('3c0a', uid(50)),
+            ('3001', edit_rate),
+            ('3002', struct.pack('>q', frames)),
+            ('3004', ESSENCE_CONTAINER_LABEL),
+            ('3f01', batch([uid(51), uid(52)])),
+        ]),
+        local_set('28', [
+            ('3c0a', uid(51)),
+            ('3006', struct.pack('>I', 2)),
+            ('3001', edit_rate),
+            ('3002', struct.pack('>q', frames)),
+            ('3004', ESSENCE_CONTAINER_LABEL),
+            ('3203', struct.pack('>I', 720)),
+            ('3202', struct.pack('>I', 576)),
+            ('3301', struct.pack('>I', 8)),
+        ]),
+        local_set('48', [
+            ('3c0a', uid(52)),
+            ('3006', struct.pack('>I', 3)),
+            ('3001', edit_rate),
+            ('3002', struct.pack('>q', frames)),
+            ('3004', ESSENCE_CONTAINER_LABEL),
+            ('3d03', struct.pack('>II', 48000, 1)),
+            ('3d07', struct.pack('>I', CHANNELS)),
+            ('3d01', struct.pack('>I', 16)),
+            ('3d0a', struct.pack('>H', 2 * CHANNELS)),
+            ('3d09', struct.pack('>I', 48000 * 2 * CHANNELS)),
+        ]),
+    ]
+
+    return primer() + ''.join(sets)
+
+
+def picture(frame, cbr=False):
+    """ Builds MPEG-2 like picture @frame payload. """
+
+    kind = GOP[frame % len(GOP)]
+    if cbr:
+        size = PICTURE_SIZES['I']
+    else:
+        size = PICTURE_SIZES[kind]
+
+    data = ''
+    if kind == 'I':
+        data += '\x00\x00\x01\xb3' + '\x00' * 8
+    data += '\x00\x00\x01\x00' + struct.pack('>BB', (frame >> 2) & 0xff, ((frame & 3) << 6) | (PICTURE_CODING_TYPES[kind] << 3))
+    return data + chr(frame & 0xff) * (size - len(data))
+
+
+def sound(frame):
+    """ Builds PCM @frame payload, sample n of channel c being (n * (c + 1)) % 65536 - 32768. """
+
+    samples = []
+    for num in range(frame * SAMPLES_PER_FRAME, (frame + 1) * SAMPLES_PER_FRAME):
+        for channel in range(CHANNELS):
+            samples.append((num * (channel + 1)) % 65536 - 32768)
+    return struct.pack('<%dh' % len(samples), *samples)
+
+
+def sample(channel, num):
+    """ Expected value of sample @num of @channel. """
+    return (num * (channel + 1)) % 65536 - 32768
+
+
+def index_segment(frames, positions, cbr_size=None, start=0, rate=(25, 1)):
+    """ Builds an Index Table Segment for @frames edit units starting at @positions. """
+
+    items = [
+        ('3c0a', uid(200 + start)),
+        ('3f0b', struct.pack('>II', *rate)),
+        ('3f0c', struct.pack('>q', start)),
+        ('3f0d', struct.pack('>q', frames)),
+    ]
+    if cbr_size:
+        items.append(('3f05', struct.pack('>I', cbr_size)))
+    else:
+        items.append(('3f05', struct.pack('>I', 0)))
+    items += [
+        ('3f06', struct.pack('>I', 1)),
+        ('3f07', struct.pack('>I', 1)),
+        ('3f08', '\x00'),
+        ('3f0e', '\x00'),
+    ]
+    if not cbr_size:
+        items.append(('3f09', struct.pack('>II', 2, 6) + struct.pack('>bBI', 0, 0, 0) + struct.pack('>bBI', 0, 0, 0)))
+        entries = []
+        for frame in range(start, start + frames):
+            kind = GOP[frame % len(GOP)]
+            flags = {'I': 0xc0, 'P': 0x22, 'B': 0x33}[kind]
+            key_offset = -(frame % len(GOP))
+            entries.append(struct.pack('>bbBQ', 0, key_offset, flags, positions[frame]))
+        items.append(('3f0a', struct.pack('>II', len(entries), 11) + ''.join(entries)))
+
+    value = ''.join([tag.decode('hex_codec') + struct.pack('>H', len(item)) + item for tag, item in items])
+    return klv(INDEX_KEY, value)
+
+
+def build(frames=10, partitions=1, index='vbr', footer=True, run_in='', start_timecode=900000, drop_frame=False, rate=(25, 1), timecode_base=None):
+    """ Builds a synthetic OP1a MXF file.
+
+    @frames: number of edit units.
+    @partitions: number of body partitions the essence is split in.
+    @index: 'vbr', 'cbr' or None, index table segment written in the footer.
+    @footer: whether to write footer partition and Random Index Pack.
+    @run_in: bytes to prepend to the file.
+
+    @returns: a tuple containing file data and a dict of interesting offsets.
+    """
+
+    cbr = index == 'cbr'
+    metadata = header_metadata(frames, start_timecode, drop_frame, rate, timecode_base)
+    fill = klv(FILL_KEY, '\x00' * 11)
+    header_size = len(partition_pack(2, 4)) + len(fill) + len(metadata)
+    info = {'frames': [], 'partitions': [], 'essence': []}
+
+    body = ''
+    stream_offset = 0
+    per_partition = (frames + partitions - 1) / partitions
+    previous = 0
+    for part in range(partitions):
+        this = header_size + len(body)
+        info['partitions'].append(this)
+        body += partition_pack(3, 4, this=this, previous=previous, body_offset=stream_offset, body_sid=1)
+        previous = this
+        for frame in range(part * per_partition, min(frames, (part + 1) * per_partition)):
+            info['frames'].append(stream_offset)
+            info['essence'].append(len(run_in) + header_size + len(body))
+            element = klv(PICTURE_ELEMENT_KEY, picture(frame, cbr)) + klv(SOUND_ELEMENT_KEY, sound(frame))
+            body += element
+            stream_offset += len(element)
+
+    footer_pos = header_size + len(body)
+    tail = ''
+    if footer:
+        segment = ''
+        if index == 'vbr':
+            segment = index_segment(frames, info['frames'], rate=rate)
+        elif index == 'cbr':
+            segment = index_segment(0, None, cbr_size=info['frames'][1] - info['frames'][0], rate=rate)
+        tail = partition_pack(4, 4, this=footer_pos, previous=previous, footer=footer_pos,
+            index_byte_count=len(segment), index_sid=index and 1 or 0, essence_containers=True)
+        tail += segment
+        entries = [(0, 0)] + [(1, pos) for pos in info['partitions']] + [(0, footer_pos)]
+        rip = ''.join([struct.pack('>IQ', sid, pos) for sid, pos in entries])
+        tail += klv(RIP_KEY, rip + struct.pack('>I', 16 + 5 + len(rip) + 4))
+
+    header = partition_pack(2, footer and 4 or 1, footer=footer and footer_pos or 0,
+        header_byte_count=len(metadata)) + fill + metadata
+    info['footer'] = footer and footer_pos or None
+    info['header_end'] = len(run_in) + header_size
+    return run_in + header + body + tail, info
+
+
+def write(filename, **kwargs):
+    """ Writes a synthetic MXF file, see build. """
+
+    data, info = build(**kwargs)
+    fdesc = open(filename, 'wb')
+    fdesc.write(data)
+    fdesc.close()
+    return info
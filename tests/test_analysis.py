@@ -0,0 +1,85 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for frame sizes and bitrate analysis. """
+
+import sys
+import unittest
+
+from sjmxf import parser, analysis
+from sjmxf.s377m import S377MException
+import mxfsample
+
+
+def profile(filename, **kwargs):
+    """ Returns the collected frame size profile of a sample file written to @filename. """
+
+    mxfsample.write(filename, **kwargs)
+    mxf = parser.OP1aParser(filename)
+    mxf.read()
+    mxf.close()
+
+    ret = analysis.FrameSizeProfile(mxf)
+    ret.collect()
+    return ret
+
+
+@unittest.skipIf(analysis.numpy is None, 'NumPy is not installed')
+class FrameSizeProfileTest(unittest.TestCase):
+    """ Verify element sizes from index and body walk, and their analysis. """
+
+    def setUp(self):
+        self.frames = 60
+        self.pictures = [mxfsample.PICTURE_SIZES[mxfsample.GOP[frame % len(mxfsample.GOP)]] for frame in range(self.frames)]
+
+    def test_sources(self):
+        """ Test index and body walk sizes match """
+
+        indexed = profile('analysis.mxf.new', frames=self.frames, partitions=3)
+        walked = profile('analysis-walk.mxf.new', frames=self.frames, partitions=3, index=None)
+        cbr = profile('analysis-cbr.mxf.new', frames=self.frames, index='cbr')
+
+        self.assertEqual((indexed.source, walked.source, cbr.source), ('index', 'walk', 'index'))
+        for item in (indexed, walked):
+            self.assertEqual(item.track().tolist(), self.pictures)
+            self.assertEqual(item.track(mxfsample.SOUND_TRACK_NUMBER).tolist(), [mxfsample.SAMPLES_PER_FRAME * 4] * self.frames)
+        self.assertEqual(cbr.track().tolist(), [mxfsample.PICTURE_SIZES['I']] * self.frames)
+        self.assertEqual(walked.edit_rate, (25, 1))
+
+    def test_structure(self):
+        """ Test picture types and GOP lengths from index flags """
+
+        indexed = profile('analysis.mxf.new', frames=self.frames)
+        self.assertEqual(indexed.picture_types(), (mxfsample.GOP * 7)[0:self.frames])
+        self.assertEqual(indexed.gops().tolist(), [9] * 6 + [6])
+        self.assertEqual(profile('analysis-walk.mxf.new', frames=4, index=None).gops(), None)
+
+    def test_bitrate(self):
+        """ Test sliding window bitrates, statistics and outliers """
+
+        indexed = profile('analysis.mxf.new', frames=self.frames)
+        bitrate = indexed.bitrate()
+        self.assertEqual(len(bitrate), self.frames - 24)
+        self.assertEqual(bitrate[3], sum(self.pictures[3:28]) * 8)
+        self.assertEqual(indexed.bitrate(window=1).tolist(), [size * 8 * 25.0 for size in self.pictures])
+
+        stats = indexed.statistics()
+        self.assertEqual((stats['count'], stats['min'], stats['max']), (self.frames, 800, 3000))
+        self.assertEqual(stats['percentiles'][50], 800)
+        self.assertEqual(stats['bitrate_max'], bitrate.max())
+        self.assertEqual(stats['bitrate_mean'], sum(self.pictures) * 8 * 25.0 / self.frames)
+
+        self.assertEqual(indexed.outliers().tolist(), [])
+        indexed.sizes[mxfsample.PICTURE_TRACK_NUMBER][13] = 20000
+        self.assertEqual(indexed.outliers().tolist(), [13])
+
+        # Tracks without elements
+        indexed.sizes[mxfsample.SOUND_TRACK_NUMBER] = indexed.sizes[mxfsample.SOUND_TRACK_NUMBER][0:0]
+        self.assertRaises(S377MException, indexed.statistics, mxfsample.SOUND_TRACK_NUMBER)
+        self.assertRaises(S377MException, indexed.bitrate, mxfsample.SOUND_TRACK_NUMBER)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(FrameSizeProfileTest)
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
@@ -0,0 +1,99 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for PCM sound essence decoding. """
+
+import sys
+import struct
+import unittest
+
+from sjmxf import parser, audio
+import mxfsample
+
+
+def expected(start, stop):
+    """ Sample values of the test files between @start and @stop. """
+    return [[mxfsample.sample(channel, num) for channel in range(mxfsample.CHANNELS)] for num in range(start, stop)]
+
+
+@unittest.skipIf(audio.numpy is None, 'NumPy is not installed')
+class PCMDecodeTest(unittest.TestCase):
+    """ Verify PCM sample formats decoding. """
+
+    def test_widths(self):
+        """ Test 8, 16, 24 and 32 bits samples """
+
+        values = [-8388608, -1, 0, 1, 8388607, 12345]
+        data = ''.join([struct.pack('<i', value)[0:3] for value in values])
+        self.assertEqual(audio.pcm_decode(data, 2, 6).tolist(), [values[0:2], values[2:4], values[4:6]])
+
+        values = [-2147483648, 2147483647]
+        self.assertEqual(audio.pcm_decode(struct.pack('<2i', *values) + 'xx', 1, 4).tolist(), [[value] for value in values])
+
+        self.assertEqual(audio.pcm_decode('\x00\x80\xff\x7f', 2, 2).tolist(), [[-128, 0], [127, -1]])
+        self.assertEqual(audio.pcm_decode(struct.pack('<4h', -32768, 1, 2, 32767), 4, 8).tolist(), [[-32768, 1, 2, 32767]])
+        self.assertEqual(audio.pcm_decode('', 2, 4).shape, (0, 2))
+        self.assertRaises(audio.S377MException, audio.pcm_decode, 'xxx', 2, 5)
+
+
+@unittest.skipIf(audio.numpy is None, 'NumPy is not installed')
+class PCMReaderTest(unittest.TestCase):
+    """ Verify sample ranges and blocks of a sound track. """
+
+    def setUp(self):
+        mxfsample.write('audio.mxf.new', frames=6, partitions=2)
+        self.mxf = parser.OP1aParser('audio.mxf.new')
+        self.mxf.read()
+        self.mxf.close()
+        self.reader = audio.PCMReader(self.mxf)
+
+    def tearDown(self):
+        self.reader.close()
+
+    def test_layout(self):
+        """ Test track layout from its descriptor """
+
+        self.assertEqual(self.reader.track_number, mxfsample.SOUND_TRACK_NUMBER)
+        self.assertEqual((self.reader.channels, self.reader.bits, self.reader.block_align), (2, 16, 4))
+        self.assertEqual(self.reader.sample_rate, (48000, 1))
+        self.assertEqual(len(self.reader), 6 * mxfsample.SAMPLES_PER_FRAME)
+
+        # CP sound and picture tracks are not PCM
+        self.assertTrue(audio.is_pcm_track(mxfsample.SOUND_TRACK_NUMBER))
+        self.assertFalse(audio.is_pcm_track(0x06010101))
+        self.assertRaises(audio.S377MException, audio.PCMReader, self.mxf, mxfsample.PICTURE_TRACK_NUMBER)
+
+    def test_samples(self):
+        """ Test sample ranges within and across elements and partitions """
+
+        per_frame = mxfsample.SAMPLES_PER_FRAME
+        for start, stop in ((0, 10), (100, per_frame), (per_frame - 5, 2 * per_frame + 7), (0, 6 * per_frame),
+            (5 * per_frame + 10, 10 * per_frame), (50, 50)):
+            samples = self.reader.samples(start, stop)
+            stop = min(stop, 6 * per_frame)
+            self.assertEqual(samples.shape, (stop - start, 2))
+            self.assertEqual(samples.tolist(), expected(start, stop))
+
+    def test_blocks(self):
+        """ Test block iteration and levels """
+
+        blocks = list(self.reader.blocks(1000, start=500))
+        self.assertEqual([pos for pos, _ in blocks], range(500, 6 * mxfsample.SAMPLES_PER_FRAME, 1000))
+        self.assertEqual(sum([len(block) for _, block in blocks]), 6 * mxfsample.SAMPLES_PER_FRAME - 500)
+        self.assertEqual(blocks[3][1].tolist(), expected(3500, 4500))
+
+        peaks, rms = self.reader.levels(1000)
+        self.assertEqual(peaks.shape, (12, 2))
+        self.assertEqual(peaks[0].tolist(), [1.0, 1.0])
+        self.assertTrue((rms <= peaks).all())
+        values = [value[1] for value in expected(2000, 3000)]
+        self.assertAlmostEqual(rms[2][1], (sum([value * value for value in values]) / 1000.0) ** 0.5 / 32768)
+        self.assertAlmostEqual(peaks[2][1], max([abs(value) for value in values]) / 32768.0)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(PCMDecodeTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(PCMReaderTest))
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
@@ -0,0 +1,202 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for byte range backends and the block cache. """
+
+import os
+import re
+import sys
+import unittest
+import threading
+import BaseHTTPServer
+import SocketServer
+
+from sjmxf import backend, parser, s377m
+import mxfsample
+
+
+class RangeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Serves files of the current directory, honoring single byte ranges. """
+
+    protocol_version = 'HTTP/1.1'
+
+    def send_data(self, head=False):
+        size = os.path.getsize(self.path.lstrip('/'))
+        match = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+        if match and self.server.ranges:
+            first, last = int(match.group(1)), min(int(match.group(2)), size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (first, last, size))
+        else:
+            first, last = 0, size - 1
+            self.send_response(200)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.end_headers()
+        if not head:
+            fdesc = open(self.path.lstrip('/'), 'rb')
+            fdesc.seek(first)
+            self.wfile.write(fdesc.read(last - first + 1))
+            fdesc.close()
+        self.server.requests.append((self.command, self.headers.get('Range')))
+
+    def do_HEAD(self):
+        self.send_data(head=True)
+
+    def do_GET(self):
+        self.send_data()
+
+    def log_message(self, *args):
+        pass
+
+
+class RangeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Threaded server keeping track of its handler threads and errors. """
+
+    daemon_threads = True
+
+    def __init__(self, *args):
+        BaseHTTPServer.HTTPServer.__init__(self, *args)
+        self.requests = []
+        self.ranges = True
+        self.threads = []
+        self.errors = []
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        thread.daemon = True
+        self.threads.append(thread)
+        thread.start()
+
+    def handle_error(self, request, client_address):
+        self.errors.append(sys.exc_info()[1])
+
+
+def write_data(filename, size=100000):
+    """ Writes @size bytes of test data to @filename, returns them. """
+
+    data = ''.join([chr(idx % 253) for idx in range(0, size)])
+    fdesc = open(filename, 'wb')
+    fdesc.write(data)
+    fdesc.close()
+    return data
+
+
+class BlockCacheTest(unittest.TestCase):
+    """ Verify block alignment, coalescing and eviction. """
+
+    def setUp(self):
+        self.data = write_data('backend.bin.new')
+
+    def test_read(self):
+        """ Test small reads are served by aligned blocks """
+
+        for local in (backend.LocalBackend, backend.MmapBackend):
+            cache = backend.BlockCache(local('backend.bin.new'), block_size=4096, capacity=8)
+            fdesc = cache.open()
+            for pos in range(100, 8000, 300):
+                fdesc.seek(pos)
+                self.assertEqual(fdesc.read(25), self.data[pos:pos + 25])
+            self.assertEqual(cache.backend.requests, 2)
+
+            # Consecutive missing blocks fetched at once
+            self.assertEqual(cache.read(10000, 20000), self.data[10000:30000])
+            self.assertEqual(cache.backend.requests, 3)
+            self.assertEqual(len(cache.blocks), 8)
+
+            # Least recently used block evicted and fetched again
+            self.assertEqual(cache.read(40000, 10), self.data[40000:40010])
+            self.assertFalse(0 in cache.blocks)
+            self.assertEqual(cache.read(0, 10), self.data[0:10])
+
+            # Reads larger than the cache bypass it
+            self.assertEqual(cache.read(0, 50000), self.data[0:50000])
+            self.assertEqual(cache.read(99990, 100), self.data[99990:])
+            self.assertEqual(cache.read(100000, 100), '')
+            fdesc.seek(-5, 2)
+            self.assertEqual(fdesc.read(), self.data[-5:])
+            self.assertEqual(cache.stats()['requests'], 7)
+            cache.close()
+
+
+class HTTPBackendTest(unittest.TestCase):
+    """ Verify parsing over HTTP range requests. """
+
+    def setUp(self):
+        self.server = RangeServer(('127.0.0.1', 0), RangeRequestHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_address[1]
+
+    def tearDown(self):
+        self.server.shutdown()
+        # Handlers end once clients closed their connections
+        for thread in self.server.threads:
+            thread.join(5)
+        self.server.server_close()
+        self.assertFalse([thread for thread in self.server.threads if thread.is_alive()])
+        self.assertEqual(self.server.errors, [])
+
+    def test_ranges(self):
+        """ Test range reads and size """
+
+        data = write_data('backend.bin.new', size=5000)
+        http = backend.HTTPBackend(self.url + 'backend.bin.new')
+        try:
+            self.assertEqual(http.size(), len(data))
+            self.assertEqual(http.read_range(10, 20), data[10:30])
+            self.assertEqual(http.read_range(len(data) - 5, 20), data[-5:])
+        finally:
+            http.close()
+        self.assertEqual(self.server.requests[1:], [('GET', 'bytes=10-29'), ('GET', 'bytes=%d-%d' % (len(data) - 5, len(data) + 14))])
+
+    def test_no_ranges(self):
+        """ Test servers ignoring range requests are rejected """
+
+        write_data('backend.bin.new', size=5000)
+        self.server.ranges = False
+        http = backend.HTTPBackend(self.url + 'backend.bin.new')
+        try:
+            self.assertRaises(IOError, http.read_range, 10, 20)
+        finally:
+            http.close()
+
+    def test_parse(self):
+        """ Test header and footer parsing in a few round trips """
+
+        mxfsample.write('backend.mxf.new', frames=400, partitions=4)
+        local = parser.OP1aParser('backend.mxf.new')
+        local.read()
+        local.close()
+
+        cache = backend.open_backend(self.url + 'backend.mxf.new', block_size=64 * 1024)
+        # HEAD then header and footer in parallel
+        self.assertEqual(len(self.server.requests), 3)
+
+        mxf = parser.mxf_kind('backend.mxf.new', backend=cache)
+        mxf.header_partition_parse()
+        mxf.header_metadata_parse()
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual([(klv.__class__, klv.pos, klv.length) for klv in mxf.data['header']['klvs']],
+            [(klv.__class__, klv.pos, klv.length) for klv in local.data['header']['klvs']])
+
+        # Body walked by key peeks, values are not read
+        mxf.body_parse()
+        mxf.footer_partition_parse()
+        mxf.footer_extra_parse()
+        mxf.close()
+        self.assertEqual(mxf.data['essence'], local.data['essence'])
+        self.assertEqual(mxf.edit_unit_count(), 400)
+        self.assertTrue(len(self.server.requests) < 3 + os.path.getsize('backend.mxf.new') / (64 * 1024) + 2)
+
+        fills = [klv for klv in mxf.data['header']['klvs'] if isinstance(klv, s377m.KLVFill)]
+        self.assertEqual(fills[0].data, '\x00' * fills[0].length)
+        cache.close()
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(BlockCacheTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(HTTPBackendTest))
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
@@ -5,8 +5,10 @@
 
 import sys
 import unittest
+from StringIO import StringIO
 
-from sjmxf.common import InterchangeObject
+from sjmxf import common
+from sjmxf.common import InterchangeObject, Diagnostics, UL, copy_range
 
 
 class InterchangeObjectTest(unittest.TestCase):
@@ -78,8 +80,118 @@ class InterchangeObjectTest(unittest.TestCase):
         self.assertEqual(InterchangeObject.ber_encode_length(256, prefix=False), '0100')
         self.assertEqual(InterchangeObject.ber_encode_length(485, prefix=False), '01e5')
 
+class DiagnosticsTest(unittest.TestCase):
+    """ Test diagnostics channel. """
+
+    def test_subscribe(self):
+        """ Test events only reach subscribers. """
+        diagnostics = Diagnostics()
+        self.assertFalse(diagnostics)
+
+        warnings = diagnostics.collect()
+        events = diagnostics.collect(levels=None)
+        self.assertTrue(diagnostics)
+        self.assertEqual(len(diagnostics.subscribers), 2)
+
+        diagnostics.emit('debug', 'klv', 16)
+        diagnostics.emit('warning', 'broken', 32, tag='3c0a')
+        self.assertEqual(len(events), 2)
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual((warnings[0].pos, warnings[0].details['tag']), (32, '3c0a'))
+        self.assertEqual(str(warnings[0]), 'warning at 32: broken')
+
+        diagnostics.unsubscribe(warnings)
+        diagnostics.unsubscribe(events)
+        self.assertFalse(diagnostics)
+
+
+class ULTest(unittest.TestCase):
+    """ Test Universal Label value type. """
+
+    def test_interning(self):
+        """ Test identical labels are built once """
+        label = '060e2b34020501010d01020101050100'.decode('hex_codec')
+        self.assertTrue(UL(label) is UL(label[:] + ''))
+        self.assertTrue(UL(UL(label)) is UL(label))
+        self.assertEqual(UL(label), label)
+        self.assertEqual(UL(label).hex, '060e2b34020501010d01020101050100')
+        self.assertEqual({label: 1}[UL(label)], 1)
+
+    def test_matches(self):
+        """ Test masked comparison ignores the version byte """
+        label = UL('060e2b34020501010d01020101050100'.decode('hex_codec'))
+        self.assertTrue(label.matches('060e2b34020501020d01020101050100'.decode('hex_codec')))
+        self.assertFalse(label.matches('060e2b34020501010d01020101050101'.decode('hex_codec')))
+        self.assertFalse(label == '060e2b34020501020d01020101050100'.decode('hex_codec'))
+
+    def test_limit(self):
+        """ Test interning table is bounded """
+        limit = UL.MAX_INTERNED
+        UL.MAX_INTERNED = 4
+        try:
+            for idx in range(0, 10):
+                UL('label %d' % idx)
+                self.assertTrue(len(UL._interned) <= 4)
+        finally:
+            UL.MAX_INTERNED = limit
+
+class CopyRangeTest(unittest.TestCase):
+    """ Test byte range copies between files. """
+
+    def setUp(self):
+        self.data = ''.join([chr(idx % 251) for idx in range(0, 300000)])
+        fdesc = open('copy.src.new', 'wb')
+        fdesc.write(self.data)
+        fdesc.close()
+
+    def copy(self, dst, offset, length, **kwargs):
+        src = open('copy.src.new', 'rb')
+        src.seek(10)
+        dst.write('head')
+        ret = copy_range(src, dst, offset, length, **kwargs)
+        dst.write('tail')
+        # Source cursor untouched
+        self.assertEqual(src.tell(), 10)
+        src.close()
+        return ret
+
+    def test_files(self):
+        """ Test copies between files """
+        dst = open('copy.dst.new', 'wb')
+        method = self.copy(dst, 1000, 200000)
+        dst.close()
+        self.assertEqual(open('copy.dst.new', 'rb').read(), 'head' + self.data[1000:201000] + 'tail')
+        if common.KERNEL_COPIES:
+            self.assertEqual(method, common.KERNEL_COPIES[0][0])
+
+    def test_buffered(self):
+        """ Test buffered copies to file like objects """
+        dst = StringIO()
+        self.assertEqual(self.copy(dst, 7, 100000, chunk_size=4096), 'buffered')
+        self.assertEqual(dst.getvalue(), 'head' + self.data[7:100007] + 'tail')
+
+        kernel_copies = common.KERNEL_COPIES
+        common.KERNEL_COPIES = []
+        try:
+            dst = open('copy.dst.new', 'wb')
+            self.assertEqual(self.copy(dst, 0, 300000), 'buffered')
+            dst.close()
+        finally:
+            common.KERNEL_COPIES = kernel_copies
+        self.assertEqual(open('copy.dst.new', 'rb').read(), 'head' + self.data + 'tail')
+
+    def test_short(self):
+        """ Test copies past the end of the source fail """
+        self.assertRaises(IOError, self.copy, StringIO(), 299000, 2000)
+        self.assertRaises(IOError, self.copy, open('copy.dst.new', 'wb'), 299000, 2000)
+
+
 if __name__ == '__main__':
-    SUITE = unittest.TestLoader().loadTestsFromTestCase(InterchangeObjectTest)
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(InterchangeObjectTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(DiagnosticsTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(ULTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(CopyRangeTest))
     RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
     sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
 
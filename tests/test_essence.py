@@ -0,0 +1,116 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for essence access. """
+
+import sys
+import unittest
+
+from sjmxf import parser, essence, s377m
+import mxfsample
+
+
+class EssenceReaderTest(unittest.TestCase):
+    """ Verify Generic Container element access. """
+
+    def test_element_key(self):
+        """ Test Generic Container element key decoding """
+
+        element = essence.decode_element_key(mxfsample.SOUND_ELEMENT_KEY)
+        self.assertEqual(element['item_name'], 'gc_sound')
+        self.assertEqual((element['element_count'], element['element_type'], element['element_number']), (1, 3, 1))
+        self.assertEqual(element['track_number'], mxfsample.SOUND_TRACK_NUMBER)
+        self.assertEqual(essence.decode_element_key(mxfsample.FILL_KEY), None)
+
+    def test_indexed(self):
+        """ Test frame lookups through the index """
+
+        info = mxfsample.write('essence.mxf.new', frames=12, partitions=2)
+        mxf = parser.OP1aParser('essence.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        reader = mxf.essence()
+        self.assertEqual(reader.tracks(), [mxfsample.PICTURE_TRACK_NUMBER, mxfsample.SOUND_TRACK_NUMBER])
+        self.assertEqual(reader.edit_unit_counts()[mxfsample.SOUND_TRACK_NUMBER], 12)
+
+        frame = reader.frame(mxfsample.PICTURE_TRACK_NUMBER, 7)
+        self.assertEqual(frame.pos, info['essence'][7])
+        self.assertEqual(frame.element['track_number'], mxfsample.PICTURE_TRACK_NUMBER)
+        self.assertTrue(isinstance(frame.payload, buffer))
+        self.assertEqual(str(frame.payload), mxfsample.picture(7))
+
+        frame = reader.frame(mxfsample.SOUND_TRACK_NUMBER, 11)
+        self.assertEqual(str(frame.payload), mxfsample.sound(11))
+        self.assertRaises(s377m.S377MException, reader.frame, mxfsample.SOUND_TRACK_NUMBER, 12)
+
+        frames = list(reader.frames(mxfsample.PICTURE_TRACK_NUMBER, 3, 9))
+        self.assertEqual([item.edit_unit for item in frames], range(3, 9))
+        self.assertEqual(str(frames[-1].payload), mxfsample.picture(8))
+        reader.close()
+
+    def test_unindexed(self):
+        """ Test frame lookups walking the essence """
+
+        mxfsample.write('essence.mxf.new', frames=6, partitions=3, index=None)
+        mxf = parser.OP1aParser('essence.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        reader = mxf.essence()
+        self.assertEqual(reader.edit_unit_counts()[mxfsample.PICTURE_TRACK_NUMBER], 6)
+        self.assertEqual(str(reader.frame(mxfsample.PICTURE_TRACK_NUMBER, 4).payload), mxfsample.picture(4))
+        self.assertEqual(len(list(reader.frames(mxfsample.SOUND_TRACK_NUMBER))), 6)
+        self.assertRaises(s377m.S377MException, reader.frame, mxfsample.PICTURE_TRACK_NUMBER, 6)
+        reader.close()
+
+
+class PrefetchingReaderTest(unittest.TestCase):
+    """ Verify background read-ahead. """
+
+    def test_frames(self):
+        """ Test frames are returned in order across chunks """
+
+        mxfsample.write('prefetch.mxf.new', frames=12, partitions=3)
+        mxf = parser.OP1aParser('prefetch.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        # Sound elements do not fit in a chunk
+        reader = essence.PrefetchingReader(mxf, depth=1, chunk_size=4096)
+        frames = [(item.track_number, item.edit_unit, str(item.payload)) for item in reader]
+        reader.close()
+
+        self.assertEqual(len(frames), 24)
+        self.assertEqual(frames[6], (mxfsample.PICTURE_TRACK_NUMBER, 3, mxfsample.picture(3)))
+        self.assertEqual(frames[23], (mxfsample.SOUND_TRACK_NUMBER, 11, mxfsample.sound(11)))
+
+        stats = reader.stats()
+        self.assertEqual(stats['frames'], 24)
+        self.assertTrue(stats['bytes_read'] >= sum([entry['length'] for entry in mxf.data['essence']]))
+        self.assertTrue(stats['chunks'] >= 24)
+
+    def test_tracks(self):
+        """ Test track selection and early close """
+
+        mxfsample.write('prefetch.mxf.new', frames=12)
+        mxf = parser.OP1aParser('prefetch.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        reader = essence.PrefetchingReader(mxf, [mxfsample.PICTURE_TRACK_NUMBER], depth=2, chunk_size=16384)
+        frames = reader.frames()
+        for edit_unit in range(0, 5):
+            frame = frames.next()
+            self.assertEqual(frame.edit_unit, edit_unit)
+            self.assertEqual(str(frame.payload), mxfsample.picture(edit_unit))
+        reader.close()
+        self.assertFalse(reader._thread)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(EssenceReaderTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(PrefetchingReaderTest))
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for the header metadata model. """
+
+import sys
+import unittest
+
+from sjmxf import parser, header
+from sjmxf.s377m import MXFDataSet
+import mxfsample
+
+
+class HeaderModelTest(unittest.TestCase):
+    """ Verify sets are indexed, cached and re-read. """
+
+    def setUp(self):
+        mxfsample.write('header.mxf.new', frames=4)
+
+        self.full = parser.OP1aParser('header.mxf.new')
+        self.full.read()
+        self.full.close()
+        self.expected = dict([(klv.data['\x3c\x0a'].read(), klv) for klv in self.full.data['header']['klvs']
+            if isinstance(klv, MXFDataSet)])
+
+        self.mxf = parser.OP1aParser('header.mxf.new')
+        self.mxf.open()
+        self.mxf.header_partition_parse()
+        self.mxf.close()
+
+    def test_scan(self):
+        """ Test every set is indexed and decoded as by the parser """
+
+        model = header.HeaderModel(self.mxf)
+        self.assertEqual(model.scan(), len(self.expected))
+        self.assertEqual(sorted(model), sorted(self.expected.keys()))
+
+        for uid, expected in self.expected.items():
+            klv = model[uid]
+            self.assertEqual((klv.__class__, klv.pos, klv.length), (expected.__class__, expected.pos, expected.length))
+            self.assertEqual([value.read() for value in klv.data.values()],
+                [value.read() for value in expected.data.values()])
+
+        self.assertEqual(model.preface.set_type, 'Preface')
+        self.assertEqual(model.get('\x00' * 16), None)
+        self.assertRaises(KeyError, model.__getitem__, '\x00' * 16)
+        model.close()
+
+    def test_budget(self):
+        """ Test evicted sets are re-read and counters updated """
+
+        model = header.HeaderModel(self.mxf)
+        model.scan()
+        uids = list(model)
+        # Room for the Primer Pack and the first three sets only
+        self.assertTrue(model.primer_size > 0)
+        self.assertEqual(model.size, model.primer_size)
+        model.budget = model.primer_size + sum([model.cost(uid) for uid in uids[0:3]])
+
+        for uid in uids[0:3]:
+            model.get(uid)
+        self.assertEqual((model.hits, model.misses), (0, 3))
+
+        # Most recently used kept
+        first = model.get(uids[0])
+        self.assertEqual(model.hits, 1)
+
+        for uid in uids[3:]:
+            model.get(uid)
+            self.assertTrue(model.size <= model.budget or len(model.cache) == 1)
+        self.assertTrue(model.evictions > 0)
+        self.assertTrue(len(model.cache) < len(uids))
+
+        # Re-read from the file once evicted
+        again = model.get(uids[0])
+        self.assertFalse(again is first)
+        self.assertEqual(again.data['\x3c\x0a'].read(), uids[0])
+
+        stats = model.stats()
+        self.assertEqual(stats['sets'], len(uids))
+        self.assertEqual(stats['hits'] + stats['misses'], len(uids) + 2)
+        self.assertEqual([klv.set_type for klv in model.sets('MaterialPackage')], ['MaterialPackage'])
+
+        # Decoded sets are not kept out of the cache
+        model.preface
+        self.assertEqual(self.mxf.data['header']['preface'], None)
+        model.clear()
+        self.assertEqual(model.size, model.primer_size)
+        model.close()
+
+
+def fingerprint(filename, **kwargs):
+    """ Returns the header fingerprint of a sample file written to @filename. """
+
+    mxfsample.write(filename, **kwargs)
+    mxf = parser.OP1aParser(filename)
+    mxf.open()
+    mxf.header_partition_parse()
+    mxf.close()
+
+    model = header.HeaderModel(mxf)
+    model.scan()
+    ret = model.fingerprint()
+    model.close()
+    return ret
+
+
+class FingerprintTest(unittest.TestCase):
+    """ Verify structural fingerprints and their comparison. """
+
+    def test_stable(self):
+        """ Test fingerprints do not depend on positions """
+
+        first = fingerprint('fingerprint.mxf.new', frames=4)
+        second = fingerprint('fingerprint-run-in.mxf.new', frames=4, run_in='\x00' * 10)
+        self.assertEqual(first, second)
+        self.assertEqual(first.diff(second), [])
+
+        self.assertEqual(first.nodes['Preface'][0], 'Preface')
+        self.assertEqual(first.nodes['Preface/content'][0], 'ContentStorage')
+        self.assertEqual(first.nodes['Preface/content/packages[0]'][0], 'MaterialPackage')
+        self.assertTrue('Preface/content/packages[0]/tracks[2]/segment' in first.nodes)
+
+        first.save('fingerprint.json.new')
+        loaded = header.Fingerprint.load('fingerprint.json.new')
+        self.assertEqual(loaded, first)
+        self.assertEqual(loaded.nodes, first.nodes)
+
+    def test_diff(self):
+        """ Test differing subtrees are reported """
+
+        first = fingerprint('fingerprint.mxf.new', frames=4)
+        second = fingerprint('fingerprint-tc.mxf.new', frames=4, start_timecode=1000)
+        self.assertNotEqual(first, second)
+
+        diff = first.diff(second)
+        self.assertEqual(len(diff), 1)
+        self.assertEqual(first.nodes[diff[0]][0], 'TimecodeComponent')
+        self.assertTrue(diff[0].startswith('Preface/content/packages[0]/tracks['))
+
+        # Ancestors tree digests differ, their own set digests do not
+        self.assertNotEqual(first.nodes['Preface/content'][2], second.nodes['Preface/content'][2])
+        self.assertEqual(first.nodes['Preface/content'][1], second.nodes['Preface/content'][1])
+
+        third = fingerprint('fingerprint-frames.mxf.new', frames=5)
+        self.assertTrue(len(first.diff(third)) > 1)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(HeaderModelTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(FingerprintTest))
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for Index Table generation. """
+
+import sys
+import unittest
+
+from sjmxf import parser, indexer
+from sjmxf.validator import Validator
+import mxfsample
+
+
+def reindex(filename, footer=True, **kwargs):
+    """ Reindex @filename and returns the parser of the result. """
+
+    mxf = parser.OP1aParser(filename)
+    if footer:
+        mxf.read()
+    else:
+        # Header metadata only, the parser expects a Footer Partition
+        mxf.open()
+        mxf.header_partition_parse()
+        mxf.header_metadata_parse()
+    mxf.close()
+    reindexer = indexer.Reindexer(mxf, **kwargs)
+    reindexer.write()
+
+    mxf = parser.OP1aParser(filename)
+    mxf.read()
+    mxf.close()
+    return reindexer, mxf
+
+
+class ReindexerTest(unittest.TestCase):
+    """ Verify index partitions written for files without index. """
+
+    def test_vbr(self):
+        """ Test edit unit positions and MPEG-2 flags of a VBR index """
+
+        info = mxfsample.write('noindex.mxf.new', frames=20, partitions=3, index=None)
+        reindexer, mxf = reindex('noindex.mxf.new')
+
+        self.assertEqual(reindexer.edit_unit_byte_count, None)
+        self.assertEqual(mxf.edit_unit_count(), 20)
+        for frame in range(0, 20):
+            self.assertEqual(mxf.edit_unit_position(frame), info['essence'][frame])
+
+        entries = mxf.data['index'][0].data['index_entries']
+        self.assertEqual([entry[2] for entry in entries[0:4]], [0xc0, 0x33, 0x33, 0x22])
+        self.assertEqual([entry[1] for entry in entries[9:12]], [0, -1, -2])
+        self.assertEqual(mxf.data['index'][0].data['index_edit_rate'], (25, 1))
+        self.assertEqual(Validator('noindex.mxf.new').run(), [])
+
+    def test_cbr(self):
+        """ Test constant edit unit sizes give a CBR index """
+
+        info = mxfsample.write('cbrindex.mxf.new', frames=6, index='cbr')
+        reindexer, mxf = reindex('cbrindex.mxf.new', index_sid=2)
+
+        self.assertEqual(reindexer.edit_unit_byte_count, info['frames'][1] - info['frames'][0])
+        self.assertEqual(mxf.edit_unit_count(index_sid=2), 6)
+        self.assertEqual(mxf.edit_unit_position(5, index_sid=2), info['essence'][5])
+        self.assertEqual(Validator('cbrindex.mxf.new').run(), [])
+
+    def test_no_footer(self):
+        """ Test a Footer Partition is added when missing """
+
+        info = mxfsample.write('nofooter.mxf.new', frames=5, index=None, footer=False)
+        reindexer, mxf = reindex('nofooter.mxf.new', footer=False)
+
+        self.assertEqual(mxf.data['footer']['partition'].data['previous_partition'], reindexer.tail)
+        self.assertEqual(mxf.edit_unit_position(4), info['essence'][4])
+        self.assertEqual(Validator('nofooter.mxf.new').run(), [])
+
+
+    def test_scan_closes(self):
+        """ Test scanning with a parser never opened leaves it closed """
+
+        mxfsample.write('noindex.mxf.new', frames=4, run_in='\x00' * 10, index=None)
+        mxf = parser.OP1aParser('noindex.mxf.new')
+        reindexer = indexer.Reindexer(mxf, body_sid=1, edit_rate=(25, 1))
+        self.assertEqual(len(reindexer.scan()), 4)
+        self.assertEqual(mxf.run_in, 10)
+        self.assertEqual(mxf.fd, None)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(ReindexerTest)
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
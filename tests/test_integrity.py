@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for integrity digests. """
+
+import sys
+import hashlib
+import unittest
+
+from sjmxf import parser, integrity
+import mxfsample
+
+
+class IntegrityCheckerTest(unittest.TestCase):
+    """ Verify single pass digests. """
+
+    def setUp(self):
+        self.data, self.info = mxfsample.build(frames=9, partitions=3, run_in='\x00' * 100)
+        fdesc = open('integrity.mxf.new', 'wb')
+        fdesc.write(self.data)
+        fdesc.close()
+
+        self.mxf = parser.OP1aParser('integrity.mxf.new')
+        self.mxf.read()
+        self.mxf.close()
+
+    def test_run(self):
+        """ Test digests match hashes of file, partitions and tracks """
+
+        # Small chunks to split KLV headers over reads
+        checker = integrity.IntegrityChecker(self.mxf, chunk_size=7)
+        digests = checker.run()
+        self.assertTrue(self.mxf.data['footer']['digests'] is digests)
+
+        self.assertEqual(digests['file']['md5'], hashlib.md5(self.data).hexdigest())
+        self.assertEqual(digests['file']['sha256'], hashlib.sha256(self.data).hexdigest())
+
+        offsets = [0] + self.info['partitions'] + [self.info['footer']]
+        self.assertEqual(sorted(digests['partitions'].keys()), offsets)
+        start = 100 + self.info['partitions'][1]
+        end = 100 + self.info['partitions'][2]
+        self.assertEqual(digests['partitions'][self.info['partitions'][1]]['md5'], hashlib.md5(self.data[start:end]).hexdigest())
+
+        pictures = ''.join([mxfsample.picture(frame) for frame in range(0, 9)])
+        sounds = ''.join([mxfsample.sound(frame) for frame in range(0, 9)])
+        self.assertEqual(digests['tracks'][mxfsample.PICTURE_TRACK_NUMBER]['md5'], hashlib.md5(pictures).hexdigest())
+        self.assertEqual(digests['tracks'][mxfsample.SOUND_TRACK_NUMBER]['sha256'], hashlib.sha256(sounds).hexdigest())
+
+        self.assertEqual(len(digests['tracks']), 2)
+        self.assertEqual(digests['incomplete'], [])
+        self.assertEqual(digests, integrity.IntegrityChecker(self.mxf).run())
+
+    def test_lost_sync(self):
+        """ Test track digests resume on the partition following an invalid KLV """
+
+        # Invalid BER length of the picture element of the second frame of the second body partition
+        pos = self.info['essence'][4] + 16
+        fdesc = open('integrity.mxf.new', 'r+b')
+        fdesc.seek(pos)
+        fdesc.write('\x89')
+        fdesc.close()
+
+        errors = self.mxf.diagnostics.collect(('error',))
+        digests = integrity.IntegrityChecker(self.mxf, chunk_size=7).run()
+        self.assertEqual(digests['incomplete'], [self.info['partitions'][1]])
+        self.assertEqual([item.pos for item in errors], [self.info['essence'][4]])
+
+        frames = [0, 1, 2, 3, 6, 7, 8]
+        pictures = ''.join([mxfsample.picture(frame) for frame in frames])
+        sounds = ''.join([mxfsample.sound(frame) for frame in frames])
+        self.assertEqual(digests['tracks'][mxfsample.PICTURE_TRACK_NUMBER]['md5'], hashlib.md5(pictures).hexdigest())
+        self.assertEqual(digests['tracks'][mxfsample.SOUND_TRACK_NUMBER]['md5'], hashlib.md5(sounds).hexdigest())
+
+    def test_verify(self):
+        """ Test partial re-verification of partitions """
+
+        checker = integrity.IntegrityChecker(self.mxf, algorithms=('md5',))
+        checker.run()
+        self.assertEqual(checker.verify(), [])
+
+        # Corrupt the second body partition
+        pos = 100 + self.info['partitions'][2] + 200
+        fdesc = open('integrity.mxf.new', 'r+b')
+        fdesc.seek(pos)
+        fdesc.write('\xff')
+        fdesc.close()
+
+        self.assertEqual(checker.verify(), [self.info['partitions'][2]])
+        self.assertEqual(checker.verify(offsets=[self.info['partitions'][1]]), [])
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(IntegrityCheckerTest))
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
@@ -0,0 +1,369 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for MXF parsers. """
+
+import sys
+import struct
+import unittest
+from StringIO import StringIO
+
+from sjmxf import parser, s377m, validator
+import mxfsample
+
+
+def write_partial(filename, data, size):
+    """ Writes the first @size bytes of @data in @filename. """
+    fdesc = open(filename, 'wb')
+    fdesc.write(data[0:size])
+    fdesc.close()
+
+
+class MXFParserIndexTest(unittest.TestCase):
+    """ Verify partition table and index table handling. """
+
+    def test_read(self):
+        """ Test index lookups after a full parse """
+
+        info = mxfsample.write('index.mxf.new', frames=12, partitions=2)
+        mxf = parser.OP1aParser('index.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        self.assertEqual(len(mxf.data['partitions']), 4)
+        self.assertEqual(len(mxf.data['index']), 1)
+        self.assertEqual(mxf.edit_unit_count(), 12)
+        for frame in range(0, 12):
+            self.assertEqual(mxf.edit_unit_position(frame), info['essence'][frame])
+        self.assertRaises(s377m.S377MException, mxf.edit_unit_position, 12)
+
+    def test_cbr_index(self):
+        """ Test constant bytes per edit unit index """
+
+        info = mxfsample.write('cbr.mxf.new', frames=10, index='cbr')
+        mxf = parser.OP1aParser('cbr.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        self.assertEqual(mxf.edit_unit_count(), 10)
+        self.assertEqual(mxf.edit_unit_position(7), info['essence'][7])
+
+
+class MXFParserRunInTest(unittest.TestCase):
+    """ Verify Run-In detection. """
+
+    def test_run_in(self):
+        """ Test Run-In is skipped and byte offsets translated """
+
+        # Run-In with a partial Partition Pack key to skip over
+        run_in = '\x00' * 1000 + '060e2b34020501010d01020101110100'.decode('hex_codec') + '\xff' * 500
+        info = mxfsample.write('runin.mxf.new', frames=4, run_in=run_in)
+
+        mxf = parser.OP1aParser('runin.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        self.assertEqual(mxf.run_in, len(run_in))
+        self.assertEqual(mxf.data['header']['partition'].pos, len(run_in))
+        self.assertEqual(mxf.file_position(mxf.data['footer']['partition'].data['this_partition']),
+            mxf.data['footer']['partition'].pos)
+        self.assertEqual(mxf.partition_offset(mxf.data['footer']['partition'].pos), info['footer'])
+        self.assertEqual(mxf.edit_unit_position(3), info['essence'][3])
+
+        # Detected offset is kept for subsequent opens
+        mxf.run_in_detect = None
+        mxf.open()
+        self.assertEqual(mxf.fd.tell(), len(run_in))
+        mxf.close()
+
+    def test_run_in_limit(self):
+        """ Test Run-In cannot exceed 64KiB """
+
+        mxfsample.write('runin.mxf.new', frames=1, run_in='\x00' * 65536)
+        mxf = parser.OP1aParser('runin.mxf.new')
+        self.assertRaises(Exception, mxf.open)
+
+
+class OperationalPatternRegistryTest(unittest.TestCase):
+    """ Verify parser selection according to operational pattern. """
+
+    def test_lookup(self):
+        """ Test masked matching of operational pattern labels """
+
+        registry = parser.OperationalPatternRegistry(group='sjmxf.tests.none')
+        registry.register('060e2b34040101010d0102010101..00', parser.OP1aParser)
+        registry.register('060e2b34040101..0d010201..10....', parser.AvidParser)
+
+        self.assertEqual(registry.lookup(mxfsample.OP1A_LABEL), parser.OP1aParser)
+        self.assertEqual(registry.lookup('060e2b34040101010d01020101020900'.decode('hex_codec')), None)
+        self.assertEqual(registry.lookup('060e2b34040101020d01020101100300'.decode('hex_codec')), parser.AvidParser)
+
+        registry.unregister(parser.AvidParser)
+        self.assertEqual(registry.lookup('060e2b34040101020d01020101100300'.decode('hex_codec')), None)
+
+    def test_mxf_kind(self):
+        """ Test selected parser reuses detection work """
+
+        mxfsample.write('kind.mxf.new', frames=3)
+        mxf = parser.mxf_kind('kind.mxf.new')
+        self.assertTrue(isinstance(mxf, parser.OP1aParser))
+        self.assertTrue(mxf.data['header']['partition'])
+
+        fdesc = mxf.fd
+        mxf.open()
+        self.assertTrue(mxf.fd is fdesc)
+
+        mxf.read()
+        mxf.close()
+        self.assertEqual(len(mxf.data['partitions']), 3)
+        self.assertEqual(mxf.edit_unit_count(), 3)
+
+
+class MXFParserGrowingFileTest(unittest.TestCase):
+    """ Verify incremental parsing of growing files. """
+
+    def test_poll(self):
+        """ Test poll only parses appended and complete KLVs """
+
+        data, info = mxfsample.build(frames=12, partitions=3)
+        write_partial('growing.mxf.new', data, info['header_end'] - 10)
+
+        mxf = parser.OP1aParser('growing.mxf.new')
+        self.assertEqual(mxf.poll(), [])
+        self.assertEqual(mxf.tail, None)
+
+        # Header and half of the first edit unit
+        write_partial('growing.mxf.new', data, info['essence'][0] + 2000)
+        found = mxf.poll()
+        self.assertEqual(len(found), 1)
+        self.assertTrue(isinstance(found[0], s377m.MXFPartition))
+        self.assertEqual(mxf.tail, info['essence'][0])
+        self.assertTrue(mxf.data['header']['preface'])
+
+        # Up to the middle of the second partition
+        write_partial('growing.mxf.new', data, info['essence'][6] + 10)
+        found = mxf.poll()
+        self.assertEqual([item.pos for item in found], [info['partitions'][1]])
+        self.assertEqual(mxf.tail, info['essence'][6])
+        self.assertEqual(mxf.data['essence'][1]['body_offset'], info['frames'][4])
+        self.assertEqual(mxf.stream_position(1, info['frames'][5]), info['essence'][5])
+        self.assertRaises(s377m.S377MException, mxf.stream_position, 1, info['frames'][6])
+        self.assertEqual(mxf.poll(), [])
+
+        # Complete file
+        write_partial('growing.mxf.new', data, len(data))
+        found = mxf.poll()
+        self.assertEqual(len(found), 3)
+        self.assertTrue(isinstance(found[-1], s377m.MXFIndexTableSegment))
+        self.assertTrue(mxf.data['footer']['random_index_pack'])
+        self.assertEqual(mxf.tail, len(data))
+        self.assertEqual(mxf.edit_unit_count(), 12)
+        self.assertEqual(mxf.edit_unit_position(11), info['essence'][11])
+        self.assertEqual(len(list(mxf.follow())), 0)
+        mxf.close()
+
+
+class MXFParserDiagnosticsTest(unittest.TestCase):
+    """ Verify parsing diagnostics. """
+
+    def setUp(self):
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+
+    def test_quiet(self):
+        """ Test nothing is printed unless in debug mode """
+
+        mxfsample.write('quiet.mxf.new', frames=4)
+        mxf = parser.mxf_kind('quiet.mxf.new')
+        self.assertFalse(mxf.debug)
+        mxf.read()
+        mxf.close()
+        self.assertEqual(sys.stdout.getvalue(), '')
+
+        mxf = parser.mxf_kind('quiet.mxf.new', debug=True)
+        mxf.read()
+        mxf.close()
+        self.assertTrue('Selecting OP1aParser' in sys.stdout.getvalue())
+
+    def test_collect(self):
+        """ Test events are collected with their offsets """
+
+        info = mxfsample.write('quiet.mxf.new', frames=4)
+        mxf = parser.OP1aParser('quiet.mxf.new')
+        warnings = mxf.diagnostics.collect()
+        events = mxf.diagnostics.collect(levels=('debug',))
+        mxf.read()
+        mxf.close()
+
+        self.assertEqual(warnings, [])
+        positions = [item.pos for item in events]
+        for pos in info['essence']:
+            self.assertTrue(pos in positions)
+        self.assertTrue(isinstance(events[-1].details['klv'], s377m.MXFIndexTableSegment))
+
+        primer = mxf.data['header']['primer']
+        self.assertTrue(primer.diagnostics is mxf.diagnostics)
+        self.assertEqual(primer.decode_from_local_tag('\x7f\x7e', '\x00', 1234), ('7f7e', '00'))
+        self.assertEqual(len(warnings), 1)
+        self.assertEqual(warnings[0].pos, 1234)
+
+    def test_unknown_tag(self):
+        """ Test local tags missing from the Primer are reported once per set """
+
+        data, _ = mxfsample.build(frames=4)
+        tag = '\x3c\x01' + struct.pack('>H', len(u'SmartJog'.encode('utf_16_be')))
+        self.assertEqual(data.count(tag), 1)
+        fdesc = open('quiet.mxf.new', 'wb')
+        fdesc.write(data.replace(tag, '\x7f\x7e' + tag[2:]))
+        fdesc.close()
+
+        mxf = parser.OP1aParser('quiet.mxf.new')
+        warnings = mxf.diagnostics.collect()
+        mxf.read()
+        mxf.close()
+        self.assertEqual([item.details['tag'] for item in warnings], ['7f7e'])
+
+        # Position of the Identification set
+        identification = [klv for klv in mxf.data['header']['klvs'] if getattr(klv, 'set_type', None) == 'Identification']
+        self.assertEqual(warnings[0].pos, identification[0].pos)
+        self.assertEqual(warnings[0].details['tag'], '7f7e')
+
+
+class MXFParserWorkersTest(unittest.TestCase):
+    """ Verify header metadata decoding by worker threads. """
+
+    def test_workers(self):
+        """ Test workers decode the same header metadata """
+
+        mxfsample.write('workers.mxf.new', frames=4)
+        results = []
+        for workers in (None, 3):
+            mxf = parser.OP1aParser('workers.mxf.new', workers=workers)
+            mxf.read()
+            mxf.close()
+            results.append(mxf.data['header'])
+
+        sequential, parallel = results
+        self.assertEqual(len(parallel['klvs']), len(sequential['klvs']))
+        for klv, expected in zip(parallel['klvs'], sequential['klvs']):
+            self.assertEqual((klv.__class__, klv.pos, klv.length), (expected.__class__, expected.pos, expected.length))
+            if isinstance(klv, s377m.MXFDataSet):
+                self.assertEqual(klv.element_mapping, expected.element_mapping)
+                self.assertEqual([value.read() for value in klv.data.values()],
+                    [value.read() for value in expected.data.values()])
+        self.assertTrue(parallel['preface'] in parallel['klvs'])
+        self.assertTrue(parallel['primer'] in parallel['klvs'])
+
+
+class MXFParserProjectionTest(unittest.TestCase):
+    """ Verify header metadata projections. """
+
+    def setUp(self):
+        mxfsample.write('projection.mxf.new', frames=4)
+        self.full = parser.OP1aParser('projection.mxf.new')
+        self.full.read()
+        self.full.close()
+
+    def parse(self, projection, workers=None):
+        mxf = parser.OP1aParser('projection.mxf.new', workers=workers)
+        mxf.read(projection)
+        mxf.close()
+        self.assertEqual([(klv.pos, klv.length) for klv in mxf.data['header']['klvs']],
+            [(klv.pos, klv.length) for klv in self.full.data['header']['klvs']])
+        self.assertEqual(mxf.edit_unit_count(), 4)
+        return mxf
+
+    def test_set_types(self):
+        """ Test sets not projected are skipped """
+
+        for workers in (None, 3):
+            mxf = self.parse(['MaterialPackage', 'Preface'], workers)
+            # KLV Fill behind the Header Partition Pack is read with it
+            kept = [klv for klv in mxf.data['header']['klvs'][1:] if not isinstance(klv, s377m.KLVSkipped)]
+            self.assertEqual([klv.__class__ for klv in kept], [s377m.MXFPrimer, s377m.MXFPreface, s377m.MXFDataSet])
+            self.assertEqual(kept[2].set_type, 'MaterialPackage')
+            self.assertTrue(mxf.data['header']['preface'] is kept[1])
+
+            expected = [klv for klv in self.full.data['header']['klvs'] if klv.pos == kept[2].pos][0]
+            self.assertEqual(kept[2].element_mapping, expected.element_mapping)
+            self.assertEqual(kept[2].get_element('tracks').read(), expected.get_element('tracks').read())
+
+    def test_elements(self):
+        """ Test only projected elements of kept sets are decoded """
+
+        mxf = self.parse({'SourcePackage': ['package_id'], None: ['tracks']})
+        for klv in mxf.data['header']['klvs']:
+            if isinstance(klv, s377m.MXFDataSet) and klv.set_type == 'SourcePackage':
+                self.assertEqual(sorted(klv.element_mapping.keys()), ['guid', 'package_id'])
+            elif isinstance(klv, s377m.MXFDataSet) and klv.set_type == 'MaterialPackage':
+                self.assertEqual(sorted(klv.element_mapping.keys()), ['guid', 'tracks'])
+                self.assertEqual(len(klv.data), 2)
+            elif isinstance(klv, s377m.MXFDataSet):
+                self.assertTrue(klv.get_element('package_id') is None)
+
+class AvidParserWriteTest(unittest.TestCase):
+    """ Verify files are rewritten with their body copied as is. """
+
+    def essence(self, filename):
+        mxf = parser.OP1aParser(filename)
+        mxf.read()
+        mxf.close()
+
+        fdesc = open(filename, 'rb')
+        ret = []
+        for entry in mxf.data['essence']:
+            fdesc.seek(entry['pos'])
+            ret.append(fdesc.read(entry['length']))
+        fdesc.close()
+        return mxf, ret
+
+    def test_write(self):
+        """ Test rewrite to another file and in place """
+
+        mxfsample.write('rewrite.mxf.new', frames=4, partitions=2, run_in='\x00' * 10)
+        _, expected = self.essence('rewrite.mxf.new')
+
+        mxf = parser.AvidParser('rewrite.mxf.new')
+        mxf.read()
+        mxf.close()
+        fills = [klv for klv in mxf.data['header']['klvs'] if isinstance(klv, s377m.KLVFill)]
+        self.assertTrue(fills and not [klv for klv in fills if klv.source is None])
+        mxf.write('rewritten.mxf.new')
+
+        written, essence = self.essence('rewritten.mxf.new')
+        self.assertEqual(essence, expected)
+        self.assertEqual(written.run_in, 10)
+
+        # Partition packs linkage follows the new layout
+        offsets = [written.partition_offset(item.pos) for item in written.data['partitions']]
+        self.assertEqual([item.data['this_partition'] for item in written.data['partitions']], offsets)
+        self.assertEqual([item.data['previous_partition'] for item in written.data['partitions']], [0] + offsets[:-1])
+        self.assertEqual(written.data['header']['partition'].data['footer_partition'], offsets[-1])
+        self.assertEqual([item['byte_offset'] for item in written.data['footer']['random_index_pack'].data['partition']], offsets)
+
+        # Byte counts follow re-serialised header metadata and index segments
+        findings = validator.Validator('rewritten.mxf.new').run()
+        self.assertEqual([item.details['check'] for item in findings], [])
+
+        mxf = parser.AvidParser('rewrite.mxf.new')
+        mxf.read()
+        mxf.close()
+        mxf.write()
+        self.assertEqual(open('rewrite.mxf.new', 'rb').read(), open('rewritten.mxf.new', 'rb').read())
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(MXFParserIndexTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(MXFParserRunInTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(OperationalPatternRegistryTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(MXFParserGrowingFileTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(MXFParserDiagnosticsTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(MXFParserWorkersTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(MXFParserProjectionTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(AvidParserWriteTest))
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
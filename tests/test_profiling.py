@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for parsing statistics. """
+
+import sys
+import struct
+import unittest
+
+from sjmxf import parser, s377m, rp210types
+import mxfsample
+
+
+class ParseStatisticsTest(unittest.TestCase):
+    """ Verify opt-in parsing instrumentation. """
+
+    def test_stats(self):
+        """ Test counters collected during a full parse """
+
+        mxfsample.write('stats.mxf.new', frames=4)
+
+        events = []
+        mxf = parser.OP1aParser('stats.mxf.new')
+        self.assertEqual(mxf.stats(), None)
+        mxf.enable_stats(lambda *args: events.append(args))
+        mxf.read()
+        mxf.disable_stats()
+        mxf.close()
+
+        stats = mxf.stats()
+        self.assertTrue(stats['bytes_read'] > 0)
+        self.assertTrue(stats['seeks'] > 0)
+        self.assertEqual(stats['klvs']['MXFPartition'], 3)
+        self.assertEqual(stats['klvs']['MXFPrimer'], 1)
+        self.assertEqual(stats['klvs']['MXFIndexTableSegment'], 1)
+        self.assertTrue(stats['klvs']['MXFDataSet'] > 10)
+        self.assertTrue(stats['time']['MXFPrimer.read'] >= 0)
+        self.assertTrue(stats['converters'])
+        self.assertEqual(stats['primer_misses'], 0)
+        self.assertEqual(len(events), sum(stats['klvs'].values()))
+        self.assertEqual(events[0][0:3], ('MXFPartition', 'read', 0))
+
+    def test_misses(self):
+        """ Test local tags missing from the Primer or RP210 are counted """
+
+        data, _ = mxfsample.build(frames=2)
+        # Company name tag missing from the Primer, product name mapped to an unknown UL
+        tag = '\x3c\x01' + struct.pack('>H', len(u'SmartJog'.encode('utf_16_be')))
+        data = data.replace(tag, '\x7f\x7e' + tag[2:])
+        pos = data.index('\x3c\x02\x06\x0e\x2b\x34') + 2
+        data = data[:pos] + '\x06\x0e\x2b\x34' + '\x7f' * 12 + data[pos + 16:]
+        fdesc = open('stats.mxf.new', 'wb')
+        fdesc.write(data)
+        fdesc.close()
+
+        mxf = parser.OP1aParser('stats.mxf.new')
+        mxf.enable_stats()
+        mxf.read()
+        mxf.disable_stats()
+        mxf.close()
+        self.assertEqual(mxf.stats()['primer_misses'], 1)
+        self.assertEqual(mxf.stats()['rp210_misses'], 1)
+
+    def test_converters(self):
+        """ Test converters are counted once per decoded value """
+
+        mxfsample.write('stats.mxf.new', frames=2)
+        mxf = parser.OP1aParser('stats.mxf.new')
+        mxf.enable_stats()
+        mxf.read()
+        mxf.disable_stats()
+        mxf.close()
+
+        values = {}
+        for klv in mxf.data['header']['klvs']:
+            if isinstance(klv, s377m.MXFDataSet):
+                for value in klv.data.values():
+                    name = value.__class__.__name__
+                    values[name] = values.get(name, 0) + 1
+        self.assertEqual(mxf.stats()['converters'], values)
+
+    def test_scope(self):
+        """ Test only the parser collecting statistics is instrumented """
+
+        read = s377m.MXFPrimer.__dict__['read']
+        init = rp210types.Converter.__dict__['__init__']
+
+        mxfsample.write('stats.mxf.new', frames=2)
+        first = parser.OP1aParser('stats.mxf.new')
+        second = parser.OP1aParser('stats.mxf.new')
+        first.enable_stats()
+        self.assertEqual(s377m.MXFPrimer.__dict__['read'], read)
+        self.assertEqual(rp210types.Converter.__dict__['__init__'], init)
+
+        second.read()
+        second.close()
+        self.assertEqual(first.stats()['klvs'], {})
+        self.assertFalse('read' in second.data['header']['primer'].__dict__)
+
+        first.read()
+        first.close()
+        self.assertTrue(first.stats()['klvs'])
+
+        # Fill values are still loaded on access
+        fills = [klv for klv in first.data['header']['klvs'] if isinstance(klv, s377m.KLVFill)]
+        self.assertTrue(fills[0].source)
+        self.assertEqual(fills[0].data, '\x00' * fills[0].length)
+
+    def test_disabled(self):
+        """ Test instrumented KLVs are not accounted once disabled """
+
+        mxfsample.write('stats.mxf.new', frames=2)
+        mxf = parser.OP1aParser('stats.mxf.new')
+        mxf.enable_stats()
+        mxf.read()
+        mxf.close()
+        mxf.disable_stats()
+
+        counters = mxf.stats()
+        mxf.read()
+        mxf.close()
+        self.assertEqual(mxf.stats(), counters)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(ParseStatisticsTest))
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
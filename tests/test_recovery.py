@@ -0,0 +1,91 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for the recovery scanner. """
+
+import sys
+import unittest
+
+from sjmxf import recovery
+from sjmxf.s377m import RandomIndexMetadata
+import mxfsample
+
+
+def write(filename, data):
+    fdesc = open(filename, 'wb')
+    fdesc.write(data)
+    fdesc.close()
+
+
+class RecoveryScannerTest(unittest.TestCase):
+    """ Verify recoverable ranges and rebuilt partition tables. """
+
+    def test_intact(self):
+        """ Test a well formed file is a single range """
+
+        data, info = mxfsample.build(frames=6, partitions=2, run_in='\x00' * 10)
+        write('intact.mxf.new', data)
+
+        scanner = recovery.RecoveryScanner('intact.mxf.new')
+        self.assertEqual(scanner.scan(), [(10, len(data))])
+        self.assertEqual(scanner.run_in, 10)
+        self.assertEqual(scanner.damaged(), [])
+        self.assertEqual(scanner.truncated, None)
+        self.assertEqual(scanner.random_index_pack_pos, len(data) - (16 + 5 + 4 * 12 + 4))
+        self.assertEqual(scanner.partition_table(),
+            [(0, 0)] + [(offset, 1) for offset in info['partitions']] + [(info['footer'], 0)])
+
+    def test_damaged(self):
+        """ Test resynchronisation behind damaged KLV headers """
+
+        data, info = mxfsample.build(frames=9, partitions=3)
+        # Lose the second body partition pack and the first essence element of the third
+        lost = info['partitions'][1]
+        damaged = info['essence'][6]
+        data = data[:lost] + 'x' * 40 + data[lost + 40:damaged] + '\xff' * 20 + data[damaged + 20:]
+        write('damaged.mxf.new', data)
+
+        diagnostics = []
+        scanner = recovery.RecoveryScanner('damaged.mxf.new')
+        scanner.diagnostics.subscribe(diagnostics.append)
+        ranges = scanner.scan()
+
+        self.assertEqual(len(ranges), 3)
+        self.assertEqual(ranges[0], (0, lost))
+        self.assertTrue(lost < ranges[1][0] <= info['essence'][3])
+        self.assertEqual(ranges[1][1], damaged)
+        self.assertTrue(damaged < ranges[2][0] <= info['essence'][7])
+        self.assertEqual(ranges[2][1], len(data))
+        self.assertEqual(scanner.damaged(), [(lost, ranges[1][0]), (damaged, ranges[2][0])])
+        self.assertEqual([item.details['check'] for item in diagnostics], ['damaged', 'damaged'])
+
+        offsets = [0, info['partitions'][0], info['partitions'][2], info['footer']]
+        self.assertEqual([offset for offset, _ in scanner.partition_table()], offsets)
+
+        # Rebuilt Random Index Pack lists the partitions found
+        write('damaged.rip.new', scanner.random_index_pack())
+        fdesc = open('damaged.rip.new', 'rb')
+        rip = RandomIndexMetadata(fdesc)
+        rip.read()
+        fdesc.close()
+        self.assertEqual([item['byte_offset'] for item in rip.data['partition']], offsets)
+        self.assertEqual([item['body_sid'] for item in rip.data['partition']], [0, 1, 1, 0])
+
+    def test_truncated(self):
+        """ Test a file cut inside an essence element """
+
+        data, info = mxfsample.build(frames=5, footer=False)
+        cut = info['essence'][3]
+        write('truncated.mxf.new', data[:cut + 30])
+
+        scanner = recovery.RecoveryScanner('truncated.mxf.new')
+        self.assertEqual(scanner.scan(), [(0, cut)])
+        self.assertEqual(scanner.truncated, cut)
+        self.assertEqual(scanner.damaged(), [(cut, cut + 30)])
+        self.assertEqual(scanner.partition_table(), [(0, 0), (info['partitions'][0], 1)])
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(RecoveryScannerTest)
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
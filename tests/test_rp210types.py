@@ -60,6 +60,8 @@ class RP210TypesSymetricTest(unittest.TestCase):
             cvalue = conv.Version(conv.Version(value, vtype).write(), vtype).read()
             self.assertEqual(value, cvalue)
 
+        self.assertRaises(conv.RP210TypesException, conv.Version('\x00\x01', 'ProductVersion').read)
+
     def test_timestamp(self):
         """ Test TimeStamp conversion methods. """
 
@@ -5,6 +5,7 @@
 
 import os
 import sys
+import struct
 import unittest
 
 from sjmxf import s377m
@@ -64,6 +65,21 @@ class S377MSymetricTest(unittest.TestCase):
         data_read, data_write = read_and_write('klvfill', s377m.KLVDarkComponent)
         self.assertEqual(data_read, data_write)
 
+    def test_klv_fill_source(self):
+        """ Test KLVFill values are loaded on access """
+        source_file = os.path.sep.join([os.path.dirname(sys.argv[0]), 'data', 'klvfill.raw'])
+        klv = load_klv('klvfill', s377m.KLVFill)
+        self.assertEqual(klv.source[1], 16 + klv.bytes_num)
+        self.assertEqual(klv.data, open(source_file, 'r').read()[16 + klv.bytes_num:])
+
+        # Modified values are written from memory
+        klv.data = 'fill'
+        klv.fdesc = open('klvfill-modified.new', 'w')
+        klv.write()
+        klv.fdesc.close()
+        self.assertEqual(klv.source, None)
+        self.assertEqual(open('klvfill-modified.new', 'r').read()[-5:], '\x04fill')
+
     def test_partition(self):
         """ Test MXFPartition """
         data_read, data_write = read_and_write('header_partition', s377m.MXFPartition)
@@ -87,6 +103,28 @@ class S377MSymetricTest(unittest.TestCase):
         data_read, data_write = read_and_write('dataset', s377m.MXFDataSet, primer)
         self.assertEqual(data_read, data_write)
 
+    def test_dataset_projection(self):
+        """ Test sets read with an element projection cannot be written """
+        primer = load_klv('primer', s377m.MXFPrimer)
+        dataset = load_klv('dataset', s377m.MXFDataSet, primer, elements=frozenset(['instance_uid']))
+        self.assertEqual(dataset.data.keys(), ['\x3c\x0a'])
+
+        dataset.fdesc = open('dataset.new', 'w')
+        self.assertRaises(s377m.S377MException, dataset.write)
+        dataset.fdesc.close()
+
+    def test_index_table_segment(self):
+        """ Test Index Table Segment """
+        data_read, data_write = read_and_write('index_table_segment', s377m.MXFIndexTableSegment)
+        self.assertEqual(data_read, data_write)
+
+        segment = load_klv('index_table_segment', s377m.MXFIndexTableSegment)
+        self.assertEqual(segment.data['index_edit_rate'], (25, 1))
+        self.assertEqual(segment.edit_unit_count(), 6)
+        self.assertEqual(segment.data['index_entries'][1][0:4], (0, -1, 0x33, 4000))
+        self.assertEqual(segment.stream_offset(4), 13000)
+        self.assertRaises(s377m.S377MException, segment.stream_offset, 6)
+
     def test_preface(self):
         """ Test Preface """
         primer = load_klv('primer', s377m.MXFPrimer)
@@ -94,8 +132,76 @@ class S377MSymetricTest(unittest.TestCase):
         self.assertEqual(data_read, data_write)
 
 
+class MXFPrimerDecoderTest(unittest.TestCase):
+    """ Verify compiled set decoders match generic local tag decoding. """
+
+    def setUp(self):
+        self.primer = load_klv('primer', s377m.MXFPrimer)
+        self.dataset = load_klv('dataset', s377m.MXFDataSet, self.primer)
+
+    def test_decode(self):
+        """ Test decoded values against decode_from_local_tag """
+        source_file = os.path.sep.join([os.path.dirname(sys.argv[0]), 'data', 'dataset.raw'])
+        fread = open(source_file, 'r')
+        fread.seek(self.dataset.pos + 16 + self.dataset.bytes_num)
+        data = fread.read(self.dataset.length)
+        fread.close()
+
+        offset = 0
+        while offset < len(data):
+            localtag = data[offset:offset+2]
+            size = struct.unpack('>H', data[offset+2:offset+4])[0]
+            element_name, expected = self.primer.decode_from_local_tag(localtag, data[offset+4:offset+4+size])
+            offset += size + 4
+
+            cvalue = self.dataset.data[localtag]
+            self.assertEqual(self.dataset.element_mapping[element_name], localtag)
+            self.assertEqual(type(cvalue), type(expected))
+            self.assertEqual(cvalue.read(), expected.read())
+
+    def test_unknown_tag(self):
+        """ Test tags missing from the Primer fall back to hex strings """
+        decode = self.primer.decoder(self.dataset.key)
+        self.assertEqual(decode('\x7f\x7e\x00\x02\xab\xcd'), ({'7f7e': '\x7f\x7e'}, [('\x7f\x7e', 'abcd')]))
+
+    def test_cache(self):
+        """ Test decoders are compiled once per set type and Primer """
+        decode = self.primer.decoder(self.dataset.key)
+        self.assertTrue(self.primer.decoder(self.dataset.key) is decode)
+        self.assertFalse(self.primer.decoder('\x00' * 16) is decode)
+
+        self.primer.inject(['7f7e'])
+        self.assertFalse(self.primer.decoder(self.dataset.key) is decode)
+
+    def test_customize(self):
+        """ Test customized Primers are shared and leave the spec untouched """
+        from sjmxf.common import Singleton
+        from sjmxf.rp210 import RP210, RP210Exception
+
+        spec = Singleton(RP210)
+        mappings = {'7f7e': ('UInt16', 'Test Element', '')}
+        aprim = s377m.MXFPrimer.customize(self.primer, spec, mappings)
+        self.assertTrue(s377m.MXFPrimer.customize(self.primer, spec, dict(mappings)) is aprim)
+        self.assertFalse('00000000000000000000000000007f7e' in spec.data)
+        self.assertEqual(aprim.decode_from_local_tag('\x7f\x7e', '\x00\x2a')[1].read(), 42)
+        self.assertRaises(RP210Exception, spec.inject, mappings)
+
+    def test_layout(self):
+        """ Test sets of the same layout share their element mapping """
+        dataset = load_klv('dataset', s377m.MXFDataSet, self.primer)
+        self.assertTrue(dataset.element_mapping is self.dataset.element_mapping)
+        self.assertEqual(dataset.data.keys(), self.dataset.data.keys())
+
+        element_name = self.dataset.element_mapping.keys()[0]
+        self.assertTrue(dataset.rm_element(element_name))
+        self.assertFalse(element_name in dataset.element_mapping)
+        self.assertTrue(element_name in self.dataset.element_mapping)
+
+
 if __name__ == '__main__':
-    SUITE = unittest.TestLoader().loadTestsFromTestCase(S377MSymetricTest)
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(S377MSymetricTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(MXFPrimerDecoderTest))
     RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
     sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
 
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for the OP-Atom splitter. """
+
+import sys
+import struct
+import unittest
+
+from sjmxf import parser, splitter
+from sjmxf.s377m import MXFDataSet, S377MException
+from sjmxf.validator import Validator
+import mxfsample
+
+
+class OPAtomSplitterTest(unittest.TestCase):
+    """ Verify OP-Atom files written from an OP1a file. """
+
+    def setUp(self):
+        self.data, self.info = mxfsample.build(frames=10, partitions=2)
+        self.mxf = self.parse(self.data)
+
+    def parse(self, data):
+        """ Returns a parser of @data header metadata. """
+
+        fdesc = open('split.mxf.new', 'wb')
+        fdesc.write(data)
+        fdesc.close()
+
+        mxf = parser.OP1aParser('split.mxf.new')
+        mxf.open()
+        mxf.header_partition_parse()
+        mxf.header_metadata_parse()
+        mxf.close()
+        return mxf
+
+    def test_split(self):
+        """ Test each track is written with its essence, index and header metadata """
+
+        # Small batches to interleave writes
+        outputs = splitter.OPAtomSplitter(self.mxf, pattern='%(base)s.%(track_id)d.new', chunk_size=5000).run()
+        self.assertEqual(outputs, {
+            mxfsample.PICTURE_TRACK_NUMBER: 'split.mxf.2.new',
+            mxfsample.SOUND_TRACK_NUMBER: 'split.mxf.3.new',
+        })
+
+        for track_number, filename in outputs.items():
+            self.assertEqual(Validator(filename).run(), [])
+
+            atom = parser.OP1aParser(filename)
+            atom.read()
+            self.assertEqual(atom.data['header']['preface'].get_element('operational_pattern_universal_label').read().encode('hex_codec'),
+                splitter.OP_ATOM_LABEL)
+
+            sets = [klv for klv in atom.data['header']['klvs'] if isinstance(klv, MXFDataSet)]
+            sources = [klv for klv in sets if klv.set_type == 'SourcePackage']
+            self.assertEqual(len(sources), 1)
+            self.assertEqual(len(sources[0].get_element('tracks').read()), 1)
+            self.assertEqual(len([klv for klv in sets if klv.set_type == 'MultipleDescriptor']), 0)
+            material = [klv for klv in sets if klv.set_type == 'MaterialPackage'][0]
+            # Timecode and essence tracks
+            self.assertEqual(len(material.get_element('tracks').read()), 2)
+            clips = [klv for klv in sets if klv.set_type == 'SourceClip' and klv.get_element('source_track_id').read()]
+            self.assertEqual([klv.get_element('source_id').read() for klv in clips], [sources[0].get_element('package_id').read()])
+
+            # Essence elements in order with their index
+            self.assertEqual(atom.edit_unit_count(), 10)
+            reader = atom.essence()
+            reader.open()
+            payloads = [str(frame.payload) for frame in reader.frames(track_number)]
+            reader.close()
+            if track_number == mxfsample.PICTURE_TRACK_NUMBER:
+                self.assertEqual(payloads, [mxfsample.picture(frame) for frame in range(10)])
+                flags = [entry[2] for entry in atom.data['index'][0].data['index_entries'][0:4]]
+                self.assertEqual(flags, [0xc0, 0x33, 0x33, 0x22])
+            else:
+                self.assertEqual(payloads, [mxfsample.sound(frame) for frame in range(10)])
+                self.assertTrue(atom.data['index'][0].data['edit_unit_byte_count'])
+            atom.close()
+
+        # Output package UMIDs differ
+        umids = set()
+        for filename in outputs.values():
+            atom = parser.OP1aParser(filename)
+            atom.read()
+            atom.close()
+            umids.add([klv for klv in atom.data['header']['klvs'] if isinstance(klv, MXFDataSet) and
+                klv.set_type == 'SourcePackage'][0].get_element('package_id').read())
+        self.assertEqual(len(umids), 2)
+
+    def test_header_essence(self):
+        """ Test essence of the Header Partition is split """
+
+        data, info = mxfsample.build(frames=4, partitions=1)
+        # Header Partition BodySID, body partition pack turned into fill
+        data = data[:21 + 60] + struct.pack('>I', 1) + data[21 + 64:]
+        pos = info['partitions'][0]
+        data = data[:pos] + mxfsample.FILL_KEY + data[pos + 16:]
+
+        outputs = splitter.OPAtomSplitter(self.parse(data), pattern='%(base)s.%(track_id)d.new').run()
+        atom = parser.OP1aParser(outputs[mxfsample.PICTURE_TRACK_NUMBER])
+        atom.read()
+        reader = atom.essence()
+        reader.open()
+        payloads = [str(frame.payload) for frame in reader.frames(mxfsample.PICTURE_TRACK_NUMBER)]
+        reader.close()
+        atom.close()
+        self.assertEqual(payloads, [mxfsample.picture(frame) for frame in range(4)])
+
+    def test_clip_wrapped(self):
+        """ Test clip wrapped tracks are refused """
+
+        self.assertFalse(splitter.clip_wrapped(mxfsample.ESSENCE_CONTAINER_LABEL))
+        for label in ('060e2b34040101020d01030102046002', '060e2b34040101010d01030102060200',
+            '060e2b34040101070d010301020c0200'):
+            self.assertTrue(splitter.clip_wrapped(label.decode('hex_codec')))
+
+        label = '060e2b34040101020d01030102046002'.decode('hex_codec')
+        data = self.data.replace(mxfsample.ESSENCE_CONTAINER_LABEL, label)
+        self.assertRaises(S377MException, splitter.OPAtomSplitter(self.parse(data)).plan)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestLoader().loadTestsFromTestCase(OPAtomSplitterTest)
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
@@ -0,0 +1,108 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for timecode addressing. """
+
+import sys
+import unittest
+
+from sjmxf import parser, timecode, s377m
+import mxfsample
+
+
+class TimecodeTest(unittest.TestCase):
+    """ Verify SMPTE 12M timecode arithmetic. """
+
+    def test_non_drop_frame(self):
+        """ Test non drop frame conversions """
+        tc = timecode.Timecode(25)
+        self.assertEqual(tc.to_frames('10:00:00:00'), 900000)
+        self.assertEqual(tc.to_frames((0, 1, 0, 24)), 1524)
+        self.assertEqual(tc.to_timecode(900001), '10:00:00:01')
+        self.assertRaises(ValueError, tc.to_frames, '00:00:00:25')
+
+    def test_drop_frame(self):
+        """ Test drop frame conversions """
+        tc = timecode.Timecode(30, drop_frame=True)
+        self.assertEqual(tc.to_frames('00:00:59;29'), 1799)
+        self.assertEqual(tc.to_frames('00:01:00;02'), 1800)
+        self.assertEqual(tc.to_frames('00:10:00;00'), 17982)
+        self.assertEqual(tc.to_frames('01:00:00;00'), 107892)
+        self.assertRaises(ValueError, tc.to_frames, '00:01:00;00')
+
+        for count in range(0, 40000, 7):
+            self.assertEqual(tc.to_frames(tc.to_timecode(count)), count)
+
+        # No drop frame counting but for 30 and 60 timebases
+        self.assertRaises(ValueError, timecode.Timecode, 25, True)
+        self.assertEqual(timecode.Timecode(60, True).to_frames('00:01:00;04'), 3600)
+
+
+class TimecodeIndexTest(unittest.TestCase):
+    """ Verify timecode to byte range mapping. """
+
+    def test_byte_ranges(self):
+        """ Test EDL events conversion """
+
+        info = mxfsample.write('timecode.mxf.new', frames=10, partitions=2)
+        mxf = parser.OP1aParser('timecode.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        index = timecode.TimecodeIndex(mxf)
+        self.assertEqual((index.start, index.timecode.base, index.timecode.drop_frame), (900000, 25, False))
+        self.assertEqual(index.edit_unit('10:00:00:04'), 4)
+        self.assertEqual(index.edit_unit_timecode(9), '10:00:00:09')
+
+        end = mxf.data['essence'][-1]['pos'] + mxf.data['essence'][-1]['length']
+        self.assertEqual(index.byte_ranges([
+            ('10:00:00:03', '10:00:00:07'),
+            ('10:00:00:00', '10:00:00:03'),
+            ('10:00:00:07', '10:00:00:10'),
+        ]), [
+            (info['essence'][3], info['essence'][7]),
+            (info['essence'][0], info['essence'][3]),
+            (info['essence'][7], end),
+        ])
+        self.assertRaises(s377m.S377MException, index.byte_range, '09:59:59:24', '10:00:00:01')
+
+    def test_drop_frame(self):
+        """ Test drop frame timecode track """
+
+        mxfsample.write('timecode.mxf.new', frames=4, start_timecode=17980, drop_frame=True, rate=(30000, 1001))
+        mxf = parser.OP1aParser('timecode.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        index = timecode.TimecodeIndex(mxf)
+        self.assertEqual(index.edit_rate, (30000, 1001))
+        self.assertEqual(index.edit_unit_timecode(0), '00:09:59;28')
+        self.assertEqual(index.edit_units(['00:09:59;29', '00:10:00;00', '00:10:00;01']), [1, 2, 3])
+
+    def test_edit_rate(self):
+        """ Test edit rates multiple of the timecode base """
+
+        info = mxfsample.write('timecode.mxf.new', frames=10, rate=(50, 1), timecode_base=25)
+        mxf = parser.OP1aParser('timecode.mxf.new')
+        mxf.read()
+        mxf.close()
+
+        index = timecode.TimecodeIndex(mxf)
+        self.assertEqual(index.scale, 2)
+        self.assertEqual(index.edit_unit('10:00:00:02'), 4)
+        self.assertEqual(index.edit_unit_timecode(5), '10:00:00:02')
+        self.assertEqual(index.byte_range('10:00:00:01', '10:00:00:03'), (info['essence'][2], info['essence'][6]))
+
+        mxfsample.write('timecode.mxf.new', frames=4, rate=(25, 1), timecode_base=30)
+        mxf = parser.OP1aParser('timecode.mxf.new')
+        mxf.read()
+        mxf.close()
+        self.assertRaises(s377m.S377MException, timecode.TimecodeIndex, mxf)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(TimecodeTest))
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(TimecodeIndexTest))
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)
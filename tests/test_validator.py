@@ -0,0 +1,104 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+""" Unit tests for the conformance validator. """
+
+import sys
+import struct
+import unittest
+
+from sjmxf import validator
+import mxfsample
+
+
+def validate(data):
+    """ Returns (check, position) of findings on @data. """
+
+    fdesc = open('validator.mxf.new', 'wb')
+    fdesc.write(data)
+    fdesc.close()
+
+    findings = validator.Validator('validator.mxf.new').run()
+    return [(item.details['check'], item.pos) for item in findings]
+
+
+def patch(data, pos, value):
+    return data[:pos] + value + data[pos + len(value):]
+
+
+class ValidatorTest(unittest.TestCase):
+    """ Verify findings on altered files. """
+
+    def setUp(self):
+        self.data, self.info = mxfsample.build(frames=6, partitions=2)
+
+    def test_valid(self):
+        """ Test a valid file has no findings """
+        self.assertEqual(validate(self.data), [])
+        data, _ = mxfsample.build(frames=4, index='cbr', run_in='\x00' * 10)
+        self.assertEqual(validate(data), [])
+
+    def test_partition_linkage(self):
+        """ Test PreviousPartition and FooterPartition chains """
+
+        # Value starts behind key and 5 bytes BER
+        pos = self.info['partitions'][1]
+        data = patch(self.data, pos + 21 + 16, struct.pack('>Q', 1))
+        data = patch(data, 21 + 24, struct.pack('>Q', 2))
+        self.assertEqual(validate(data), [
+            ('partition_linkage', pos),
+            ('partition_linkage', 0),
+        ])
+
+    def test_byte_counts(self):
+        """ Test HeaderByteCount and IndexByteCount """
+
+        data = patch(self.data, 21 + 32, struct.pack('>Q', 100))
+        data = patch(data, self.info['footer'] + 21 + 40, struct.pack('>Q', 1))
+        self.assertEqual(validate(data), [
+            ('header_byte_count', 0),
+            ('index_byte_count', self.info['footer']),
+        ])
+
+    def test_random_index_pack(self):
+        """ Test Random Index Pack entries match partitions """
+
+        rip = len(self.data) - 4 - 12 * 4 - 21
+        data = patch(self.data, rip + 21 + 12, struct.pack('>IQ', 2, self.info['partitions'][0]))
+        self.assertEqual(validate(data), [
+            ('random_index_pack', rip),
+            ('random_index_pack', rip),
+        ])
+
+    def test_kag(self):
+        """ Test KAG alignment of header metadata """
+
+        data = patch(self.data, 21 + 4, struct.pack('>I', 512))
+        self.assertEqual(validate(data), [('kag', self.info['header_end'] - len(mxfsample.header_metadata(6)))])
+
+    def test_strong_reference(self):
+        """ Test dangling strong references """
+
+        instance = '\x3c\x0a\x00\x10' + mxfsample.uid(41)
+        pos = self.data.index(instance)
+        data = patch(self.data, pos, '\x3c\x0a\x00\x10' + mxfsample.uid(99))
+        findings = validate(data)
+        self.assertEqual(len(findings), 1)
+        self.assertEqual(findings[0][0], 'strong_reference')
+        self.assertTrue(findings[0][1] < self.info['header_end'])
+
+    def test_partition_status(self):
+        """ Test an invalid partition status is reported, not raised """
+
+        pos = self.info['partitions'][1]
+        data = patch(self.data, pos + 14, '\x07')
+        findings = validate(data)
+        self.assertEqual(findings[0], ('partition_pack', pos))
+        self.assertTrue(('random_index_pack', len(self.data) - 4 - 12 * 4 - 21) in findings)
+
+
+if __name__ == '__main__':
+    SUITE = unittest.TestSuite()
+    SUITE.addTest(unittest.TestLoader().loadTestsFromTestCase(ValidatorTest))
+    RESULT = unittest.TextTestRunner(verbosity=2).run(SUITE)
+    sys.exit(len(RESULT.errors) + len(RESULT.failures) > 0)